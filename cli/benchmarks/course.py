@@ -0,0 +1,284 @@
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+
+from pathlib import Path
+
+
+# Synthetic courses are generated deterministically, so results of different commits can be
+# compared as long as the course parameters are the same.
+
+COURSE_VERSION = 1
+
+# Tasks are grouped into lessons of this size, every third task is written in Go.
+TASKS_PER_LESSON = 10
+GO_TASK_PERIOD = 3
+
+CPP_PROFILES = ["release", "asan", "debug"]
+CPP_FILLER_EXTENSIONS = [".txt", ".h", ".cpp", ".md"]
+
+# A quarter of the build files goes to the tool cache in `.cache`.
+TOOL_CACHE_SHARE = 4
+BUILD_FILE_CONTENT = b"\x7fELF" + b"\0" * 252
+
+GIT_IDENTITY = ["-c", "user.name=Benchmark", "-c", "user.email=benchmark@example.com"]
+
+# External tools are replaced with these scripts, so the benchmarks run offline and measure the cli
+# only.
+CMAKE_STUB = """#!/bin/sh
+# Leaves the files the cli expects in the build directory.
+while [ $# -gt 0 ]; do
+  if [ "$1" = "-B" ]; then
+    mkdir -p "$2" && echo '[]' > "$2/compile_commands.json" && touch "$2/build.ninja"
+  fi
+  shift
+done
+"""
+NOOP_STUB = "#!/bin/sh\nexit 0\n"
+STUBBED_TOOLS = ["ninja", "gdb", "clangd", "clang-format", "clang-tidy", "go", "gofmt"]
+
+CONFIG = """cpp_default_profile: release
+
+gitlab_url: https://gitlab.example.com
+course_public_repo: public.git
+course_students_group: benchmark/students
+manytask_url: https://manytask.example.com
+
+exclude_patterns:
+  - "build*"
+  - "*private*"
+  - "compile_commands.json"
+  - ".*"
+
+include_patterns:
+  - ".gitignore"
+  - ".clang-format"
+  - ".task.yml"
+"""
+
+GITIGNORE = "build/\n.cache/\n.idea/\n.vscode/\ncompile_commands.json\n"
+
+CPP_TASK = """cpp_targets:
+  {name}_test:
+    timeout: 10s
+    profiles:
+{profiles}
+cpp_lint_files:
+  - test.cpp
+cpp_lint_profiles:
+  - release
+submit_files:
+  - solution.hpp
+"""
+
+GO_TASK = """go_targets:
+  example.com/course/{directory}:
+    timeout: 10s
+submit_files:
+  - solution.go
+"""
+
+CPP_SOLUTION = """#pragma once
+
+inline int Solve(int value) {{
+    // SOLUTION BEGIN
+    return value * {index};
+    // SOLUTION END
+}}
+"""
+
+CPP_TEST = """#include "solution.hpp"
+
+#include <cassert>
+
+int main() {{
+    assert(Solve(1) == {index});
+    // PRIVATE BEGIN
+    assert(Solve(2) == {index} * 2);
+    // PRIVATE END
+}}
+"""
+
+GO_SOLUTION = """package task{index:04}
+
+func Solve(value int) int {{
+	// SOLUTION BEGIN
+	return value * {index}
+	// SOLUTION END
+}}
+"""
+
+GO_TEST = """package task{index:04}
+
+import "testing"
+
+func TestSolve(t *testing.T) {{
+	if Solve(1) != {index} {{
+		t.Fail()
+	}}
+}}
+"""
+
+CLION_WORKSPACE = '<?xml version="1.0" encoding="UTF-8"?>\n<project version="4" />\n'
+
+
+################################################################################
+
+
+def _write(path: Path, content: str | bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if isinstance(content, str):
+        path.write_text(content)
+    else:
+        path.write_bytes(content)
+
+
+def _write_executable(path: Path, content: str):
+    _write(path, content)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def _git(course_directory: Path, *args: str):
+    subprocess.run(["git", "-C", course_directory, *GIT_IDENTITY, *args],
+                   stdout=subprocess.DEVNULL, check=True)
+
+
+def _get_task_directory(index: int) -> str:
+    language = "go" if index % GO_TASK_PERIOD == GO_TASK_PERIOD - 1 else "cpp"
+    return f"{language}/lesson{index // TASKS_PER_LESSON:03}/task{index:04}"
+
+
+def _write_task(course_directory: Path, index: int, filler_files: int):
+    directory = _get_task_directory(index)
+    task_directory = course_directory / directory
+
+    if directory.startswith("go/"):
+        _write(task_directory / ".task.yml", GO_TASK.format(directory=directory))
+        _write(task_directory / "solution.go", GO_SOLUTION.format(index=index))
+        _write(task_directory / "solution_test.go", GO_TEST.format(index=index))
+        extensions = [".txt"]
+    else:
+        name = f"task{index:04}"
+        profiles = "".join(f"      - {profile}\n" for profile in CPP_PROFILES)
+        _write(task_directory / ".task.yml", CPP_TASK.format(name=name, profiles=profiles))
+        _write(task_directory / "solution.hpp", CPP_SOLUTION.format(index=index))
+        _write(task_directory / "test.cpp", CPP_TEST.format(index=index))
+        _write(task_directory / "CMakeLists.txt", f"add_catch({name}_test test.cpp)\n")
+        extensions = CPP_FILLER_EXTENSIONS
+
+    for number in range(filler_files):
+        extension = extensions[number % len(extensions)]
+        _write(task_directory / "data" / f"{number:05}{extension}",
+               f"// Data file {number} of task {index}\n" * 8)
+
+
+def _get_base_file_count(index: int) -> int:
+    return 3 if _get_task_directory(index).startswith("go/") else 4
+
+
+def _write_build_files(course_directory: Path, build_files: int):
+    cache_files = build_files // TOOL_CACHE_SHARE
+    for number in range(build_files - cache_files):
+        profile = CPP_PROFILES[number % len(CPP_PROFILES)]
+        _write(course_directory / "build" / "cpp" / profile / "CMakeFiles" /
+               f"objects{number // 1000:03}" / f"{number:06}.o", BUILD_FILE_CONTENT)
+
+    for number in range(cache_files):
+        _write(course_directory / ".cache" / "go-build" / f"{number % 256:02x}" /
+               f"{number:06}-d", BUILD_FILE_CONTENT)
+
+
+def _solve_tasks(course_directory: Path, tasks: int):
+    """Commits changes of all submit files, like a student who solved every task at once."""
+    for index in range(tasks):
+        task_directory = course_directory / _get_task_directory(index)
+        for name in ["solution.hpp", "solution.go"]:
+            path = task_directory / name
+            if path.exists():
+                path.write_text(path.read_text().replace("SOLUTION BEGIN", "SOLUTION BEGIN\n"))
+
+    _git(course_directory, "commit", "--quiet", "--all", "--message", "Solve tasks")
+
+
+################################################################################
+
+
+def get_parameters(tasks: int, files: int, build_files: int) -> dict:
+    return {
+        "version": COURSE_VERSION,
+        "tasks": tasks,
+        "files": files,
+        "build_files": build_files,
+    }
+
+
+def create_stub_tools(directory: Path):
+    """Creates stubs of the external tools and the `cli` entry point running the cli of this tree."""
+    _write_executable(directory / "cmake", CMAKE_STUB)
+    for tool in STUBBED_TOOLS:
+        _write_executable(directory / tool, NOOP_STUB)
+
+    _write_executable(directory / "cli", (
+        f"#!/bin/sh\nexec {sys.executable} -c "
+        "'import sys; sys.argv[0] = \"cli\"; import client; client.run()' \"$@\"\n"))
+
+
+def generate_course(root: Path, tasks: int, files: int, build_files: int) -> Path:
+    """
+    Generates the course repository with the given number of tasks, source files and files in
+    build and cache directories. A generated course with the same parameters is reused.
+    """
+    course_directory = root / "course"
+    parameters_path = root / "course.json"
+    parameters = get_parameters(tasks, files, build_files)
+
+    try:
+        if json.loads(parameters_path.read_text()) == parameters:
+            return course_directory
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    shutil.rmtree(course_directory, ignore_errors=True)
+    parameters_path.unlink(missing_ok=True)
+
+    _write(course_directory / "config.yml", CONFIG)
+    _write(course_directory / ".gitignore", GITIGNORE)
+    _write(course_directory / ".clang-format", "BasedOnStyle: Google\n")
+    _write(course_directory / "CMakeLists.txt", "project(course)\n")
+    _write(course_directory / "go.mod", "module example.com/course\n\ngo 1.22\n")
+    _write(course_directory / ".idea" / "workspace.xml", CLION_WORKSPACE)
+
+    base_files = sum(_get_base_file_count(index) for index in range(tasks))
+    filler_files = max(0, files - base_files)
+    for index in range(tasks):
+        _write_task(course_directory, index,
+                    filler_files // tasks + (index < filler_files % tasks))
+
+    _write_build_files(course_directory, build_files)
+
+    _git(course_directory, "init", "--quiet")
+    _git(course_directory, "add", "--all")
+    _git(course_directory, "commit", "--quiet", "--message", "Initial commit")
+    _solve_tasks(course_directory, tasks)
+
+    parameters_path.write_text(json.dumps(parameters))
+    return course_directory
+
+
+def get_environment(root: Path, course_directory: Path) -> dict[str, str]:
+    """Returns the environment of the cli installed into the course."""
+    return dict(os.environ) | {
+        "PATH": f"{root / 'stubs'}{os.pathsep}{os.environ.get('PATH', '')}",
+        "PYTHONPATH": str(Path(__file__).resolve().parent.parent / "src"),
+        "SYSTEM": os.environ.get("SYSTEM", "x86_64-linux"),
+        "CONFIG_PATH": str(course_directory / "config.yml"),
+        "VERSION_BUILD": "0.0.0",
+        "ASAN_SYMBOLIZER_PATH": "/bin/true",
+        "TSAN_SYMBOLIZER_PATH": "/bin/true",
+        "PRIVATE": "1",
+        "CLI_NO_DAEMON": "1",
+        "CLI_OUTPUT": "plain",
+    }
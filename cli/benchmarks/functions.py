@@ -0,0 +1,89 @@
+import shutil
+import time
+
+import lib
+import private
+
+from collections.abc import Callable
+from pathlib import Path
+
+
+# Hot paths of the cli measured inside one process. It is started in the course directory with the
+# environment of the cli, see `course.get_environment`.
+
+EXPORT_SCRATCH_DIRECTORY = Path("benchmarks") / "export"
+
+
+################################################################################
+
+
+def _clear_caches():
+    """Forgets everything the cli keeps in memory, as if it was started again."""
+    for function in [lib.load_config, lib.load_task_from_dir, lib.load_all_tasks,
+                     lib.get_submit_file_tasks, lib._get_course_files]:
+        function.cache_clear()
+
+
+def _prepare_warm() -> list:
+    _clear_caches()
+    return []
+
+
+def _prepare_cold() -> list:
+    _clear_caches()
+    lib._get_cache_path("tasks").unlink(missing_ok=True)
+    return []
+
+
+def _prepare_export_transform() -> list:
+    """Copies the course files to a scratch directory, the transform changes them in place."""
+    _clear_caches()
+    course_directory = lib.get_course_directory()
+    scratch_directory = lib.get_build_directory() / EXPORT_SCRATCH_DIRECTORY
+    shutil.rmtree(scratch_directory, ignore_errors=True)
+
+    paths = []
+    for relative_path in lib._get_course_files():
+        path = scratch_directory / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(course_directory / relative_path, path)
+        paths.append(str(path))
+    return [paths]
+
+
+def _prepare_tasks_from_diff() -> list:
+    _clear_caches()
+    return [lib.get_course_directory()]
+
+
+def _get_files():
+    cpp = lib.get_module("cpp")
+    return lib.get_files(cpp.SOURCE_EXT | cpp.HEADER_EXT | lib.get_module("go").GO_EXT)
+
+
+################################################################################
+
+
+# Maps names of benchmarks to functions preparing arguments and measured functions.
+BENCHMARKS: dict[str, tuple[Callable[[], list], Callable]] = {
+    "load-all-tasks": (_prepare_warm, lib.load_all_tasks),
+    "load-all-tasks.cold": (_prepare_cold, lib.load_all_tasks),
+    "get-files": (_prepare_warm, _get_files),
+    "export-transform": (_prepare_export_transform, private._strip_private_patterns_from_files),
+    "tasks-from-diff": (_prepare_tasks_from_diff, private._try_get_tasks_from_diff),
+}
+
+
+def measure(name: str, runs: int) -> list[float]:
+    """Returns durations of the runs in seconds, the first run warms up and is not measured."""
+    prepare, function = BENCHMARKS[name]
+
+    durations = []
+    for _ in range(runs + 1):
+        args = prepare()
+        start = time.perf_counter()
+        function(*args)
+        durations.append(time.perf_counter() - start)
+
+    shutil.rmtree(lib.get_build_directory() / EXPORT_SCRATCH_DIRECTORY, ignore_errors=True)
+    return durations[1:]
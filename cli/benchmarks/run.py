@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import course
+import rich_click as click
+
+from pathlib import Path
+from rich.console import Console
+from rich.table import Table
+from rich.text import Text
+
+
+################################################################################
+
+
+RESULTS_VERSION = 1
+
+# Commands of the cli and names of caches removed before every run of the command, which measures
+# the command without its persistent cache.
+COMMAND_BENCHMARKS = {
+    "startup": (["--help"], None),
+    "list-tasks": (["list-tasks"], None),
+    "list-tasks.cold": (["list-tasks"], "tasks"),
+    "check-configs": (["check", "configs"], None),
+    "check-configs.cold": (["check", "configs"], "configs"),
+    "setup-vscode": (["setup-vscode", "--confirm"], None),
+    "setup-clion": (["setup-clion"], None),
+}
+
+# Benchmarks measured inside one process, see `functions.py`.
+FUNCTION_BENCHMARKS = [
+    "load-all-tasks",
+    "load-all-tasks.cold",
+    "get-files",
+    "export-transform",
+    "tasks-from-diff",
+]
+
+console = Console(stderr=True, highlight=False)
+
+
+################################################################################
+
+
+def _get_commit() -> dict:
+    repository = Path(__file__).resolve().parent
+    try:
+        commit = subprocess.run(["git", "-C", repository, "rev-parse", "HEAD"],
+                                capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(
+            ["git", "-C", repository, "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True, text=True, check=True).stdout
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(status)}
+
+
+def _summarize(durations: list[float]) -> dict:
+    return {
+        "median": statistics.median(durations),
+        "min": min(durations),
+        "max": max(durations),
+        "runs": durations,
+    }
+
+
+def _run_command(args: list, course_directory: Path, environment: dict):
+    result = subprocess.run(args, cwd=course_directory, env=environment,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        console.print(result.stderr)
+        console.print(f"[red bold]Benchmark command {' '.join(map(str, args))} failed")
+        sys.exit(1)
+
+
+def _measure_command(name: str, runs: int, root: Path, course_directory: Path,
+                     environment: dict) -> list[float]:
+    args, cache_name = COMMAND_BENCHMARKS[name]
+
+    durations = []
+    for _ in range(runs + 1):
+        if cache_name:
+            (course_directory / "build" / "cache" / f"{cache_name}.json").unlink(missing_ok=True)
+        start = time.perf_counter()
+        _run_command([root / "stubs" / "cli", *args], course_directory, environment)
+        durations.append(time.perf_counter() - start)
+
+    # The first run warms up the file system cache and is not measured.
+    return durations[1:]
+
+
+def _measure_function(name: str, runs: int, root: Path, course_directory: Path,
+                      environment: dict) -> list[float]:
+    output_path = root / "function.json"
+    _run_command([sys.executable, Path(__file__).resolve(), "measure", name,
+                  "--runs", str(runs), "--output", output_path], course_directory, environment)
+    return json.loads(output_path.read_text())
+
+
+def _get_benchmarks(filters: tuple[str, ...]) -> list[str]:
+    names = list(COMMAND_BENCHMARKS) + FUNCTION_BENCHMARKS
+    return [name for name in names if not filters or any(text in name for text in filters)]
+
+
+def _print_results(results: dict):
+    table = Table(title=f"Benchmarks ({results['course']['tasks']} tasks, "
+                  f"{results['course']['files']} files)")
+    table.add_column("Benchmark")
+    table.add_column("Median", justify="right")
+    table.add_column("Min", justify="right")
+    table.add_column("Max", justify="right")
+
+    for name, result in results["benchmarks"].items():
+        table.add_row(name, *(f"{result[key] * 1000:.0f} ms" for key in ["median", "min", "max"]))
+
+    console.print(table)
+
+
+################################################################################
+
+
+@click.group()
+def benchmarks():
+    """
+    Benchmarks of the cli on synthetic course repositories.
+
+    External tools are replaced with stubs, so the benchmarks run offline and measure the cli
+    itself. Results are written as JSON and can be compared between commits.
+    """
+
+
+@benchmarks.command()
+@click.option("--directory", type=click.Path(file_okay=False),
+              help="Directory to generate the course in. The course is reused by later runs with "
+              "the same parameters. A temporary directory is used by default.")
+@click.option("--tasks", default=300, show_default=True, help="Number of tasks in the course.")
+@click.option("--files", default=30000, show_default=True,
+              help="Number of files in the tasks.")
+@click.option("--build-files", default=20000, show_default=True,
+              help="Number of files in build and cache directories.")
+@click.option("--runs", default=5, show_default=True, help="Number of measured runs.")
+@click.option("-k", "--filter", "filters", multiple=True,
+              help="Run benchmarks with this substring in names. Can be used multiple times.")
+@click.option("-o", "--output", type=click.Path(dir_okay=False),
+              help="Write results to the JSON file.")
+def run(directory: str | None, tasks: int, files: int, build_files: int, runs: int,
+        filters: tuple[str, ...], output: str | None):
+    """Run benchmarks."""
+    if directory is None:
+        root = Path(tempfile.mkdtemp(prefix="cli-benchmarks-"))
+    else:
+        root = Path(directory).absolute()
+        root.mkdir(parents=True, exist_ok=True)
+
+    try:
+        start = time.perf_counter()
+        course_directory = course.generate_course(root, tasks, files, build_files)
+        course.create_stub_tools(root / "stubs")
+        console.print(f"Course is ready in {time.perf_counter() - start:.1f}s: {course_directory}")
+
+        # Results of a previous run must not be reused.
+        shutil.rmtree(course_directory / "build" / "cache", ignore_errors=True)
+        environment = course.get_environment(root, course_directory)
+
+        results = {
+            "version": RESULTS_VERSION,
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            **_get_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "course": course.get_parameters(tasks, files, build_files),
+            "benchmarks": {},
+        }
+
+        for name in _get_benchmarks(filters):
+            console.print(f"Running {name}")
+            measure = _measure_command if name in COMMAND_BENCHMARKS else _measure_function
+            durations = measure(name, runs, root, course_directory, environment)
+            results["benchmarks"][name] = _summarize(durations)
+    finally:
+        if directory is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    _print_results(results)
+
+    if output:
+        with open(output, "w") as stream:
+            json.dump(results, stream, indent=2)
+
+
+@benchmarks.command()
+@click.argument("base", type=click.Path(exists=True, dir_okay=False))
+@click.argument("new", type=click.Path(exists=True, dir_okay=False))
+@click.option("--threshold", default=10.0, show_default=True,
+              help="Fail if a median is slower by more than this percentage.")
+def compare(base: str, new: str, threshold: float):
+    """Compare results of two runs."""
+    with open(base) as stream:
+        base_results = json.load(stream)
+    with open(new) as stream:
+        new_results = json.load(stream)
+
+    if base_results["course"] != new_results["course"]:
+        console.print("[yellow bold]Results were measured on different courses: "
+                      f"{base_results['course']} and {new_results['course']}")
+
+    table = Table(title=f"{(base_results['commit'] or base)[:12]} → "
+                  f"{(new_results['commit'] or new)[:12]}")
+    table.add_column("Benchmark")
+    table.add_column("Base", justify="right")
+    table.add_column("New", justify="right")
+    table.add_column("Change", justify="right")
+
+    regressions = []
+    for name, new_result in new_results["benchmarks"].items():
+        base_result = base_results["benchmarks"].get(name)
+        if base_result is None:
+            table.add_row(name, "-", f"{new_result['median'] * 1000:.0f} ms", "-")
+            continue
+
+        change = (new_result["median"] / base_result["median"] - 1) * 100
+        if change > threshold:
+            regressions.append(name)
+            style = "red bold"
+        elif change < -threshold:
+            style = "green"
+        else:
+            style = "default"
+        table.add_row(name, f"{base_result['median'] * 1000:.0f} ms",
+                      f"{new_result['median'] * 1000:.0f} ms", Text(f"{change:+.1f}%", style=style))
+
+    console.print(table)
+
+    if regressions:
+        console.print(f"[red bold]Slower by more than {threshold:g}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+@benchmarks.command(hidden=True)
+@click.argument("name", type=click.Choice(FUNCTION_BENCHMARKS))
+@click.option("--runs", default=5)
+@click.option("--output", type=click.Path(dir_okay=False), required=True)
+def measure(name: str, runs: int, output: str):
+    """Measure a function of the cli, started by `run` in the course directory."""
+    import functions
+
+    with open(output, "w") as stream:
+        json.dump(functions.measure(name, runs), stream)
+
+
+if __name__ == "__main__":
+    benchmarks()
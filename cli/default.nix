@@ -60,6 +60,10 @@ let
     "GITLAB_API_TOKEN"
     "CI_PROJECT_NAME"
     "CI_PIPELINE_CREATED_AT"
+    "CLI_TRACE"
+    "CLI_OUTPUT"
+    "CLI_NO_DAEMON"
+    "^CI="
     "^LC_"
     "^LANG"
   ];
@@ -0,0 +1,165 @@
+import io
+import json
+import os
+import rich_click as click
+import shutil
+import sys
+import tarfile
+import time
+
+import lib
+
+from pathlib import Path
+
+
+################################################################################
+
+
+VERSION_BUILD = os.environ["VERSION_BUILD"]
+
+MANIFEST_NAME = "manifest.json"
+
+# Build directories are large and archives are made for every pipeline, so speed matters more
+# than size.
+COMPRESS_LEVEL = 1
+
+################################################################################
+
+
+def _get_source_files() -> list[Path]:
+    return list(lib.execute_for_each_module_yielding("cache_source_files"))
+
+
+def _create_manifest(paths: list[Path]) -> dict:
+    course_directory = lib.get_course_directory()
+    return {
+        "version_build": VERSION_BUILD,
+        "course_directory": str(course_directory),
+        "paths": [str(path.relative_to(course_directory)) for path in paths],
+        "files": {
+            str(path.relative_to(course_directory)): [
+                lib.get_file_hash(path), path.stat().st_mtime_ns]
+            for path in _get_source_files()
+        },
+    }
+
+
+def _restore_modification_times(files: dict[str, list]) -> int:
+    """
+    Sets modification times of files with the same content as in the snapshot to the recorded
+    ones, the other files are touched, so that only they are newer than the build outputs.
+    Returns the number of changed files.
+    """
+    course_directory = lib.get_course_directory()
+    now = time.time_ns()
+
+    changed = 0
+    for path in _get_source_files():
+        file_hash, mtime = files.get(str(path.relative_to(course_directory)), [None, None])
+        if file_hash == lib.get_file_hash(path):
+            os.utime(path, ns=(mtime, mtime))
+        else:
+            os.utime(path, ns=(now, now))
+            changed += 1
+    return changed
+
+
+def _get_snapshot_roots() -> list[Path]:
+    """Returns directories which export takes the snapshot paths from."""
+    return [lib.get_build_directory().resolve(), (lib.get_course_directory() / ".cache").resolve()]
+
+
+def _resolve_snapshot_path(path: str) -> Path | None:
+    """Returns the path of the course, or None if it points outside of the snapshot roots."""
+    resolved = (lib.get_course_directory() / path).resolve()
+    for root in _get_snapshot_roots():
+        if resolved != root and resolved.is_relative_to(root):
+            return resolved
+    return None
+
+
+def _remove_path(path: Path):
+    if path.is_symlink() or path.is_file():
+        path.unlink()
+    elif path.is_dir():
+        shutil.rmtree(path)
+
+
+################################################################################
+
+
+@click.group()
+def cache():
+    """
+    Export and import snapshots of build directories.
+
+    A snapshot contains configured and built profiles together with the codegen outputs, so a
+    fresh checkout of the course (e.g. a CI job) rebuilds only the files which differ from the
+    ones the snapshot was made from.
+    """
+
+
+@cache.command(name="export")
+@click.argument("archive", type=click.Path(dir_okay=False))
+def export_cache(archive: str):
+    """Pack build directories of the course into the archive."""
+    start = time.perf_counter()
+    course_directory = lib.get_course_directory()
+
+    paths = list(lib.execute_for_each_module_yielding("cache_paths"))
+    if not paths:
+        lib.print_error("Nothing to export, build the course first")
+        sys.exit(1)
+
+    manifest = json.dumps(_create_manifest(paths), indent=2).encode()
+    with tarfile.open(archive, "w:gz", compresslevel=COMPRESS_LEVEL) as tar:
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(manifest)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(manifest))
+
+        for path in paths:
+            tar.add(path, arcname=str(path.relative_to(course_directory)))
+
+    lib.print_success(
+        f"Exported {', '.join(str(path.relative_to(course_directory)) for path in paths)} "
+        f"to {archive} ({os.path.getsize(archive) / 2**20:.1f} MiB) "
+        f"in {time.perf_counter() - start:.1f}s")
+
+
+@cache.command(name="import")
+@click.argument("archive", type=click.Path(exists=True, dir_okay=False))
+def import_cache(archive: str):
+    """Restore build directories of the course from the archive."""
+    start = time.perf_counter()
+    course_directory = lib.get_course_directory()
+
+    with tarfile.open(archive, "r:gz") as tar:
+        manifest = json.load(tar.extractfile(MANIFEST_NAME))
+        if manifest["version_build"] != VERSION_BUILD:
+            lib.print_error(
+                "Snapshot was built by another version of the build environment.\n"
+                f"Version in snapshot {manifest['version_build']}, running {VERSION_BUILD}")
+            sys.exit(1)
+
+        invalid_paths = [path for path in manifest["paths"] if not _resolve_snapshot_path(path)]
+        if invalid_paths:
+            lib.print_error(
+                f"Snapshot contains paths outside of build directories: {', '.join(invalid_paths)}")
+            sys.exit(1)
+
+        members = [
+            member for member in tar
+            if any(Path(member.name).is_relative_to(path) for path in manifest["paths"])]
+        for path in manifest["paths"]:
+            _remove_path(_resolve_snapshot_path(path))
+
+        tar.extractall(course_directory, members=members, filter="tar")
+
+    changed = _restore_modification_times(manifest["files"])
+    lib.execute_for_each_module("import_cache", Path(manifest["course_directory"]))
+
+    lib.print_success(
+        f"Imported {', '.join(manifest['paths'])} from {archive} "
+        f"in {time.perf_counter() - start:.1f}s, "
+        f"{changed} source files differ from the snapshot")
@@ -0,0 +1,93 @@
+import json
+import os
+import signal
+import socket
+import sys
+
+from pathlib import Path
+
+
+# Only the standard library is imported here, so that forwarding a command to the daemon does not
+# pay for importing the cli itself.
+
+SOCKET_NAME = "cli.sock"
+
+# Commands which are always executed in the calling process.
+LOCAL_COMMANDS = {"daemon"}
+
+################################################################################
+
+
+def find_socket_path() -> Path | None:
+    directory = Path.cwd()
+    for directory in [directory, *directory.parents]:
+        if (directory / ".git").exists():
+            return directory / "build" / SOCKET_NAME
+    return None
+
+
+def connect(socket_path: Path) -> socket.socket:
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        # Socket paths are limited to about a hundred bytes, the relative one is usually shorter.
+        client.connect(os.path.relpath(socket_path))
+    except OSError:
+        client.close()
+        raise
+    return client
+
+
+def send_request(client: socket.socket, request: dict, fds: list[int]):
+    socket.send_fds(client, [b"\0"], fds)
+    client.sendall(json.dumps(request).encode() + b"\n")
+
+
+def forward_to_daemon() -> int | None:
+    """
+    Executes the command in the daemon of the course, if it is running. Standard streams are
+    passed to the daemon, so the output goes directly to the terminal. Returns the exit code or
+    None if the command has to be executed in this process.
+    """
+    if os.environ.get("CLI_NO_DAEMON") or LOCAL_COMMANDS.intersection(sys.argv[1:2]):
+        return None
+
+    socket_path = find_socket_path()
+    if socket_path is None or not socket_path.exists():
+        return None
+
+    try:
+        client = connect(socket_path)
+    except OSError:
+        return None
+
+    with client:
+        send_request(client, {
+            "command": "run",
+            "argv": sys.argv,
+            "cwd": os.getcwd(),
+            "env": dict(os.environ),
+        }, [0, 1, 2])
+
+        responses = client.makefile("r")
+        response = json.loads(responses.readline() or "{}")
+        if "pid" not in response:
+            # The daemon was started by another version of the cli.
+            return None
+
+        def forward_signal(signum, frame):
+            os.kill(response["pid"], signum)
+
+        for signum in [signal.SIGINT, signal.SIGTERM, signal.SIGHUP]:
+            signal.signal(signum, forward_signal)
+
+        result = json.loads(responses.readline() or '{"exit_code": 1}')
+        return result["exit_code"]
+
+
+def run():
+    exit_code = forward_to_daemon()
+    if exit_code is not None:
+        sys.exit(exit_code)
+
+    import main
+    main.main()
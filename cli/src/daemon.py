@@ -0,0 +1,295 @@
+import atexit
+import client
+import importlib
+import json
+import os
+import rich_click as click
+import shutil
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import lib
+
+from pathlib import Path
+
+
+################################################################################
+
+
+# The daemon exits after this many seconds without requests.
+IDLE_TIMEOUT = 3 * 60 * 60
+
+# Variables read when modules are imported. Requests with other values are executed by the
+# client itself.
+FROZEN_ENVIRONMENT = [
+    "PATH",
+    "SYSTEM",
+    "VERSION",
+    "VERSION_BUILD",
+    "CONFIG_PATH",
+    "PRIVATE",
+    "_CLI_VERSION",
+    "ASAN_SYMBOLIZER_PATH",
+    "TSAN_SYMBOLIZER_PATH",
+]
+
+# Tools whose paths are resolved once.
+TOOLS = ["cli", "git", "cmake", "clangd", "clang-format", "clang-tidy", "go", "gofmt"]
+
+################################################################################
+
+
+def _get_socket_path() -> Path:
+    return lib.get_build_directory() / client.SOCKET_NAME
+
+
+def _send_response(connection: socket.socket, response: dict):
+    connection.sendall(json.dumps(response).encode() + b"\n")
+
+
+def _request(command: str) -> dict | None:
+    try:
+        connection = client.connect(_get_socket_path())
+    except OSError:
+        return None
+
+    with connection:
+        client.send_request(connection, {"command": command}, [])
+        return json.loads(connection.makefile("r").readline() or "null")
+
+
+def _warm_up():
+    """Imports the cli and fills caches which are shared by all requests."""
+    main = importlib.import_module("main")
+    for command in main.LAZY_COMMANDS.values():
+        module_name, _ = command.split(":")
+        if command not in main.PRIVATE_LAZY_COMMANDS.values():
+            importlib.import_module(module_name)
+    importlib.import_module("git")
+
+    for tool in TOOLS:
+        if shutil.which(tool):
+            lib.get_tool_path(tool)
+
+    lib.load_config()
+    lib.load_all_tasks()
+    lib.get_submit_file_tasks()
+
+
+def _refresh_caches():
+    """Reloads caches of the task files, which may have been changed since the last request."""
+    for function in [lib.load_config, lib.load_task_from_dir, lib.load_all_tasks,
+                     lib.get_submit_file_tasks]:
+        function.cache_clear()
+
+    lib.load_config()
+    lib.load_all_tasks()
+    lib.get_submit_file_tasks()
+
+
+def _run_forked_request(connection: socket.socket, fds: list[int], request: dict):
+    """Executes the command in the forked process with the streams and environment of the client."""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    for target_fd, fd in enumerate(fds):
+        os.dup2(fd, target_fd)
+        os.close(fd)
+    sys.stdout.reconfigure(line_buffering=True)
+
+    os.chdir(request["cwd"])
+    os.environ.clear()
+    os.environ.update(request["env"])
+    sys.argv = request["argv"]
+    lib._trace_start = time.perf_counter()
+
+    _send_response(connection, {"pid": os.getpid()})
+
+    exit_code = 0
+    try:
+        importlib.import_module("main").main()
+    except SystemExit as error:
+        if isinstance(error.code, str):
+            print(error.code, file=sys.stderr)
+            exit_code = 1
+        else:
+            exit_code = error.code or 0
+    except KeyboardInterrupt:
+        exit_code = 130
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+
+    atexit._run_exitfuncs()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    _send_response(connection, {"exit_code": exit_code})
+
+
+def _handle_request(connection: socket.socket, started: float, requests: int) -> bool:
+    """Handles a request of the client. Returns False if the daemon has to stop."""
+    connection.settimeout(5)
+    _, fds, _, _ = socket.recv_fds(connection, 1, 3)
+    request = json.loads(connection.makefile("r").readline())
+    connection.settimeout(None)
+
+    try:
+        if request["command"] == "status":
+            _send_response(connection, {
+                "pid": os.getpid(),
+                "uptime": time.time() - started,
+                "requests": requests,
+            })
+        elif request["command"] == "stop":
+            _send_response(connection, {"stopped": True})
+            return False
+        elif any(request["env"].get(name) != os.environ.get(name) for name in FROZEN_ENVIRONMENT):
+            _send_response(connection, {"error": "Environment of the daemon is outdated"})
+        else:
+            _refresh_caches()
+            if os.fork() == 0:
+                try:
+                    _run_forked_request(connection, fds, request)
+                finally:
+                    os._exit(0)
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+    return True
+
+
+def _serve():
+    socket_path = _get_socket_path()
+    os.chdir(lib.get_course_directory())
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        os.remove(os.path.relpath(socket_path))
+    except FileNotFoundError:
+        pass
+    server.bind(os.path.relpath(socket_path))
+    server.listen()
+    server.settimeout(IDLE_TIMEOUT)
+
+    # Forked requests are reaped automatically.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    started = time.time()
+    requests = 0
+    try:
+        _warm_up()
+        while True:
+            try:
+                connection, _ = server.accept()
+            except TimeoutError:
+                break
+
+            requests += 1
+            with connection:
+                try:
+                    if not _handle_request(connection, started, requests):
+                        break
+                except (OSError, ValueError, KeyError):
+                    traceback.print_exc()
+    finally:
+        server.close()
+        try:
+            os.remove(os.path.relpath(socket_path))
+        except FileNotFoundError:
+            pass
+
+
+def _daemonize(log_path: Path):
+    """Detaches the current process from the terminal. Returns False in the original process."""
+    if os.fork() != 0:
+        return False
+
+    os.setsid()
+    if os.fork() != 0:
+        os._exit(0)
+
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(null_fd)
+    os.close(log_fd)
+    return True
+
+
+def _wait_for_socket(timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if _request("status"):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+################################################################################
+
+
+@click.group()
+def daemon():
+    """
+    Manage the background daemon of the course.
+
+    The daemon keeps the cli loaded, so commands started in the course directory return faster.
+    Commands are executed by the cli itself when the daemon is not running. Set CLI_NO_DAEMON=1
+    to bypass it.
+    """
+
+
+@daemon.command()
+@click.option("--foreground", is_flag=True, help="Do not detach from the terminal.")
+def start(foreground: bool):
+    """Start the daemon."""
+    if _request("status"):
+        lib.print_info("Daemon is already running")
+        return
+
+    if foreground:
+        _serve()
+        return
+
+    if _daemonize(lib.get_build_directory() / "logs" / "daemon.log"):
+        try:
+            _serve()
+        finally:
+            os._exit(0)
+
+    if not _wait_for_socket(timeout=10):
+        lib.print_error(
+            f"Daemon did not start, see {lib.get_build_directory() / 'logs' / 'daemon.log'}")
+        sys.exit(1)
+    lib.print_success("Daemon started")
+
+
+@daemon.command()
+def stop():
+    """Stop the daemon."""
+    if _request("stop") is None:
+        lib.print_info("Daemon is not running")
+        return
+    lib.print_success("Daemon stopped")
+
+
+@daemon.command()
+def status():
+    """Print the status of the daemon."""
+    response = _request("status")
+    if response is None:
+        lib.print_info("Daemon is not running")
+        return
+
+    lib.print_info(
+        f"Daemon is running with pid {response['pid']}\n"
+        f"Uptime: {response['uptime']:.0f}s\n"
+        f"Requests: {response['requests']}")
@@ -0,0 +1,465 @@
+import fcntl
+import json
+import os
+import queue
+import re
+import rich.box
+import rich_click as click
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import lib
+import private
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from rich.table import Table
+
+
+################################################################################
+
+
+# Jobs are files in the spool directory, which may be shared by workers on several machines:
+#   pending/<id>.json         - submitted jobs, claimed by workers in the order of ids;
+#   running/<id>.<claim>.json - claimed jobs, their modification time is the heartbeat of the
+#                               worker, the claim is a random token of the worker's attempt;
+#   done/<id>.json            - jobs with grading results, done/<id>.log is the log of grading.
+# A job moves between the directories by renames, which are atomic, so only one worker can claim
+# it, and a worker whose job was returned to the queue can not publish or return it again.
+# Clocks of the machines are assumed to be synchronized.
+JOB_STATES = ["pending", "running", "done"]
+
+DEFAULT_QUEUE_DIRECTORY = Path(".cache") / "queue"
+
+HEARTBEAT_INTERVAL = 10
+POLL_INTERVAL = 2
+
+# Jobs without heartbeats for this long are returned to the queue. Jobs which were claimed this
+# many times are not graded again, they probably crash workers.
+JOB_STALE_TIMEOUT = 60
+JOB_MAX_ATTEMPTS = 3
+
+
+################################################################################
+
+
+def _get_queue_directory(queue_directory: str | None) -> Path:
+    if queue_directory is None:
+        return lib.get_course_directory() / DEFAULT_QUEUE_DIRECTORY
+    return Path(queue_directory).absolute()
+
+
+def _write_job(path: Path, job: dict):
+    """Writes the job atomically, a temporary file is created in the same directory first."""
+    temporary_path = path.with_suffix(f".{os.getpid()}.{threading.get_native_id()}.tmp")
+    temporary_path.write_text(json.dumps(job))
+    os.replace(temporary_path, path)
+
+
+def _load_jobs(queue_directory: Path, state: str) -> list[dict]:
+    jobs = []
+    for path in sorted((queue_directory / state).glob("*.json")):
+        try:
+            jobs.append(json.loads(path.read_text()) | {"heartbeat": path.stat().st_mtime})
+        except (FileNotFoundError, json.JSONDecodeError):
+            # The job was moved or is being written.
+            continue
+    return jobs
+
+
+def _get_job_id(path: Path) -> str:
+    return path.name.split(".")[0]
+
+
+def _get_pending_path(queue_directory: Path, path: Path) -> Path:
+    return queue_directory / "pending" / f"{_get_job_id(path)}.json"
+
+
+def _reap_stale_jobs(queue_directory: Path):
+    """Returns jobs of dead workers to the queue."""
+    for path in (queue_directory / "running").glob("*.json"):
+        try:
+            if time.time() - path.stat().st_mtime < JOB_STALE_TIMEOUT:
+                continue
+            os.rename(path, _get_pending_path(queue_directory, path))
+        except FileNotFoundError:
+            # The job has just finished or another worker has reaped it.
+            continue
+        lib.print_warning(f"Job {_get_job_id(path)} has no heartbeats, it is returned to the queue")
+
+
+def _claim_job(queue_directory: Path, worker_name: str) -> tuple[Path, dict] | None:
+    """Moves the first pending job to running. Returns its path and the job."""
+    for pending_path in sorted((queue_directory / "pending").glob("*.json")):
+        claim = uuid.uuid4().hex[:8]
+        running_path = queue_directory / "running" / f"{pending_path.stem}.{claim}.json"
+        try:
+            # The job is touched first, so that it does not look stale right after the claim.
+            os.utime(pending_path)
+            os.rename(pending_path, running_path)
+            job = json.loads(running_path.read_text())
+        except FileNotFoundError:
+            # Another worker has claimed the job.
+            continue
+
+        job["attempts"] = job.get("attempts", 0) + 1
+        job["worker"] = worker_name
+        job["claim"] = claim
+        _write_job(running_path, job)
+        return running_path, job
+
+    return None
+
+
+def _publish_result(queue_directory: Path, running_path: Path, job: dict, result: dict,
+                    log_path: Path | None = None) -> bool:
+    """
+    Moves the job to done with the result. Returns False if the job is not claimed by this worker
+    anymore, then the result is dropped.
+    """
+    done_path = queue_directory / "done" / f"{job['id']}.json"
+    try:
+        # The rename succeeds only while the claim of this worker is in running.
+        os.rename(running_path, done_path)
+    except FileNotFoundError:
+        lib.print_warning(
+            f"Job {job['id']} was returned to the queue while it was graded, the result is dropped")
+        return False
+
+    if log_path is not None and log_path.exists():
+        shutil.copyfile(log_path, done_path.with_suffix(".log"))
+        result["log"] = str(done_path.with_suffix(".log"))
+
+    _write_job(done_path, job | {"result": result})
+    return True
+
+
+def _prepare_workspace(workspace: Path, job: dict):
+    """Clones the student repository and checks out the commit of the job."""
+    shutil.rmtree(workspace, ignore_errors=True)
+    workspace.parent.mkdir(parents=True, exist_ok=True)
+
+    lib.run(["git", "clone", "--quiet", "--no-checkout", job["repo"], workspace],
+            capture_output=True, check=True)
+    # Tasks may be selected by git notes of the commit.
+    lib.run(["git", "-C", workspace, "fetch", "--quiet", "origin",
+             "+refs/notes/*:refs/notes/*"], capture_output=True)
+    lib.run(["git", "-C", workspace, "checkout", "--quiet", "--detach", job["commit"]],
+            capture_output=True, check=True)
+
+
+def _grade_job(job: dict, slot_index: int) -> tuple[dict, Path]:
+    workspace = lib.get_build_directory() / "grade" / f"worker-{slot_index}-repo"
+    log_path = lib.get_build_directory() / "logs" / f"worker-{job['id']}.log"
+
+    _prepare_workspace(workspace, job)
+    args = [workspace]
+    for task_name in job["tasks"]:
+        args += ["--task", task_name]
+    if job["full"]:
+        args.append("--full")
+
+    try:
+        result = private._grade_in_slot(f"worker-{slot_index}", args, log_path)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    if job["report"]:
+        reports = private._Reports()
+        reports.send_passed(result["tasks"], result["failed_checks"], job["username"])
+        if not reports.wait():
+            result["exit_code"] = result["exit_code"] or 1
+
+    return result, log_path
+
+
+class _Heartbeats:
+    """Touches files of the running jobs, so that other workers do not reap them."""
+
+    def __init__(self):
+        self._paths: set[Path] = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, path: Path):
+        with self._lock:
+            self._paths.add(path)
+
+    def remove(self, path: Path):
+        with self._lock:
+            self._paths.discard(path)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(HEARTBEAT_INTERVAL):
+            with self._lock:
+                paths = list(self._paths)
+            for path in paths:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    self.remove(path)
+                    lib.print_warning(
+                        f"Job {_get_job_id(path)} was returned to the queue while it was graded")
+
+
+def _acquire_worker_lock(lock_path: Path):
+    """Allows a single worker per course checkout, because workers reuse its grading slots."""
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    lock_file = open(lock_path, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lib.print_error("Another worker is running in this course directory")
+        sys.exit(1)
+    return lock_file
+
+
+def _get_error_result(error: str) -> dict:
+    return {"exit_code": None, "duration": 0, "tasks": [], "failed_checks": [], "error": error}
+
+
+def _print_job_result(job: dict, result: dict):
+    name = f"{job['username']} ({job['id']})"
+    if result["exit_code"] == 0:
+        lib.print_inline_success(f"{name}: passed ({result['duration']:.0f}s)")
+    else:
+        lib.print_inline_info(
+            f"{name}: failed with {len(result['failed_checks'])} failed checks "
+            f"({result['duration']:.0f}s), see {result.get('log', '-')}")
+
+
+def _run_worker(queue_directory: Path, jobs: int, exit_when_empty: bool):
+    worker_name = f"{socket.gethostname()}:{os.getpid()}"
+    for state in JOB_STATES:
+        (queue_directory / state).mkdir(parents=True, exist_ok=True)
+
+    free_slots = queue.SimpleQueue()
+    for index in range(jobs):
+        free_slots.put(index)
+
+    heartbeats = _Heartbeats()
+    stopping = threading.Event()
+    running: dict[Future, tuple[Path, dict]] = {}
+
+    def run_job(running_path: Path, job: dict) -> dict | None:
+        slot_index = free_slots.get()
+        try:
+            result, log_path = _grade_job(job, slot_index)
+        except subprocess.CalledProcessError as error:
+            # The repository or the commit does not exist.
+            result, log_path = _get_error_result(
+                (error.stderr or b"").decode(errors="replace").strip() or str(error)), None
+        finally:
+            free_slots.put(slot_index)
+            heartbeats.remove(running_path)
+
+        # The job is returned to the queue when the worker is interrupted.
+        if stopping.is_set() or not _publish_result(
+                queue_directory, running_path, job, result, log_path):
+            return None
+        return result
+
+    lib.print_info(
+        f"Worker {worker_name} grades up to {jobs} jobs at once from {queue_directory}")
+
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        while True:
+            _reap_stale_jobs(queue_directory)
+
+            # Like batch grading, a new job is admitted only if the machine is not overloaded.
+            while len(running) < jobs and (not running or private._has_free_resources()):
+                claimed = _claim_job(queue_directory, worker_name)
+                if claimed is None:
+                    break
+
+                running_path, job = claimed
+                if job["attempts"] > JOB_MAX_ATTEMPTS:
+                    if _publish_result(queue_directory, running_path, job, _get_error_result(
+                            f"Job was abandoned after {JOB_MAX_ATTEMPTS} attempts")):
+                        lib.print_warning(f"Job {job['id']} was abandoned")
+                    continue
+
+                lib.print_inline_info(f"Grading {job['repo']} at {job['commit']} ({job['id']})")
+                heartbeats.add(running_path)
+                running[executor.submit(run_job, running_path, job)] = claimed
+
+            if not running:
+                if exit_when_empty:
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+
+            finished, _ = wait(running, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in finished:
+                _, job = running.pop(future)
+                result = future.result()
+                if result is None:
+                    continue
+                if "error" in result:
+                    lib.print_error(f"Job {job['id']} failed: {result['error']}")
+                else:
+                    _print_job_result(job, result)
+    except KeyboardInterrupt:
+        stopping.set()
+        for running_path, job in running.values():
+            try:
+                os.rename(running_path, _get_pending_path(queue_directory, running_path))
+            except FileNotFoundError:
+                continue
+            lib.print_warning(f"Job {job['id']} is returned to the queue")
+        raise
+    finally:
+        # Interrupted gradings finish quickly, their processes get the signal too.
+        executor.shutdown()
+        heartbeats.stop()
+
+
+def _resolve_commit(repo: str, commit: str) -> str | None:
+    """
+    Returns the hash of the commit, so that the job grades the repository as it was submitted.
+    Returns None if the revision is not found.
+    """
+    try:
+        if Path(repo).exists():
+            return lib.check_output(["git", "-C", repo, "rev-parse", "--verify", "--quiet",
+                                     f"{commit}^{{commit}}"]).decode().strip()
+
+        if re.fullmatch("[0-9a-f]{40}", commit):
+            return commit
+        refs = lib.check_output(["git", "ls-remote", repo, commit]).decode().split()
+    except subprocess.CalledProcessError:
+        return None
+    return refs[0] if refs else None
+
+
+def _format_age(timestamp: float) -> str:
+    return f"{time.time() - timestamp:.0f}s"
+
+
+def _queue_option(function):
+    return click.option(
+        "--queue", "queue_directory", envvar="CLI_GRADE_QUEUE", type=click.Path(file_okay=False),
+        help="Spool directory of the queue, it may be shared by workers on several machines "
+        "(.cache/queue of the course by default, also set by CLI_GRADE_QUEUE).")(function)
+
+
+################################################################################
+
+
+@click.command()
+@_queue_option
+@click.option("-j", "--jobs", default=1, show_default=True,
+              help="Number of jobs graded concurrently, each in its own worktree of the course.")
+@click.option("--exit-when-empty", is_flag=True,
+              help="Exit when there are no pending jobs instead of waiting for new ones.")
+def worker(queue_directory: str | None, jobs: int, exit_when_empty: bool):
+    """
+    Grade jobs from the queue.
+
+    Jobs are submitted with `cli queue submit`. Each job is graded in a clone of the student
+    repository and a worktree of the course at its current commit, like `cli grade --batch`
+    does. Results are written to the done directory of the queue. Jobs of workers which stopped
+    sending heartbeats are returned to the queue.
+    """
+    lock_file = _acquire_worker_lock(lib.get_build_directory() / "grade" / "worker.lock")
+    with lock_file:
+        _run_worker(_get_queue_directory(queue_directory), jobs, exit_when_empty)
+
+
+@click.group(name="queue")
+def grade_queue():
+    """Manage the queue of grading jobs."""
+
+
+@grade_queue.command()
+@_queue_option
+@click.argument("repo")
+@click.option("--commit", default="HEAD", show_default=True,
+              help="Commit to grade. Revisions are resolved to commits on submission.")
+@click.option("-t", "--task", "tasks", multiple=True,
+              help="Grade the task instead of the ones selected by the git note or the last "
+              "commit. This option can be used multiple times.")
+@click.option("--username", help="Username to report scores for (the repository name by default).")
+@click.option("--report", is_flag=True, help="Report scores to manytask.")
+@click.option("--full", is_flag=True, help="Run all checks of a task after a failed one.")
+def submit(queue_directory: str | None, repo: str, commit: str, tasks: tuple[str, ...],
+           username: str | None, report: bool, full: bool):
+    """Submit a grading job for the repository, given by a path or a URL."""
+    queue_path = _get_queue_directory(queue_directory)
+    if Path(repo).exists():
+        repo = str(Path(repo).absolute())
+
+    commit_hash = _resolve_commit(repo, commit)
+    if commit_hash is None:
+        lib.print_error(f"Revision {commit} is not found in {repo}")
+        sys.exit(1)
+
+    # Ids are ordered by the submission time.
+    job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    job = {
+        "id": job_id,
+        "repo": repo,
+        "commit": commit_hash,
+        "tasks": list(tasks),
+        "username": username or Path(repo.rstrip("/")).stem,
+        "report": report,
+        "full": full,
+        "submitted": time.time(),
+    }
+
+    (queue_path / "pending").mkdir(parents=True, exist_ok=True)
+    _write_job(queue_path / "pending" / f"{job_id}.json", job)
+    print(job_id)
+
+
+@grade_queue.command()
+@_queue_option
+@click.option("--all", "show_all", is_flag=True, help="Show all finished jobs, not only the last.")
+def status(queue_directory: str | None, show_all: bool):
+    """Print jobs in the queue."""
+    queue_path = _get_queue_directory(queue_directory)
+
+    table = Table(title=f"Queue {queue_path}", box=rich.box.SQUARE)
+    table.add_column("Job")
+    table.add_column("User")
+    table.add_column("State")
+    table.add_column("Details")
+    table.add_column("Age", justify="right")
+
+    for job in _load_jobs(queue_path, "pending"):
+        table.add_row(job["id"], job["username"], "pending",
+                      f"attempt {job['attempts'] + 1}" if job.get("attempts") else "-",
+                      _format_age(job["submitted"]))
+
+    for job in _load_jobs(queue_path, "running"):
+        table.add_row(job["id"], job["username"], "[cyan]running",
+                      f"{job['worker']}, heartbeat {_format_age(job['heartbeat'])} ago",
+                      _format_age(job["submitted"]))
+
+    done_jobs = _load_jobs(queue_path, "done")
+    for job in done_jobs if show_all else done_jobs[-10:]:
+        result = job.get("result")
+        if result is None:
+            # The worker is writing the result.
+            state, details = "[cyan]publishing", job["worker"]
+        elif result["exit_code"] == 0:
+            state, details = "[green]passed", ", ".join(result["tasks"]) or "-"
+        elif "error" in result:
+            state, details = "[red]error", result["error"]
+        else:
+            state, details = "[red]failed", "\n".join(result["failed_checks"]) or "-"
+        table.add_row(job["id"], job["username"], state, details, _format_age(job["submitted"]))
+
+    lib.error_console.print(table, width=lib.CONSOLE_WIDTH)
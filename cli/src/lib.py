@@ -1,16 +1,31 @@
+import atexit
+import contextvars
+import hashlib
 import importlib
+import json
 import os
-import pkgutil
+import re
+import shutil
+import signal
+import statistics
 import subprocess
 import sys
-import yaml
+import threading
+import time
 import types
 
 from rich.rule import Rule
 from rich.text import Text
 from rich.style import Style
 from rich.console import Console, RenderableType
-from collections.abc import Generator
+from rich.live import Live
+from rich.markup import escape
+from rich.table import Table
+from collections import deque
+from collections.abc import Callable, Generator, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from functools import cache
 from pathlib import Path
 
@@ -26,8 +41,257 @@ CONSOLE_WIDTH = 79
 SYSTEM = os.environ["SYSTEM"]
 CONFIG_PATH = os.environ["CONFIG_PATH"]
 
+# Language modules from the `modules` package, they are imported on first use.
+MODULES = ["cpp", "go"]
+
+# Directories which never contain course sources, they are skipped during walks.
+IGNORED_DIRECTORIES = {".git", ".cache", "build"}
+
+TASK_INDEX_VERSION = 1
+
+TRACE_SUMMARY_SIZE = 10
+URL_USERINFO_REGEX = re.compile(r"(\w+://)[^/@\s]+@")
+
+# Number of last lines of step output kept in memory.
+LOG_TAIL_SIZE = 20
+
+OUTPUT_MODES = ["auto", "live", "plain", "stream"]
+
+# Bytes hashed by the calibration benchmark and the number of its runs.
+CALIBRATION_SIZE = 256 * 2**20
+CALIBRATION_RUNS = 5
+
+STEP_STATUS_STYLES = {
+    "pending": "dim",
+    "running": "cyan",
+    "passed": "green",
+    "cached": "green dim",
+    "failed": "red bold",
+    "cancelled": "yellow",
+}
+
+
+################################################################################
+
+
+class _StepAwareConsole:
+    """Console proxy which writes to the log of the current step, if there is one."""
+
+    def __init__(self, console: Console):
+        self._console = console
+
+    def __getattr__(self, name: str):
+        step_log = _step_log.get()
+        return getattr(step_log.console if step_log else self._console, name)
+
+
+_step_log: contextvars.ContextVar["_StepLog | None"] = contextvars.ContextVar(
+    "step_log", default=None)
+_step_cpus: contextvars.ContextVar[set[int] | None] = contextvars.ContextVar(
+    "step_cpus", default=None)
+_step_cpu_allocator: contextvars.ContextVar["_CpuAllocator | None"] = contextvars.ContextVar(
+    "step_cpu_allocator", default=None)
+_output_mode = "auto"
+_results_cache_lock = threading.Lock()
+
 console = Console(force_terminal=True, highlight=False)
-error_console = Console(stderr=True, force_terminal=True, highlight=False)
+_terminal_error_console = Console(stderr=True, force_terminal=True, highlight=False)
+error_console = _StepAwareConsole(_terminal_error_console)
+
+
+################################################################################
+
+
+_trace_path: Path | None = None
+_trace_start = time.perf_counter()
+_trace_events: list[dict] = []
+_trace_events_lock = threading.Lock()
+_span_args: contextvars.ContextVar[dict] = contextvars.ContextVar("span_args", default={})
+
+# Running processes and whether each of them leads its own process group.
+_running_processes: dict[subprocess.Popen, bool] = {}
+_running_processes_lock = threading.Lock()
+_cancelled = threading.Event()
+
+
+def enable_tracing(path: Path):
+    global _trace_path
+
+    if _trace_path is None:
+        atexit.register(_write_trace)
+    _trace_path = path
+
+
+@contextmanager
+def span(name: str, category: str = "phase", **args) -> Iterator[None]:
+    """
+    Records a timed span for the trace. Arguments such as check name and profile are inherited
+    by nested spans, including spans of subprocesses.
+    """
+    span_args = _span_args.get() | args
+    token = _span_args.set(span_args)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        _span_args.reset(token)
+
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - _trace_start) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+            "args": span_args,
+        }
+        with _trace_events_lock:
+            _trace_events.append(event)
+
+
+def _get_subprocess_span_name(args: list) -> str:
+    return Path(str(args[0])).name
+
+
+def _redact_argument(arg) -> str:
+    """Hides credentials in URLs, traces are kept as CI artifacts."""
+    return URL_USERINFO_REGEX.sub(r"\1***@", str(arg))
+
+
+def run(args: list,
+        input: str | bytes | None = None,
+        capture_output: bool = False,
+        timeout: float | None = None,
+        check: bool = False,
+        **kwargs) -> subprocess.CompletedProcess:
+    """
+    Same as subprocess.run, but the call is traced and the process is terminated when running
+    processes are cancelled. A process with a timeout runs in its own process group, which is
+    killed as a whole, so that its children do not outlive it.
+    """
+    if input is not None:
+        kwargs["stdin"] = subprocess.PIPE
+    if capture_output:
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+
+    with span(_get_subprocess_span_name(args), category="subprocess",
+              command=" ".join(_redact_argument(arg) for arg in args)):
+        if is_cancelled():
+            raise subprocess.CalledProcessError(-1, args)
+
+        # Output of processes started by a step goes to the step log.
+        step_log = _step_log.get()
+        log_reader = None
+        if step_log and ("stdout" not in kwargs or "stderr" not in kwargs):
+            read_fd, write_fd = os.pipe()
+            kwargs.setdefault("stdout", write_fd)
+            kwargs.setdefault("stderr", write_fd)
+            log_reader = threading.Thread(
+                target=step_log.read_from, args=(open(read_fd, "rb"),), daemon=True)
+
+        own_group = timeout is not None and "process_group" not in kwargs
+        if own_group:
+            kwargs["process_group"] = 0
+
+        try:
+            process = subprocess.Popen(args, **kwargs)
+        finally:
+            if log_reader:
+                os.close(write_fd)
+
+        with process:
+            with _running_processes_lock:
+                _running_processes[process] = own_group
+            # Processes started by a step with dedicated cores run only on them, processes of
+            # other steps run on the cores not dedicated to any step.
+            step_cpus = _step_cpus.get()
+            cpu_allocator = _step_cpu_allocator.get()
+            if step_cpus:
+                _set_process_tree_affinity(process.pid, step_cpus)
+            elif cpu_allocator:
+                cpu_allocator.add_process(process)
+            if log_reader:
+                log_reader.start()
+            try:
+                stdout, stderr = process.communicate(input, timeout=timeout)
+                if own_group:
+                    # Children of the process may still run and hold the log pipe open.
+                    _signal_process(process, own_group, signal.SIGKILL)
+                if log_reader:
+                    log_reader.join()
+            except subprocess.TimeoutExpired as error:
+                _signal_process(process, own_group, signal.SIGKILL)
+                error.output, error.stderr = process.communicate()
+                raise
+            except BaseException:
+                _signal_process(process, own_group, signal.SIGKILL)
+                raise
+            finally:
+                if cpu_allocator and not step_cpus:
+                    cpu_allocator.remove_process(process)
+                with _running_processes_lock:
+                    _running_processes.pop(process, None)
+
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, args, stdout, stderr)
+
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+
+def check_output(args: list, **kwargs) -> bytes:
+    return run(args, stdout=subprocess.PIPE, check=True, **kwargs).stdout
+
+
+def is_cancelled() -> bool:
+    return _cancelled.is_set()
+
+
+def _signal_process(process: subprocess.Popen, own_group: bool, signum: int):
+    try:
+        if own_group:
+            os.killpg(process.pid, signum)
+        else:
+            process.send_signal(signum)
+    except ProcessLookupError:
+        pass
+
+
+def cancel_running_processes():
+    """Terminates running subprocesses, subprocesses started later fail immediately."""
+    _cancelled.set()
+    with _running_processes_lock:
+        for process, own_group in _running_processes.items():
+            _signal_process(process, own_group, signal.SIGTERM)
+
+
+def _write_trace():
+    with _trace_events_lock:
+        events = list(_trace_events)
+
+    with open(_trace_path, "w") as stream:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, stream)
+
+    totals = {}
+    for event in events:
+        key = (event["name"], event["args"].get("check", ""), event["args"].get("profile", ""))
+        count, duration = totals.get(key, (0, 0.0))
+        totals[key] = (count + 1, duration + event["dur"] / 1e6)
+
+    table = Table(title=f"Slowest spans (trace written to {_trace_path})", box=rich.box.SQUARE)
+    table.add_column("Span")
+    table.add_column("Check")
+    table.add_column("Profile")
+    table.add_column("Count", justify="right")
+    table.add_column("Total", justify="right")
+
+    top_spans = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+    for (name, check, profile), (count, duration) in top_spans[:TRACE_SUMMARY_SIZE]:
+        table.add_row(name, check, profile, str(count), f"{duration:.2f}s")
+
+    error_console.print(table, width=CONSOLE_WIDTH)
 
 
 ################################################################################
@@ -89,19 +353,18 @@ def print_inline_success(text: str):
 
 
 @cache
-def get_modules() -> list[types.ModuleType]:
-    modules = []
+def get_module(name: str) -> types.ModuleType:
+    return importlib.import_module("modules" + "." + name)
 
-    for _, name, _ in pkgutil.iter_modules([importlib.import_module("modules").__path__[0]]):
-        modules.append(importlib.import_module("modules" + "." + name))
 
-    return modules
+def get_modules() -> list[types.ModuleType]:
+    return [get_module(name) for name in MODULES]
 
 
 @cache
 def get_course_directory() -> Path:
     try:
-        return Path(subprocess.check_output([
+        return Path(check_output([
             "git",
             "rev-parse",
             "--show-toplevel"
@@ -117,11 +380,16 @@ def get_build_directory() -> Path:
 
 
 @cache
+def get_tool_path(name: str) -> Path:
+    path = shutil.which(name)
+    if path is None:
+        print_error(f"{name} is not found in PATH")
+        sys.exit(1)
+    return Path(path)
+
+
 def get_cli_path() -> Path:
-    return Path(subprocess.check_output([
-        "which",
-        "cli",
-    ])[:-1].decode())
+    return get_tool_path("cli")
 
 
 @cache
@@ -135,18 +403,103 @@ def load_task_from_dir(directory: Path) -> dict:
         sys.exit(1)
 
     with open(task_path, "r") as stream:
-        task = yaml.safe_load(stream)
+        task = load_yaml(stream)
 
     task["task_name"] = str(directory.resolve().relative_to(get_course_directory()))
 
     return task
 
 
+def _walk_task_directories(cached_directories: dict) -> dict:
+    """
+    Returns the directory tree of the course, directories with unchanged mtime are taken from the
+    cache without listing them.
+    """
+    course_directory = get_course_directory()
+
+    directories = {}
+    stack = ["."]
+    while stack:
+        relative_path = stack.pop()
+        path = course_directory / relative_path
+
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+
+        entry = cached_directories.get(relative_path)
+        if entry is None or entry["mtime"] != mtime:
+            entry = {"mtime": mtime, "subdirectories": [], "has_task": False}
+            with os.scandir(path) as iterator:
+                for item in iterator:
+                    if item.is_dir(follow_symlinks=False):
+                        if item.name not in IGNORED_DIRECTORIES:
+                            entry["subdirectories"].append(item.name)
+                    elif item.name == ".task.yml":
+                        entry["has_task"] = True
+            entry["subdirectories"].sort()
+
+        directories[relative_path] = entry
+        stack.extend(os.path.join(relative_path, name) if relative_path != "." else name
+                     for name in reversed(entry["subdirectories"]))
+
+    return directories
+
+
+def _load_indexed_task(task_name: str, cached_entry: dict | None) -> dict:
+    task_path = get_course_directory() / task_name / ".task.yml"
+    stat = task_path.stat()
+
+    if cached_entry and cached_entry["mtime"] == stat.st_mtime_ns \
+            and cached_entry["size"] == stat.st_size:
+        return cached_entry
+
+    file_hash = get_file_hash(task_path)
+    if cached_entry and cached_entry["hash"] == file_hash:
+        return cached_entry | {"mtime": stat.st_mtime_ns, "size": stat.st_size}
+
+    with open(task_path, "r") as stream:
+        task = load_yaml(stream)
+    task["task_name"] = task_name
+
+    return {"mtime": stat.st_mtime_ns, "size": stat.st_size, "hash": file_hash, "task": task}
+
+
 @cache
 def load_all_tasks() -> list[dict]:
-    result = []
-    for task_path in get_course_directory().rglob(".task.yml"):
-        result.append(load_task_from_dir(task_path.parent))
+    index = load_cache("tasks")
+    if index.get("version") != TASK_INDEX_VERSION:
+        index = {}
+
+    cached_directories = index.get("directories", {})
+    cached_tasks = index.get("tasks", {})
+
+    directories = _walk_task_directories(cached_directories)
+
+    tasks = {}
+    for relative_path, entry in directories.items():
+        if entry["has_task"]:
+            tasks[relative_path] = _load_indexed_task(relative_path, cached_tasks.get(relative_path))
+
+    if directories != cached_directories or tasks != cached_tasks:
+        store_cache("tasks", {
+            "version": TASK_INDEX_VERSION,
+            "directories": directories,
+            "tasks": tasks,
+        })
+
+    return [entry["task"] for entry in tasks.values()]
+
+
+@cache
+def get_submit_file_tasks() -> dict[str, list[str]]:
+    """Maps submit files relative to the course directory to the tasks that use them."""
+    result = {}
+    for task in load_all_tasks():
+        for file in task["submit_files"]:
+            file_path = os.path.normpath(os.path.join(task["task_name"], file))
+            result.setdefault(file_path, []).append(task["task_name"])
     return result
 
 
@@ -158,20 +511,114 @@ def get_cwd_task() -> dict:
 @cache
 def load_config() -> dict:
     with open(CONFIG_PATH, "r") as stream:
-        return yaml.safe_load(stream)
+        return load_yaml(stream)
+
+
+def load_yaml(stream) -> dict:
+    import yaml
+
+    # The C loader is much faster, but it may be unavailable if libyaml is not installed.
+    return yaml.load(stream, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
+
+def get_file_hash(path: Path) -> str:
+    with open(path, "rb") as file:
+        return hashlib.file_digest(file, "sha256").hexdigest()
+
+
+def _get_cache_path(name: str) -> Path:
+    return get_build_directory() / "cache" / f"{name}.json"
+
+
+def load_cache(name: str) -> dict:
+    try:
+        with open(_get_cache_path(name), "r") as stream:
+            return json.load(stream)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
 
+def store_cache(name: str, data: dict):
+    cache_path = _get_cache_path(name)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
 
-def get_files(extensions: list[str]) -> list[Path]:
-    exclude_directories = {"contrib", ".git", "build"}
+    # Write to a temporary file first, so that an interrupted run never leaves a broken cache.
+    temporary_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_native_id()}.tmp")
+    with open(temporary_path, "w") as stream:
+        json.dump(data, stream)
+    os.replace(temporary_path, cache_path)
+
+
+def get_input_key(files: list[Path], **inputs) -> str:
+    """Returns a hash of the contents of the files and of the other inputs of a check."""
+    return hashlib.sha256(json.dumps({
+        "files": {str(path): get_file_hash(path) for path in files},
+        "inputs": inputs,
+    }, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _is_source_path(relative_path: str) -> bool:
+    base = relative_path.split("/", 1)[0]
+    return not any(exclude in base for exclude in IGNORED_DIRECTORIES | {"contrib"})
+
+
+def _list_files_from_git() -> list[str]:
+    output = run([
+        "git",
+        "-C", get_course_directory(),
+        "ls-files",
+        "-z",
+        "--cached",
+        "--others",
+        "--exclude-standard",
+        "--",
+        ".",
+    ] + [f":(exclude,top){directory}" for directory in IGNORED_DIRECTORIES | {"contrib"}],
+        capture_output=True, check=True).stdout
+    return [path for path in output.decode().split("\0") if path]
+
+
+def _list_files_from_walk() -> list[str]:
+    course_directory = get_course_directory()
+
+    result = []
+    stack = [""]
+    while stack:
+        relative_directory = stack.pop()
+        with os.scandir(course_directory / relative_directory) as iterator:
+            for item in iterator:
+                relative_path = relative_directory + item.name
+                if item.is_dir(follow_symlinks=False):
+                    if item.name not in IGNORED_DIRECTORIES and \
+                            (relative_directory or _is_source_path(relative_path)):
+                        stack.append(relative_path + "/")
+                else:
+                    result.append(relative_path)
+
+    return result
+
+
+@cache
+def _get_course_files() -> list[str]:
+    try:
+        relative_paths = _list_files_from_git()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        relative_paths = _list_files_from_walk()
+
+    return [path for path in relative_paths if _is_source_path(path)]
+
+
+def get_files(extensions: set[str]) -> list[Path]:
+    course_directory = get_course_directory()
 
     source_files = []
-    for path in get_course_directory().rglob("*"):
-        if path.suffix not in extensions:
+    for relative_path in _get_course_files():
+        if os.path.splitext(relative_path)[1] not in extensions:
             continue
 
-        base = path.relative_to(get_course_directory()).parts[0]
-
-        if not any(exclude in base for exclude in exclude_directories):
+        path = course_directory / relative_path
+        # Files deleted from the working tree are still listed in the git index.
+        if path.is_file():
             source_files.append(path)
 
     return source_files
@@ -182,10 +629,10 @@ def execute_for_each_module(function_name: str, *args, **kwargs) -> None:
 
     module_name = kwargs.pop("module", None)
     if module_name is not None:
-        modules = [module for module in modules if module.__name__.split(".")[-1] == module_name]
-        if not modules:
+        if module_name not in MODULES:
             print_error(f"Invalid module {module_name}")
             sys.exit(1)
+        modules = [get_module(module_name)]
 
     for module in modules:
         if not hasattr(module, function_name):
@@ -201,7 +648,415 @@ def execute_for_each_module_yielding(function_name: str, *args, **kwargs) -> Gen
             yield failed_test
 
 
-def print_failed_checks_and_exit(failed_checks: list[str]):
+@dataclass
+class Step:
+    """
+    A unit of work for execute_steps. The function returns False or raises CalledProcessError on
+    failure. If the step has a check name, its failure is reported as a failed check.
+
+    If the step has a cache key function, the key is computed right before the step is executed,
+    after its dependencies. A step whose key matches the key of its last successful run is not
+    executed again and is reported as cached.
+
+    Resources of the step (cpus and memory in bytes) count towards the budget of execute_steps
+    while the step runs. Durations of executed steps are recorded, the cost is the expected
+    duration relative to other steps until a duration is recorded.
+    """
+    key: str
+    function: Callable[[], bool | None]
+    dependencies: list[str] = field(default_factory=list)
+    check_name: str | None = None
+    # Steps with the same lock never run concurrently, e.g. builds in one build directory.
+    lock: str | None = None
+    cache_key: Callable[[], str] | None = None
+    cpus: int = 1
+    memory: int = 0
+    cost: float = 1.0
+    # Physical cores reserved for processes of the step, no other step with cores runs on them.
+    cores: int = 0
+    # Time limit of the step in seconds, reported next to its duration.
+    timeout: float | None = None
+
+
+def collect_steps_for_each_module(function_name: str, *args, **kwargs) -> list[Step]:
+    steps = []
+    for module in get_modules():
+        if not hasattr(module, function_name):
+            continue
+        steps += getattr(module, function_name)(*args, **kwargs)
+    return steps
+
+
+def select_steps(steps: list[Step], check_names: set[str]) -> list[Step]:
+    """Returns steps of the given checks together with their dependencies."""
+    steps_by_key = {step.key: step for step in steps}
+
+    selected = set()
+    keys = [step.key for step in steps if step.check_name in check_names]
+    while keys:
+        key = keys.pop()
+        if key not in selected:
+            selected.add(key)
+            keys += steps_by_key[key].dependencies
+
+    return [step for step in steps if step.key in selected]
+
+
+class _StepLog:
+    """Output of a step. It is written to the log file, the last lines are also kept in memory."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.tail: deque[str] = deque(maxlen=LOG_TAIL_SIZE)
+        self.console = Console(file=self, width=CONSOLE_WIDTH, highlight=False, no_color=True)
+        self._file = open(path, "w")
+        self._lock = threading.Lock()
+
+    def write(self, text: str):
+        with self._lock:
+            self._file.write(text)
+            self._file.flush()
+            self.tail.extend(line for line in text.splitlines() if line.strip())
+
+    def flush(self):
+        pass
+
+    def read_from(self, stream):
+        try:
+            for line in stream:
+                self.write(line if isinstance(line, str) else line.decode(errors="replace"))
+        except (OSError, ValueError):
+            # The stream was closed after the process was killed.
+            pass
+
+    def close(self):
+        self._file.close()
+
+
+@dataclass
+class _StepState:
+    step: Step
+    status: str = "pending"
+    start: float | None = None
+    end: float | None = None
+    log: _StepLog | None = None
+    failed_dependency: str | None = None
+    cpu_set: set[int] | None = None
+
+    @property
+    def name(self) -> str:
+        return self.step.check_name or self.step.key
+
+    @property
+    def elapsed(self) -> float:
+        if self.start is None:
+            return 0.0
+        return (self.end or time.perf_counter()) - self.start
+
+
+def set_output_mode(mode: str):
+    global _output_mode
+    _output_mode = mode
+
+
+def _get_output_mode() -> str:
+    if _output_mode != "auto":
+        return _output_mode
+    if os.environ.get("CI") or not sys.stderr.isatty():
+        return "plain"
+    return "live"
+
+
+def _get_step_log_path(key: str) -> Path:
+    return get_build_directory() / "logs" / (key.replace("/", "_") + ".log")
+
+
+def _get_step_input_key(step: Step) -> str | None:
+    if step.cache_key is None:
+        return None
+    try:
+        return step.cache_key()
+    except OSError:
+        return None
+
+
+def load_step_durations() -> dict[str, float]:
+    """Returns durations in seconds of the last successful executions of steps by their keys."""
+    return load_cache("durations")
+
+
+def _store_step_duration(key: str, duration: float):
+    with _results_cache_lock:
+        durations = load_cache("durations")
+        durations[key] = round(duration, 3)
+        store_cache("durations", durations)
+
+
+def _store_passed_result(key: str, input_key: str):
+    with _results_cache_lock:
+        results = load_cache("results")
+        results[key] = input_key
+        store_cache("results", results)
+
+
+def _execute_step(state: _StepState, use_cache: bool,
+                  cpu_allocator: "_CpuAllocator | None") -> str:
+    _step_log.set(state.log)
+    _step_cpus.set(state.cpu_set)
+    _step_cpu_allocator.set(cpu_allocator)
+    try:
+        input_key = _get_step_input_key(state.step)
+        if use_cache and input_key and load_cache("results").get(state.step.key) == input_key:
+            print_inline_info(f"{state.name} passed before with the same inputs, skipping")
+            return "cached"
+
+        if state.step.function() is False:
+            return "failed"
+
+        if input_key:
+            _store_passed_result(state.step.key, input_key)
+        return "passed"
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as error:
+        if not is_cancelled():
+            print_inline_info(str(error))
+        return "failed"
+    finally:
+        if state.log:
+            state.log.close()
+
+
+def _render_progress(states: dict[str, _StepState]) -> Table:
+    table = Table(box=rich.box.SQUARE, width=CONSOLE_WIDTH)
+    table.add_column("Check", no_wrap=True, overflow="ellipsis")
+    table.add_column("Status", width=9)
+    table.add_column("Time", justify="right", width=12)
+
+    counts = {}
+    for state in states.values():
+        counts[state.status] = counts.get(state.status, 0) + 1
+        if state.status not in ["running", "failed"]:
+            continue
+
+        name = state.name
+        if state.status == "running" and state.log and state.log.tail:
+            name += f"\n[dim]{escape(state.log.tail[-1])}"
+        elapsed = f"{state.elapsed:.1f}s" if state.start is not None else ""
+        if state.step.timeout is not None:
+            elapsed += f"/{state.step.timeout:.0f}s"
+        table.add_row(name, f"[{STEP_STATUS_STYLES[state.status]}]{state.status}", elapsed)
+
+    table.caption = ", ".join(f"{count} {status}" for status, count in counts.items())
+    return table
+
+
+def _print_step_status(state: _StepState):
+    status_style = STEP_STATUS_STYLES[state.status]
+    elapsed = ""
+    if state.end is not None:
+        allowed = f" of {state.step.timeout:.0f}s" if state.step.timeout is not None else ""
+        elapsed = f" ({state.elapsed:.1f}s{allowed})"
+    error_console.print(
+        f"[{status_style}]\\[{state.status.upper():^9}][/] {escape(state.name)}{elapsed}",
+        width=CONSOLE_WIDTH)
+
+
+def _print_failed_step_logs(states: dict[str, _StepState]):
+    printed_logs = set()
+    for state in states.values():
+        if state.status != "failed" or not state.step.check_name:
+            continue
+
+        log_state = states[state.failed_dependency] if state.failed_dependency else state
+        if log_state.log is None or log_state.log.path in printed_logs:
+            continue
+        printed_logs.add(log_state.log.path)
+
+        error_console.print(
+            Rule(f"[bold red]Log of {escape(log_state.name)}", style=Style(color="red")),
+            width=CONSOLE_WIDTH)
+        error_console.out(log_state.log.path.read_text(errors="replace"), highlight=False)
+        error_console.print(
+            f"[dim]Full log: {log_state.log.path}", width=CONSOLE_WIDTH)
+        error_console.print()
+
+
+def execute_steps(
+        steps: list[Step],
+        jobs: int = 1,
+        fail_fast: bool = False,
+        use_cache: bool = True,
+        cpus: int | None = None,
+        memory: int | None = None) -> list[str]:
+    """
+    Executes steps in dependency order, running up to `jobs` steps concurrently. Steps with equal
+    keys are executed once. Ready steps are started in the order they were passed. Returns names
+    of failed checks.
+
+    Output of each step is captured to a log under build/logs, unless the output mode is "stream".
+    Progress is shown as a live table on terminals or as plain lines otherwise, and logs are
+    printed only for failed checks. Results of passed steps are cached, see Step; use_cache=False
+    executes the steps anyway. With fail_fast, running steps are cancelled after the first failure
+    and the remaining ones are not started; their checks are returned as failed.
+
+    If cpus or memory are given, a step is started only if the resources of the running steps
+    and of the step fit into them. A step which does not fit even alone is started when nothing
+    else is running. Steps with cores wait until enough cores are not used by other such steps,
+    processes of the other steps are moved off the cores while they are taken.
+    """
+    states: dict[str, _StepState] = {}
+    for step in steps:
+        if step.key not in states:
+            states[step.key] = _StepState(step)
+
+    for state in states.values():
+        for dependency in state.step.dependencies:
+            assert dependency in states, f"Unknown dependency {dependency} of {state.step.key}"
+
+    output_mode = _get_output_mode()
+    cpu_allocator = None
+    if any(state.step.cores for state in states.values()) and hasattr(os, "sched_setaffinity"):
+        cpu_allocator = _CpuAllocator()
+    running: dict[Future, _StepState] = {}
+    failed_checks = []
+    failed_fast = False
+
+    def set_status(state: _StepState, status: str):
+        state.status = status
+        if output_mode == "plain":
+            _print_step_status(state)
+
+    def fail_dependents():
+        for state in states.values():
+            if state.status != "pending":
+                continue
+
+            state.failed_dependency = next(
+                (dependency for dependency in state.step.dependencies
+                 if states[dependency].status == "failed"), None)
+            if state.failed_dependency is None:
+                continue
+
+            set_status(state, "failed")
+            if state.step.check_name:
+                if output_mode == "stream":
+                    print_error(f"Check {state.step.check_name} failed, "
+                                f"step {state.failed_dependency} failed")
+                failed_checks.append(state.step.check_name)
+
+    def get_cpus(step: Step) -> int:
+        return max(step.cpus, step.cores)
+
+    def fits_resources(step: Step, used_cpus: int, used_memory: int) -> bool:
+        if not running:
+            return True
+        if cpus is not None and used_cpus + get_cpus(step) > cpus:
+            return False
+        if memory is not None and used_memory + step.memory > memory:
+            return False
+        return True
+
+    def start_ready_steps(executor: ThreadPoolExecutor):
+        locks = {state.step.lock for state in running.values() if state.step.lock}
+        used_cpus = sum(get_cpus(state.step) for state in running.values())
+        used_memory = sum(state.step.memory for state in running.values())
+        for state in states.values():
+            if len(running) >= jobs:
+                return
+            if state.status != "pending" or state.step.lock in locks:
+                continue
+            if not all(states[dep].status in ["passed", "cached"]
+                       for dep in state.step.dependencies):
+                continue
+            if not fits_resources(state.step, used_cpus, used_memory):
+                continue
+            if cpu_allocator and state.step.cores:
+                state.cpu_set = cpu_allocator.allocate(state.step.cores)
+                if state.cpu_set is None:
+                    continue
+
+            if state.step.lock:
+                locks.add(state.step.lock)
+            used_cpus += get_cpus(state.step)
+            used_memory += state.step.memory
+            if output_mode != "stream":
+                state.log = _StepLog(_get_step_log_path(state.step.key))
+            state.start = time.perf_counter()
+            set_status(state, "running")
+
+            context = contextvars.copy_context()
+            running[executor.submit(
+                context.run, _execute_step, state, use_cache, cpu_allocator)] = state
+
+    live = None
+    if output_mode == "live":
+        live = Live(get_renderable=lambda: _render_progress(states),
+                    console=_terminal_error_console, refresh_per_second=4)
+        live.start()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            while True:
+                if not is_cancelled():
+                    fail_dependents()
+                    start_ready_steps(executor)
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    state = running.pop(future)
+                    state.end = time.perf_counter()
+                    if state.cpu_set:
+                        cpu_allocator.release(state.cpu_set)
+                    status = future.result()
+                    if status == "passed":
+                        _store_step_duration(state.step.key, state.elapsed)
+                    if status != "failed":
+                        set_status(state, status)
+                    elif is_cancelled():
+                        set_status(state, "cancelled")
+                    else:
+                        set_status(state, "failed")
+                        if state.step.check_name:
+                            failed_checks.append(state.step.check_name)
+                        if fail_fast and not failed_fast:
+                            # Dependents are marked before cancellation stops the marking.
+                            fail_dependents()
+                            failed_fast = True
+                            cancel_running_processes()
+        except BaseException:
+            cancel_running_processes()
+            raise
+        finally:
+            if live:
+                live.stop()
+
+    # Cancellation by the failed step does not affect steps executed later.
+    if failed_fast:
+        _cancelled.clear()
+
+    for state in states.values():
+        if state.status == "pending":
+            state.status = "cancelled"
+
+    _print_failed_step_logs(states)
+
+    cancelled_checks = [state.step.check_name for state in states.values()
+                        if state.status == "cancelled" and state.step.check_name]
+    if cancelled_checks:
+        print_warning(
+            "The following checks were cancelled:\n" +
+            "\n".join(f"- {check_name}" for check_name in cancelled_checks))
+
+    # Checks which did not run after the first failure did not pass either.
+    if failed_fast:
+        failed_checks += [name for name in cancelled_checks if name not in failed_checks]
+
+    return failed_checks
+
+
+def print_failed_checks(failed_checks: list[str]):
     color = "red" if failed_checks else "green"
 
     error_console.print(
@@ -229,6 +1084,9 @@ def print_failed_checks_and_exit(failed_checks: list[str]):
     else:
         error_console.print("[green bold]Checks succeded")
 
+
+def print_failed_checks_and_exit(failed_checks: list[str]):
+    print_failed_checks(failed_checks)
     sys.exit(1 if len(failed_checks) > 0 else 0)
 
 
@@ -240,3 +1098,154 @@ def is_linux() -> bool:
 @cache
 def is_darwin() -> bool:
     return "darwin" in SYSTEM
+
+
+def run_calibration_benchmark() -> float:
+    """Returns the median time in seconds of a fixed single-threaded workload."""
+    chunk = bytes(2**20)
+    timings = []
+    for _ in range(CALIBRATION_RUNS):
+        start = time.perf_counter()
+        digest = hashlib.sha256()
+        for _ in range(CALIBRATION_SIZE // len(chunk)):
+            digest.update(chunk)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def get_timeout_factor() -> float:
+    """Returns the factor of test timeouts for this machine, see `cli calibrate`."""
+    return load_cache("calibration").get("factor", 1.0)
+
+
+def get_available_memory() -> int | None:
+    """Returns the memory available for new processes in bytes, or None if it is unknown."""
+    if not is_linux():
+        return None
+    with open("/proc/meminfo") as meminfo:
+        for line in meminfo:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def _parse_cpu_list(text: str) -> list[int]:
+    """Parses lists of cpus like 0-3,8-11 used by the kernel."""
+    cpus = []
+    for part in text.strip().split(","):
+        if part:
+            first, _, last = part.partition("-")
+            cpus += range(int(first), int(last or first) + 1)
+    return cpus
+
+
+def _get_cpu_cores() -> list[tuple[int, tuple[int, ...]]]:
+    """
+    Returns physical cores available to the process as pairs of the NUMA node and the cpus of
+    the core, i.e. its hyperthreads.
+    """
+    available_cpus = os.sched_getaffinity(0)
+
+    cpu_nodes = {}
+    for node_path in Path("/sys/devices/system/node").glob("node[0-9]*"):
+        try:
+            for cpu in _parse_cpu_list((node_path / "cpulist").read_text()):
+                cpu_nodes[cpu] = int(node_path.name.removeprefix("node"))
+        except OSError:
+            pass
+
+    cores = {}
+    for cpu in sorted(available_cpus):
+        try:
+            siblings = _parse_cpu_list(Path(
+                f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list").read_text())
+        except OSError:
+            siblings = [cpu]
+        core = tuple(sorted(available_cpus.intersection(siblings)))
+        cores.setdefault(core, cpu_nodes.get(cpu, 0))
+
+    return [(node, core) for core, node in cores.items()]
+
+
+def _set_process_tree_affinity(pid: int, cpus: set[int]):
+    """
+    Sets the affinity of all threads of the process and of its descendants. Processes started
+    later inherit it.
+    """
+    try:
+        threads = [int(name) for name in os.listdir(f"/proc/{pid}/task")]
+    except OSError:
+        threads = [pid]
+
+    for thread in threads:
+        try:
+            os.sched_setaffinity(thread, cpus)
+            children = Path(f"/proc/{pid}/task/{thread}/children").read_text().split()
+        except OSError:
+            continue
+        for child in children:
+            _set_process_tree_affinity(int(child), cpus)
+
+
+class _CpuAllocator:
+    """
+    Hands out disjoint sets of cpus made of whole physical cores. A set is taken from a single
+    NUMA node when one has enough free cores, the fullest such node is used to keep the others
+    free. Added processes run on the free cores, they are moved when the free cores change.
+    """
+
+    def __init__(self):
+        self._cores = _get_cpu_cores()
+        self._free = list(self._cores)
+        self._processes: set[subprocess.Popen] = set()
+        self._lock = threading.Lock()
+
+    def _get_free_cpus(self) -> set[int]:
+        # With every core taken, processes of other steps share them rather than stop.
+        return {cpu for _, cpus in self._free or self._cores for cpu in cpus}
+
+    def _move_processes(self):
+        cpus = self._get_free_cpus()
+        for process in self._processes:
+            _set_process_tree_affinity(process.pid, cpus)
+
+    def add_process(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.add(process)
+            _set_process_tree_affinity(process.pid, self._get_free_cpus())
+
+    def remove_process(self, process: subprocess.Popen):
+        with self._lock:
+            self._processes.discard(process)
+
+    def allocate(self, cores: int) -> set[int] | None:
+        with self._lock:
+            cpu_set = self._allocate(cores)
+            if cpu_set:
+                self._move_processes()
+            return cpu_set
+
+    def _allocate(self, cores: int) -> set[int] | None:
+        cores = min(cores, len(self._cores))
+        if len(self._free) < cores:
+            return None
+
+        free_by_node: dict[int, list[tuple[int, tuple[int, ...]]]] = {}
+        for core in self._free:
+            free_by_node.setdefault(core[0], []).append(core)
+
+        fitting_nodes = [node for node, free in free_by_node.items() if len(free) >= cores]
+        if fitting_nodes:
+            chosen = free_by_node[min(fitting_nodes, key=lambda node: len(free_by_node[node]))]
+        else:
+            chosen = sorted(self._free, key=lambda core: -len(free_by_node[core[0]]))
+        chosen = chosen[:cores]
+
+        for core in chosen:
+            self._free.remove(core)
+        return {cpu for _, cpus in chosen for cpu in cpus}
+
+    def release(self, cpu_set: set[int]):
+        with self._lock:
+            self._free += [core for core in self._cores if cpu_set.issuperset(core[1])]
+            self._move_processes()
@@ -1,15 +1,15 @@
 #!/usr/bin/env python
 
-import git
+import importlib
 import json
 import lib
 import os
 import re
-import subprocess
 import sys
 
 from pathlib import Path
 from rich.containers import Renderables
+from rich.prompt import Confirm
 from rich.tree import Tree
 
 import rich_click as click
@@ -18,6 +18,60 @@ import rich_click.rich_click as rc
 
 VERSION = os.environ.get("_CLI_VERSION")
 
+# Commands defined outside of this file, they are imported only when invoked.
+LAZY_COMMANDS = {
+    "configure": "modules.cpp:configure",
+    "build": "modules.cpp:build",
+    "setup-clion": "modules.cpp:setup_clion",
+    "setup-vscode": "modules.cpp:setup_vscode",
+    "clangd-path": "modules.cpp:clangd_path",
+    "daemon": "daemon:daemon",
+    "cache": "build_cache:cache",
+}
+
+PRIVATE_LAZY_COMMANDS = {
+    "check": "private:check",
+    "grade": "private:grade",
+    "update-manytask": "private:update_manytask",
+    "report": "private:report",
+    "export": "private:export",
+    "fix-ci-config-path": "private:fix_ci_config_path",
+    "fix-ci-config-timeout": "private:fix_ci_config_timeout",
+    "print-python-path": "private:print_python_path",
+    "worker": "grade_queue:worker",
+    "queue": "grade_queue:grade_queue",
+}
+
+if os.environ.get("PRIVATE"):
+    LAZY_COMMANDS |= PRIVATE_LAZY_COMMANDS
+
+# Short help of lazy commands, so that `cli --help` does not import them.
+LAZY_COMMAND_HELP = {
+    "configure": "Configure profile for autocompletion.",
+    "build": "Build task executable(s).",
+    "setup-clion": "Setup CLion targets.",
+    "setup-vscode": "Setup VS Code workspace.",
+    "clangd-path": "Print clangd path.",
+    "daemon": "Manage the background daemon of the course.",
+    "cache": "Export and import snapshots of build directories.",
+    "check": "Check the private repository.",
+    "grade": "Grade student's tasks.",
+    "update-manytask": "Update manytask config.",
+    "report": "Manage reports to manytask.",
+    "export": "Export files to the public repository.",
+    "fix-ci-config-path": "Fix CI config path in student's repositories.",
+    "fix-ci-config-timeout": "Fix CI default timeout in student's repositories.",
+    "print-python-path": "Print the PYTHONPATH entries.",
+    "worker": "Grade jobs from the queue.",
+    "queue": "Manage the queue of grading jobs.",
+}
+
+# Commands which use the build directories, startup checks of the modules run only for them.
+STARTUP_CHECK_COMMANDS = {
+    "test", "lint", "run-checks", "submit", "build", "configure", "setup-clion", "setup-vscode",
+    "check", "grade",
+}
+
 
 ################################################################################
 
@@ -42,13 +96,46 @@ def check_cli_version():
 ################################################################################
 
 
-@click.group()
-def cli():
+class LazyGroup(click.RichGroup):
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(super().list_commands(ctx) + list(LAZY_COMMANDS))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name not in LAZY_COMMANDS:
+            return super().get_command(ctx, cmd_name)
+
+        # Help only lists commands, the command is imported when it is resolved to be invoked.
+        return click.RichCommand(cmd_name, short_help=LAZY_COMMAND_HELP[cmd_name])
+
+    def resolve_command(self, ctx: click.Context,
+                        args: list[str]) -> tuple[str | None, click.Command | None, list[str]]:
+        if args and args[0] in LAZY_COMMANDS:
+            module_name, command_name = LAZY_COMMANDS[args[0]].split(":")
+            return args[0], getattr(importlib.import_module(module_name), command_name), args[1:]
+        return super().resolve_command(ctx, args)
+
+
+@click.group(cls=LazyGroup)
+@click.option("--trace", "trace_path", envvar="CLI_TRACE", type=click.Path(dir_okay=False),
+              help="Write a Chrome trace of the command to the file (also set by CLI_TRACE).")
+@click.option("--output", "output_mode", envvar="CLI_OUTPUT", default="auto", show_default=True,
+              type=click.Choice(lib.OUTPUT_MODES),
+              help="How to show progress of checks: a live table, plain lines or the full output "
+              "of every check. By default a live table is used on terminals and plain lines in CI "
+              "(also set by CLI_OUTPUT).")
+@click.pass_context
+def cli(ctx: click.Context, trace_path: str | None, output_mode: str):
     """
     Marvin — the code assistant with a brain the size of a planet (but happy to
     help you with your homework anyway). Seamlessly build, check, and submit
     your course assignments.
     """
+    if trace_path:
+        lib.enable_tracing(Path(trace_path))
+    lib.set_output_mode(output_mode)
+
+    if ctx.invoked_subcommand in STARTUP_CHECK_COMMANDS:
+        lib.execute_for_each_module("startup_checks")
 
 
 @cli.command()
@@ -59,20 +146,23 @@ def cli():
               "Wildcards can also be used. For example: \"-f 'Test*' -f EdgeCase\".")
 @click.option("--sandbox", is_flag=True,
               help="Run tests in an isolated environment (only for Linux).")
-def test(profiles: tuple[str, ...], filters: tuple[str, ...], sandbox: bool):
+@click.option("--no-cache", is_flag=True,
+              help="Run tests even if they passed before with the same inputs.")
+def test(profiles: tuple[str, ...], filters: tuple[str, ...], sandbox: bool, no_cache: bool):
     """Run tests for the current task."""
 
-    lib.print_failed_checks_and_exit(
-        list(lib.execute_for_each_module_yielding(
-            "run_tests", lib.get_cwd_task(), profiles, filters, sandbox)))
+    lib.print_failed_checks_and_exit(lib.execute_steps(
+        lib.collect_steps_for_each_module(
+            "test_steps", lib.get_cwd_task(), profiles, filters, sandbox),
+        use_cache=not no_cache))
 
 
 @cli.command()
 def lint():
     """Run linter checks for the current task."""
 
-    lib.print_failed_checks_and_exit(
-        list(lib.execute_for_each_module_yielding("run_linter", lib.get_cwd_task())))
+    lib.print_failed_checks_and_exit(lib.execute_steps(
+        lib.collect_steps_for_each_module("lint_steps", lib.get_cwd_task())))
 
 
 @cli.command()
@@ -80,34 +170,26 @@ def lint():
 def format(fix: bool):
     """Run format checks for the current task."""
 
-    lib.print_failed_checks_and_exit(
-        list(lib.execute_for_each_module_yielding("run_format", lib.get_cwd_task(), fix)))
+    lib.print_failed_checks_and_exit(lib.execute_steps(
+        lib.collect_steps_for_each_module("format_steps", lib.get_cwd_task(), fix)))
 
 
 @cli.command()
 @click.option("--fail-fast", is_flag=True, help="Finish checks on the first error")
-def run_checks(fail_fast):
+@click.option("-j", "--jobs", default=1, show_default=True,
+              help="Number of steps to run concurrently.")
+@click.option("--no-cache", is_flag=True,
+              help="Run checks even if they passed before with the same inputs.")
+def run_checks(fail_fast: bool, jobs: int, no_cache: bool):
     """Run format, test and lint checks for the current task."""
 
     task = lib.get_cwd_task()
 
-    failed_checks = []
+    steps = []
+    for steps_function in ["format_steps", "test_steps", "lint_steps"]:
+        steps += lib.collect_steps_for_each_module(steps_function, task)
 
-    def try_finish():
-        if not fail_fast or len(failed_checks) == 0:
-            return
-
-        lib.print_failed_checks(failed_checks)
-        exit(1)
-
-    for check_function in ["run_format", "run_tests", "run_linter"]:
-        for failed_check in lib.execute_for_each_module_yielding(check_function, task):
-            failed_checks.append(failed_check)
-            if fail_fast:
-                lib.print_failed_checks(failed_checks)
-                sys.exit(1)
-
-    lib.print_failed_checks_and_exit(failed_checks)
+    lib.print_failed_checks_and_exit(lib.execute_steps(steps, jobs, fail_fast, not no_cache))
 
 
 @cli.command()
@@ -117,11 +199,41 @@ def clean(module: str | None = None):
     lib.execute_for_each_module("clean", module=module)
 
 
+def _get_preflight_steps(task: dict) -> list[lib.Step]:
+    """Returns the format check and the cheapest tests of the task."""
+    test_steps = lib.collect_steps_for_each_module("test_steps", task)
+    test_costs = {step.check_name: step.cost for step in test_steps if step.check_name}
+
+    cheapest_tests = set()
+    if test_costs:
+        min_cost = min(test_costs.values())
+        cheapest_tests = {name for name, cost in test_costs.items() if cost == min_cost}
+
+    return lib.collect_steps_for_each_module("format_steps", task) + \
+        lib.select_steps(test_steps, cheapest_tests)
+
+
 @cli.command()
-def submit():
+@click.option("--preflight/--no-preflight", default=False, show_default=True,
+              help="Check format and run the cheapest tests before submitting. Checks which "
+              "passed before with the same inputs are not run again.")
+def submit(preflight: bool):
     """Submit the current task to the grading system."""
+    import git
+
     task = lib.get_cwd_task()
 
+    if preflight:
+        failed_checks = lib.execute_steps(_get_preflight_steps(task))
+        if failed_checks:
+            lib.print_failed_checks(failed_checks)
+            # Without a terminal to ask, e.g. in IDE tasks and scripts, the task is submitted.
+            if not sys.stdin.isatty():
+                lib.print_warning("Checks failed, submitting the task anyway")
+            elif not Confirm.ask("[yellow]Checks failed, do you want to submit the task anyway?",
+                                 default=False, console=lib.error_console):
+                raise click.Abort()
+
     lib.print_inline_info(f"[bold]Submitting task {task['task_name']}.\n")
 
     repo = git.Repo(lib.get_course_directory())
@@ -136,7 +248,7 @@ def submit():
     staged_files = repo.index.diff("HEAD")
     if staged_files:
         lib.error_console.print("Successfully staged these files:")
-        for diff in repo.index.diff("HEAD"):
+        for diff in staged_files:
             lib.error_console.print(f" - {diff.a_path}")
     else:
         lib.error_console.print("[yellow bold]No changes were staged for commit.")
@@ -144,17 +256,18 @@ def submit():
 
     commit = repo.index.commit(f"Submit task {task['task_name']}")
     author = commit.author
-    subprocess.run([
+    lib.run([
         "git", "-c", f"user.name={author.name}", "-c", f"user.email={author.email}",
         "notes", "add", "-m", json.dumps({"tasks": [task['task_name']]})
     ]).check_returncode()
 
     lib.error_console.print("[bold]Pushing changes to 'origin'.\n")
     try:
-        repo.remote("origin").push([
-            f'refs/heads/{repo.active_branch.name}',
-            "refs/notes/commits",
-        ])
+        with lib.span("push"):
+            repo.remote("origin").push([
+                f'refs/heads/{repo.active_branch.name}',
+                "refs/notes/commits",
+            ])
     except git.exc.GitCommandError as err:
         lib.print_error(Renderables([
             "[red bold]Could not push changes to remote repository.",
@@ -178,6 +291,29 @@ def submit():
     lib.error_console.print(f"[bold]Link to commit: {commit_link}")
 
 
+@cli.command()
+def calibrate():
+    """
+    Measure the speed of this machine and scale test timeouts to it.
+
+    Timeouts are multiplied by the ratio of the measured time to 'calibration_reference_time'
+    of the course config, which is measured on the reference machine. They are never reduced.
+    """
+    measured_time = lib.run_calibration_benchmark()
+    reference_time = lib.load_config().get("calibration_reference_time")
+    if not reference_time:
+        lib.print_warning(
+            f"Benchmark took {measured_time:.2f}s. Set 'calibration_reference_time' of the course "
+            "config to the time on the reference machine to scale timeouts.")
+        return
+
+    factor = max(1.0, measured_time / reference_time)
+    lib.store_cache("calibration", {"factor": factor, "measured_time": measured_time})
+    lib.print_success(
+        f"Benchmark took {measured_time:.2f}s, {reference_time:.2f}s on the reference machine.\n"
+        f"Test timeouts are multiplied by {factor:.2f}")
+
+
 @cli.command()
 def list_tasks():
     """List all available course tasks."""
@@ -200,9 +336,6 @@ def list_tasks():
     lib.console.print(tree)
 
 
-lib.execute_for_each_module("add_commands", cli)
-
-
 ################################################################################
 
 
@@ -224,7 +357,7 @@ rc.COMMAND_GROUPS = {
         },
         {
             "name": "Build & Setup Commands",
-            "commands": [clean.name, "build", "configure"]
+            "commands": [clean.name, "build", "configure", calibrate.name, "cache", "daemon"]
         },
         {
             "name": "Task Management Commands",
@@ -238,34 +371,10 @@ rc.COMMAND_GROUPS = {
 }
 
 if os.environ.get("PRIVATE"):
-    import private
-
-    cli.add_command(private.check)
-    cli.add_command(private.grade)
-    cli.add_command(private.update_manytask)
-    cli.add_command(private.export)
-    cli.add_command(private.fix_ci_config_path)
-    cli.add_command(private.fix_ci_config_timeout)
-    cli.add_command(private.print_python_path)
-
     rc.COMMAND_GROUPS["*"].append({
         "name": "Staff Commands",
-        "commands": [getattr(getattr(private, command), "name") for command in [
-                "check",
-                "grade",
-                "update_manytask",
-                "export",
-                "fix_ci_config_path",
-                "fix_ci_config_timeout",
-                "print_python_path"
-        ]],
+        "commands": list(PRIVATE_LAZY_COMMANDS),
     })
-    rc.COMMAND_GROUPS["cli check*"] = [
-        {
-            "name": "Staff Commands",
-            "commands": [str(command) for command in private.check.commands],
-        },
-    ]
 
     rc.STYLE_COMMANDS_TABLE_COLUMN_WIDTH_RATIO = (2, 5)
 
@@ -274,9 +383,9 @@ if os.environ.get("PRIVATE"):
 
 
 def main():
-    check_cli_version()
-    lib.execute_for_each_module("startup_checks")
-    cli()
+    with lib.span("cli"):
+        check_cli_version()
+        cli()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,15 @@
 import rich_click as click
+import functools
+import hashlib
 import json
 import lib
 import os
 import shutil
+import struct
 import subprocess
 import sys
+import threading
+import time
 import xml.etree.ElementTree as ET
 
 
@@ -22,9 +27,20 @@ ASAN_SYMBOLIZER_PATH = os.environ["ASAN_SYMBOLIZER_PATH"]
 TSAN_SYMBOLIZER_PATH = os.environ["TSAN_SYMBOLIZER_PATH"]
 VERSION_BUILD = os.environ["VERSION_BUILD"]
 
+_configure_cache_lock = threading.Lock()
+
 SOURCE_EXT = {".cpp", ".c", ".cc"}
 HEADER_EXT = {".hpp", ".h", ".ipp"}
 
+# Files of build directories which may contain absolute paths of the course.
+RELOCATED_FILE_EXT = {".ninja", ".cmake", ".txt", ".json", ".d", ".rsp"}
+NINJA_DEPS_SIGNATURE = b"# ninjadeps\n"
+NINJA_DEPS_VERSION = 4
+BINARY_SNIFF_SIZE = 8192
+
+# Expected slowdown of tests built with profiles containing these names, relative to release.
+PROFILE_COSTS = {"debug": 2.0, "asan": 3.0, "tsan": 10.0}
+
 ################################################################################
 
 
@@ -47,27 +63,28 @@ def _get_source_and_header_files() -> list[Path]:
 
 
 def _build_executable(target: str, profile: str):
-    build_directory = _get_build_directory_for_profile(profile)
+    with lib.span("build", target=target, profile=profile):
+        build_directory = _get_build_directory_for_profile(profile)
 
-    lib.print_inline_info(
-        f"Building target {target}.{profile} in build directory {build_directory}"
-    )
+        lib.print_inline_info(
+            f"Building target {target}.{profile} in build directory {build_directory}"
+        )
 
-    subprocess.run([
-        "cmake",
-        "--build",
-        build_directory,
-        "--target",
-        target
-    ]).check_returncode()
-
-    if lib.is_darwin() and (build_directory / target).is_file():
-        # It is necessary to generate .dSYM directory for symbolizers to work correctly.
-        subprocess.run([
-            "dsymutil",
-            build_directory / target,
+        lib.run([
+            "cmake",
+            "--build",
+            build_directory,
+            "--target",
+            target
         ]).check_returncode()
 
+        if lib.is_darwin() and (build_directory / target).is_file():
+            # It is necessary to generate .dSYM directory for symbolizers to work correctly.
+            lib.run([
+                "dsymutil",
+                build_directory / target,
+            ]).check_returncode()
+
 
 def _run_single_test(
         check_name: str,
@@ -76,56 +93,63 @@ def _run_single_test(
         sandbox: bool,
         timeout: float,
         filter: str | None = None) -> bool:
-    lib.print_info(f"Running test {check_name}")
+    with lib.span("test", check=check_name, profile=profile):
+        lib.print_info(f"Running test {check_name}")
 
-    try:
-        _configure_single_profile(profile)
-        _build_executable(target, profile)
-
-        build_directory = _get_build_directory_for_profile(profile)
+        try:
+            build_directory = _get_build_directory_for_profile(profile)
 
-        lib.print_inline_info(
-            f"Running test {check_name} with timeout {timeout} seconds",
-        )
+            lib.print_inline_info(
+                f"Running test {check_name} with timeout {timeout:.0f} seconds",
+            )
 
-        if not sandbox:
-            subprocess.run(
-                [build_directory / target] + ([filter] if filter else []),
-                timeout=timeout
-            ).check_returncode()
+            start = time.perf_counter()
+            if not sandbox:
+                lib.run(
+                    [build_directory / target] + ([filter] if filter else []),
+                    timeout=timeout
+                ).check_returncode()
+            else:
+                lib.run([
+                    "bwrap",
+                    "--die-with-parent",
+                    "--unshare-pid",
+                    "--ro-bind",
+                    "/nix",
+                    "/nix",
+                    "--ro-bind",
+                    "/proc",
+                    "/proc",
+                    "--ro-bind",
+                    build_directory / target,
+                    target,
+                    "--clearenv",
+                    "--setenv",
+                    "TSAN_SYMBOLIZER_PATH",
+                    TSAN_SYMBOLIZER_PATH,
+                    "--setenv",
+                    "ASAN_SYMBOLIZER_PATH",
+                    ASAN_SYMBOLIZER_PATH,
+                    f"./{target}",
+                ] + ([filter] if filter else []),
+                    timeout=timeout).check_returncode()
+        except subprocess.CalledProcessError as error:
+            lib.print_inline_info(str(error))
+            lib.print_error(f"Test {check_name} failed")
+            return False
+        except subprocess.TimeoutExpired as error:
+            lib.print_inline_info(str(error))
+            lib.print_error(f"Test {check_name} timed out after {timeout:.0f} seconds")
+            return False
         else:
-            subprocess.run([
-                "bwrap",
-                "--ro-bind",
-                "/nix",
-                "/nix",
-                "--ro-bind",
-                "/proc",
-                "/proc",
-                "--ro-bind",
-                build_directory / target,
-                target,
-                "--clearenv",
-                "--setenv",
-                "TSAN_SYMBOLIZER_PATH",
-                TSAN_SYMBOLIZER_PATH,
-                "--setenv",
-                "ASAN_SYMBOLIZER_PATH",
-                ASAN_SYMBOLIZER_PATH,
-                f"./{target}",
-            ] + ([filter] if filter else []),
-                timeout=timeout).check_returncode()
-    except subprocess.CalledProcessError as error:
-        lib.print_inline_info(str(error))
-        lib.print_error(f"Test {check_name} failed")
-        return False
-    except subprocess.TimeoutExpired as error:
-        lib.print_inline_info(str(error))
-        lib.print_error(f"Test {check_name} timed out")
-        return False
-    else:
-        lib.print_success(f"Test {check_name} succeded")
-        return True
+            lib.print_success(
+                f"Test {check_name} succeded in {time.perf_counter() - start:.1f} of "
+                f"{timeout:.0f} seconds")
+            return True
+
+
+def _get_default_profile() -> str:
+    return lib.load_config()["cpp_default_profile"]
 
 
 def _to_upper_case(profile: str):
@@ -135,29 +159,59 @@ def _to_upper_case(profile: str):
     return profile.replace("-", "_").upper()
 
 
-def _configure_single_profile(profile: str):
-    build_directory = _get_cpp_build_directory()
-    if not build_directory.exists():
-        build_directory.mkdir(parents=True)
-        (build_directory / ".version").write_text(VERSION_BUILD)
+def _get_configure_fingerprint(args: list) -> str:
+    return hashlib.sha256(json.dumps([
+        [str(arg) for arg in args],
+        VERSION_BUILD,
+        str(lib.get_tool_path("cmake")),
+        os.environ.get("CC"),
+        os.environ.get("CXX"),
+    ]).encode()).hexdigest()
 
-    build_directory = _get_build_directory_for_profile(profile)
-    lib.print_inline_info(
-        f"Configuring profile {profile} in build directory {build_directory}"
-    )
 
-    subprocess.run([
+def _get_configure_args(profile: str) -> list:
+    return [
         "cmake",
         "-S", lib.get_course_directory(),
-        "-B", build_directory,
+        "-B", _get_build_directory_for_profile(profile),
         f"-DCMAKE_BUILD_TYPE={_to_upper_case(profile)}",
         "-GNinja",
         "-Wno-dev"
-    ]).check_returncode()
+    ]
 
-    codegen_target = lib.load_config().get("cpp_codegen_target")
-    if codegen_target:
-        _build_executable(codegen_target, profile)
+
+def _configure_single_profile(profile: str, force: bool = False):
+    """
+    Configures the profile. Unless forced, cmake is not run again if the profile was already
+    configured with the same arguments: ninja re-runs it by itself when CMakeLists change.
+    """
+    with lib.span("configure", profile=profile):
+        build_directory = _get_cpp_build_directory()
+        if not build_directory.exists():
+            build_directory.mkdir(parents=True)
+            (build_directory / ".version").write_text(VERSION_BUILD)
+
+        build_directory = _get_build_directory_for_profile(profile)
+        args = _get_configure_args(profile)
+
+        fingerprint = _get_configure_fingerprint(args)
+        fingerprints = lib.load_cache("cpp-configure")
+        if force or fingerprints.get(profile) != fingerprint or \
+                not (build_directory / "build.ninja").exists():
+            lib.print_inline_info(
+                f"Configuring profile {profile} in build directory {build_directory}"
+            )
+            lib.run(args).check_returncode()
+
+            # Profiles may be configured concurrently, so the cache is reloaded before update.
+            with _configure_cache_lock:
+                fingerprints = lib.load_cache("cpp-configure")
+                fingerprints[profile] = fingerprint
+                lib.store_cache("cpp-configure", fingerprints)
+
+        codegen_target = lib.load_config().get("cpp_codegen_target")
+        if codegen_target:
+            _build_executable(codegen_target, profile)
 
 
 @cache
@@ -317,43 +371,45 @@ def _setup_clion_tools():
     toolset_tree.write(toolset_path)
 
 
-def _run_linter(profile: str, lint_files: list[str]):
-    _configure_single_profile(profile)
-    lib.print_inline_info(
-        "Running linter"
-    )
-    subprocess.run(
-        ["clang-tidy", "-p", _get_build_directory_for_profile(profile),
-         "--config-file", lib.get_course_directory() / ".clang-tidy"] + lint_files
-    ).check_returncode()
+def _run_linter(check_name: str, profile: str, lint_files: list[str]):
+    with lib.span("lint", check=check_name, profile=profile):
+        lib.print_inline_info(
+            "Running linter"
+        )
+        lib.run(
+            ["clang-tidy", "-p", _get_build_directory_for_profile(profile),
+             "--config-file", lib.get_course_directory() / ".clang-tidy"] + lint_files
+        ).check_returncode()
+
+
+def _run_format(check_name: str, source_files: list[str]):
+    with lib.span("format", check=check_name):
+        lib.run(
+            ["clang-format", "--dry-run", "-Werror",
+             f"--style=file:{lib.get_course_directory() / '.clang-format'}"] + source_files
+        ).check_returncode()
 
 
-def _run_format(source_files: list[str]):
-    subprocess.run(
-        ["clang-format", "--dry-run", "-Werror",
-         f"--style=file:{lib.get_course_directory() / '.clang-format'}"] + source_files
-    ).check_returncode()
+def _run_fix_format(check_name: str, source_files: list[str]):
+    with lib.span("format", check=check_name):
+        lib.run(
+            ["clang-format", "-i",
+             f"--style=file:{lib.get_course_directory() / '.clang-format'}"] + source_files
+        ).check_returncode()
 
 
-def _run_fix_format(source_files: list[str]):
-    subprocess.run(
-        ["clang-format", "-i",
-         f"--style=file:{lib.get_course_directory() / '.clang-format'}"] + source_files
-    ).check_returncode()
+def _get_format_cache_key(source_files: list[Path]) -> str:
+    return lib.get_input_key(
+        source_files + [lib.get_course_directory() / ".clang-format"],
+        clang_format=lib.get_tool_path("clang-format"))
 
 
 def _get_clangd_path() -> str:
-    return subprocess.check_output([
-        "which",
-        "clangd",
-    ])[:-1].decode()
+    return str(lib.get_tool_path("clangd"))
 
 
 def _get_gdb_path() -> str:
-    return subprocess.check_output([
-        "which",
-        "gdb",
-    ])[:-1].decode()
+    return str(lib.get_tool_path("gdb"))
 
 
 def _get_test_name(task_name: str, target: str, profile: str) -> str:
@@ -365,7 +421,7 @@ def _get_vscode_build_label(test_name: str) -> str:
 
 
 def _configure_and_copy_compile_commands(profile: str):
-    _configure_single_profile(profile)
+    _configure_single_profile(profile, force=True)
 
     shutil.copy(
         _get_build_directory_for_profile(profile) / "compile_commands.json",
@@ -461,30 +517,225 @@ def _setup_vscode_launch():
         json.dump({"configurations": configurations}, f, indent=4)
 
 
+def _get_configure_step(profile: str) -> lib.Step:
+    return lib.Step(
+        key=f"cpp.configure.{profile}",
+        function=functools.partial(_configure_single_profile, profile),
+        lock=f"cpp.{profile}")
+
+
+def _get_build_step(target: str, profile: str) -> lib.Step:
+    return lib.Step(
+        key=f"cpp.build.{target}.{profile}",
+        function=functools.partial(_build_executable, target, profile),
+        dependencies=[f"cpp.configure.{profile}"],
+        lock=f"cpp.{profile}",
+        # Ninja builds with all cores.
+        cpus=os.cpu_count() or 1)
+
+
+def _run_lint_check(check_name: str, profile: str, lint_files: list[str]) -> bool:
+    lib.print_info(f"Running lint check {check_name} for {len(lint_files)} file(s)")
+
+    try:
+        _run_linter(check_name, profile, lint_files)
+    except subprocess.CalledProcessError:
+        lib.print_error(f"Lint check with profile {profile} failed")
+        return False
+    else:
+        lib.print_success(f"Lint check with profile {profile} succeded")
+        return True
+
+
+def _run_format_check(check_name: str, source_files: list[str], fix: bool) -> bool:
+    if fix:
+        lib.print_inline_info(f"Fixing format for {len(source_files)} files",)
+        _run_fix_format(check_name, source_files)
+        return True
+
+    lib.print_info(f"Running format check {check_name} for {len(source_files)} file(s)")
+
+    try:
+        _run_format(check_name, source_files)
+    except subprocess.CalledProcessError:
+        lib.print_error("Format check failed")
+        return False
+    else:
+        lib.print_success("Format check succeded")
+        return True
+
+
 ################################################################################
 
 
-def run_tests(
+def _get_test_cache_key(task: dict, target: str, profile: str, sandbox: bool, timeout: float,
+                        filter: str) -> str:
+    task_directory = lib.get_course_directory() / task["task_name"]
+    return lib.get_input_key(
+        [task_directory / file for file in task["submit_files"]] +
+        [_get_build_directory_for_profile(profile) / target],
+        task=task,
+        profile=profile,
+        sandbox=sandbox,
+        timeout=timeout,
+        filter=filter,
+    )
+
+
+@cache
+def _get_ninja_deps(profile: str) -> dict[str, set[Path]] | None:
+    """Returns headers and sources of object files recorded by ninja, or None if not built."""
+    build_directory = _get_build_directory_for_profile(profile)
+    if not (build_directory / ".ninja_deps").exists():
+        return None
+
+    deps = {}
+    output = lib.check_output(["ninja", "-C", build_directory, "-t", "deps"]).decode()
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            current = deps.setdefault(line.split(": #deps")[0], set())
+        else:
+            current.add((build_directory / line.strip()).resolve())
+    return deps
+
+
+@cache
+def _get_target_inputs(target: str, profile: str) -> set[Path] | None:
+    """
+    Returns all files the target is built from, or None if it is unknown. The profile is
+    configured first if needed. Headers are included only if the objects of the target were built.
+    """
+    build_directory = _get_build_directory_for_profile(profile)
+    try:
+        if not (build_directory / "build.ninja").exists():
+            _configure_single_profile(profile)
+        output = lib.check_output(["ninja", "-C", build_directory, "-t", "inputs", target])
+    except subprocess.CalledProcessError:
+        return None
+
+    deps = _get_ninja_deps(profile)
+    inputs = set()
+    for path in output.decode().splitlines():
+        inputs.add((build_directory / path).resolve())
+        if path.endswith(".o") and deps is not None:
+            if path not in deps:
+                return None
+            inputs.update(deps[path])
+    return inputs
+
+
+@cache
+def _get_source_directories(profile: str) -> set[Path] | None:
+    """Returns directories of the sources compiled in the profile."""
+    compile_commands_path = _get_build_directory_for_profile(profile) / "compile_commands.json"
+    try:
+        commands = json.loads(compile_commands_path.read_text())
+    except (OSError, ValueError):
+        return None
+    return {(Path(command["directory"]) / command["file"]).resolve().parent
+            for command in commands}
+
+
+def _is_target_affected(target: str, profile: str, changed_files: set[Path]) -> bool:
+    """
+    Checks if the target is built from the changed files. Until the profile is built, headers of
+    the objects are not known: a changed file affects the target if it is next to the sources of
+    the target or in a directory without sources of the profile, like a directory of headers.
+    """
+    inputs = _get_target_inputs(target, profile)
+    if inputs is None or not inputs.isdisjoint(changed_files):
+        return True
+    if _get_ninja_deps(profile) is not None:
+        return False
+
+    source_directories = _get_source_directories(profile)
+    if source_directories is None:
+        return True
+    target_directories = {path.parent for path in inputs}
+    return any(path.parent in target_directories or path.parent not in source_directories
+               for path in changed_files)
+
+
+def affected_test_checks(task: dict, changed_files: set[Path]) -> set[str]:
+    """
+    Returns test checks of the task whose binaries are built from the changed files. Checks are
+    considered affected if the ninja graph of the profile does not know the target.
+    """
+    cpp_targets = task.get("cpp_targets", [])
+    build_files_changed = any(
+        path.name == "CMakeLists.txt" or path.suffix == ".cmake" for path in changed_files)
+
+    affected = set()
+    for target in cpp_targets:
+        for profile in cpp_targets[target]["profiles"]:
+            if build_files_changed or _is_target_affected(target, profile, changed_files):
+                affected.add(_get_test_name(task["task_name"], target, profile))
+    return affected
+
+
+def _get_test_timeout(timeout: str, profile: str) -> float:
+    """
+    Scales the timeout of the target by the multiplier of the profile from the course config and
+    by the factor of this machine.
+    """
+    multipliers = lib.load_config().get("cpp_timeout_multipliers", {})
+    multiplier = multipliers.get(profile) or next(
+        (value for name, value in multipliers.items() if name in profile), 1.0)
+    return parse(timeout) * multiplier * lib.get_timeout_factor()
+
+
+def _get_profile_cost(profile: str) -> float:
+    return next((cost for name, cost in PROFILE_COSTS.items() if name in profile), 1.0)
+
+
+def test_steps(
         task: dict,
         profiles: list = [],
         filters: list = [],
-        sandbox: bool = False) -> Generator[str]:
+        sandbox: bool = False) -> list[lib.Step]:
     filter = ",".join(filters)
 
     cpp_targets = task.get("cpp_targets", [])
 
+    steps = []
     for target in cpp_targets:
-        timeout = parse(cpp_targets[target]["timeout"])
+        memory = cpp_targets[target].get("memory", 0) * 2**20
+        cores = cpp_targets[target].get("cores", 0)
         for profile in cpp_targets[target]["profiles"]:
             if profiles and profile not in profiles:
                 continue
 
-            check_name = _get_test_name(task["task_name"], target, profile)
-            if not _run_single_test(check_name, target, profile, sandbox, timeout, filter):
-                yield check_name
-
+            timeout = _get_test_timeout(cpp_targets[target]["timeout"], profile)
 
-def run_linter(task: dict) -> Generator[str]:
+            check_name = _get_test_name(task["task_name"], target, profile)
+            cache_key = None
+            if profile not in lib.load_config().get("cpp_uncached_profiles", []):
+                cache_key = functools.partial(
+                    _get_test_cache_key, task, target, profile, sandbox, timeout, filter)
+
+            steps += [
+                _get_configure_step(profile),
+                _get_build_step(target, profile),
+                lib.Step(
+                    key=check_name,
+                    function=functools.partial(
+                        _run_single_test, check_name, target, profile, sandbox, timeout, filter),
+                    dependencies=[f"cpp.build.{target}.{profile}"],
+                    check_name=check_name,
+                    cache_key=cache_key,
+                    memory=memory,
+                    cost=_get_profile_cost(profile),
+                    cores=cores,
+                    timeout=timeout),
+            ]
+
+    return steps
+
+
+def lint_steps(task: dict) -> list[lib.Step]:
+    steps = []
     for profile in task.get("cpp_lint_profiles", []):
 
         lint_files = [
@@ -493,40 +744,35 @@ def run_linter(task: dict) -> Generator[str]:
 
         check_name = f"{task["task_name"]}#cpp.lint.{profile}"
 
-        lib.print_info(f"Running lint check {check_name} for {len(lint_files)} file(s)")
+        steps += [
+            _get_configure_step(profile),
+            lib.Step(
+                key=check_name,
+                function=functools.partial(_run_lint_check, check_name, profile, lint_files),
+                dependencies=[f"cpp.configure.{profile}"],
+                check_name=check_name),
+        ]
 
-        try:
-            _run_linter(profile, lint_files)
-        except subprocess.CalledProcessError:
-            lib.print_error(f"Lint check with profile {profile} failed")
-            yield check_name
-        else:
-            lib.print_success(f"Lint check with profile {profile} succeded")
+    return steps
 
 
-def run_format(task: dict, fix: bool = False) -> Generator[str]:
+def format_steps(task: dict, fix: bool = False) -> list[lib.Step]:
     source_files = [
         lib.get_course_directory() / task["task_name"] / file for file in task["submit_files"]
         if Path(file).suffix in SOURCE_EXT | HEADER_EXT]
 
     if not source_files:
-        return
-
-    if fix:
-        lib.print_inline_info(f"Fixing format for {len(source_files)} files",)
-        _run_fix_format(source_files)
-        return
+        return []
 
     check_name = f"{task["task_name"]}#cpp.format"
-    lib.print_info(f"Running format check {check_name} for {len(source_files)} file(s)")
 
-    try:
-        _run_format(source_files)
-    except subprocess.CalledProcessError:
-        lib.print_error("Format check failed")
-        yield check_name
-    else:
-        lib.print_success("Format check succeded")
+    return [
+        lib.Step(
+            key=check_name,
+            function=functools.partial(_run_format_check, check_name, source_files, fix),
+            check_name=check_name,
+            cache_key=None if fix else functools.partial(_get_format_cache_key, source_files)),
+    ]
 
 
 def clean():
@@ -554,7 +800,95 @@ def clean():
         pass
 
 
-def lint_all() -> Generator[str]:
+def cache_paths() -> list[Path]:
+    """Returns directories of the build snapshot, outputs of the codegen target are among them."""
+    if not _get_cpp_build_directory().is_dir():
+        return []
+    return [_get_cpp_build_directory()]
+
+
+def cache_source_files() -> list[Path]:
+    """Returns files whose modification times decide what ninja rebuilds."""
+    return _get_source_and_header_files() + [
+        path for path in lib.get_files({".txt", ".cmake"})
+        if path.name == "CMakeLists.txt" or path.suffix == ".cmake"]
+
+
+def _relocate_text_files(build_directory: Path, old_prefix: bytes, new_prefix: bytes):
+    for path in build_directory.rglob("*"):
+        if path.suffix not in RELOCATED_FILE_EXT or not path.is_file():
+            continue
+        content = path.read_bytes()
+        if b"\0" not in content[:BINARY_SNIFF_SIZE] and old_prefix in content:
+            stat = path.stat()
+            path.write_bytes(content.replace(old_prefix, new_prefix))
+            os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def _relocate_ninja_deps(path: Path, old_prefix: bytes, new_prefix: bytes):
+    """
+    Rewrites paths in the binary ninja deps log. Path records are a size, the path padded with
+    zeros to 4 bytes and a checksum of the record index; dependency records are kept as is.
+    A log of another version is removed, ninja then rebuilds the objects to record their deps.
+    """
+    data = path.read_bytes()
+    header_size = len(NINJA_DEPS_SIGNATURE) + 4
+    if (not data.startswith(NINJA_DEPS_SIGNATURE) or
+            struct.unpack_from("<I", data, len(NINJA_DEPS_SIGNATURE))[0] != NINJA_DEPS_VERSION):
+        lib.print_warning(f"Unknown format of {path}, objects of the profile will be rebuilt")
+        path.unlink()
+        return
+
+    result = bytearray(data[:header_size])
+    offset = header_size
+    path_index = 0
+    while offset + 4 <= len(data):
+        (size,) = struct.unpack_from("<I", data, offset)
+        record = data[offset + 4:offset + 4 + (size & 0x7fffffff)]
+        offset += 4 + (size & 0x7fffffff)
+        if size & 0x80000000:
+            result += struct.pack("<I", size) + record
+            continue
+
+        name = record[:-4].rstrip(b"\0")
+        if name.startswith(old_prefix):
+            name = new_prefix + name[len(old_prefix):]
+        name += b"\0" * (-len(name) % 4)
+        result += struct.pack("<I", len(name) + 4) + name
+        result += struct.pack("<I", ~path_index & 0xffffffff)
+        path_index += 1
+
+    path.write_bytes(result)
+
+
+def import_cache(old_course_directory: Path):
+    """
+    Prepares the imported build snapshot: absolute paths are fixed if it was made in another
+    directory, and the profiles are marked as configured. Commands in the ninja logs keep the
+    old paths then, so ninja rebuilds their outputs.
+    """
+    old_prefix = str(old_course_directory).encode()
+    new_prefix = str(lib.get_course_directory()).encode()
+
+    if not _get_cpp_build_directory().exists():
+        return
+
+    fingerprints = lib.load_cache("cpp-configure")
+    for build_directory in _get_cpp_build_directory().iterdir():
+        if not (build_directory / "build.ninja").is_file():
+            continue
+
+        if old_prefix != new_prefix:
+            _relocate_text_files(build_directory, old_prefix, new_prefix)
+            if (build_directory / ".ninja_deps").is_file():
+                _relocate_ninja_deps(build_directory / ".ninja_deps", old_prefix, new_prefix)
+
+        profile = build_directory.name
+        fingerprints[profile] = _get_configure_fingerprint(_get_configure_args(profile))
+    lib.store_cache("cpp-configure", fingerprints)
+
+
+def lint_all() -> list[str]:
     source_files = _get_cpp_source_files()
 
     profiles = lib.load_config().get("cpp_lint_all_profiles")
@@ -567,24 +901,34 @@ def lint_all() -> Generator[str]:
                 for profile in cpp_targets[target]["profiles"]:
                     profiles.add(profile)
 
+    steps = []
     for profile in profiles:
-        try:
-            _run_linter(profile, source_files)
-        except subprocess.CalledProcessError:
-            yield f"private#cpp.lint.{profile}"
+        check_name = f"private#cpp.lint.{profile}"
+        steps += [
+            _get_configure_step(profile),
+            lib.Step(
+                key=check_name,
+                function=functools.partial(_run_lint_check, check_name, profile, source_files),
+                dependencies=[f"cpp.configure.{profile}"],
+                check_name=check_name),
+        ]
+
+    return lib.execute_steps(steps)
 
 
 def format_all(fix: bool) -> Generator[str]:
     source_files = _get_source_and_header_files()
 
+    check_name = "private#format"
+
     if fix:
-        _run_fix_format(source_files)
+        _run_fix_format(check_name, source_files)
     else:
         try:
-            _run_format(source_files)
+            _run_format(check_name, source_files)
         except subprocess.CalledProcessError:
             lib.print_error("Format check failed")
-            yield "private#format"
+            yield check_name
 
 
 def check_config(task: dict):
@@ -601,7 +945,7 @@ def check_config(task: dict):
 
 @click.command()
 @click.option("-p", "--profile",
-              default=lib.load_config()["cpp_default_profile"], show_default=True,
+              default=_get_default_profile, show_default="course default profile",
               help="Profile to use for autocompletion.")
 def configure(profile: str):
     """Configure profile for autocompletion."""
@@ -655,7 +999,7 @@ def build(profiles: tuple[str], targets: tuple[str], build_all=False):
 
 @click.command()
 @click.option("-p", "--profile",
-              default=lib.load_config()["cpp_default_profile"], show_default=True,
+              default=_get_default_profile, show_default="course default profile",
               help="Profile to use for autocompletion.")
 @click.option("--confirm", is_flag=True,
               help="Do not ask for confirmation.")
@@ -685,17 +1029,6 @@ def setup_vscode(profile: str, confirm: bool = False):
 ################################################################################
 
 
-def add_commands(cli: click.Group):
-    cli.add_command(configure)
-    cli.add_command(build)
-    cli.add_command(setup_clion)
-    cli.add_command(setup_vscode)
-    cli.add_command(clangd_path)
-
-
-################################################################################
-
-
 def check_build_version():
     if not _get_cpp_build_directory().exists():
         return
@@ -1,8 +1,12 @@
+import functools
+import hashlib
 import lib
 import os
 import shutil
 import subprocess
 import sys
+import threading
+import time
 
 from collections.abc import Generator
 from functools import cache
@@ -13,6 +17,14 @@ from pytimeparse import parse
 ################################################################################
 
 
+GO_EXT = {".go"}
+
+_format_cache_lock = threading.Lock()
+
+
+################################################################################
+
+
 @cache
 def _get_build_directory() -> Path:
     return lib.get_course_directory() / "build" / "go"
@@ -28,26 +40,31 @@ def _get_go_cache_path() -> Path:
     return lib.get_course_directory() / ".cache" / "go"
 
 
+def _get_go_env() -> dict[str, str]:
+    go_env = os.environ.copy()
+    go_env["GOCACHE"] = str(_get_go_cache_path())
+    return go_env
+
+
 ################################################################################
 
 
 def _build_test(target: str):
-    build_directory = _get_build_directory()
+    with lib.span("build", target=target):
+        build_directory = _get_build_directory()
 
-    lib.print_inline_info(
-        f"Building target {target} in build directory {build_directory}"
-    )
+        lib.print_inline_info(
+            f"Building target {target} in build directory {build_directory}"
+        )
 
-    go_env = os.environ.copy()
-    go_env["GOCACHE"] = _get_go_cache_path()
-    subprocess.run([
-        "go",
-        "test",
-        "-c",
-        "-o",
-        build_directory / _get_executable_file_name(target),
-        target,
-    ], env=go_env).check_returncode()
+        lib.run([
+            "go",
+            "test",
+            "-c",
+            "-o",
+            build_directory / _get_executable_file_name(target),
+            target,
+        ], env=_get_go_env()).check_returncode()
 
 
 def _run_single_test(
@@ -55,67 +72,289 @@ def _run_single_test(
         target: str,
         timeout: float,
         sandbox: bool) -> bool:
-    lib.print_info(f"Running test {check_name}")
+    with lib.span("test", check=check_name):
+        lib.print_info(f"Running test {check_name}")
+
+        try:
+            lib.print_inline_info(f"Running test {check_name} with timeout {timeout:.0f} seconds")
+            start = time.perf_counter()
+
+            executable_name = _get_executable_file_name(target)
+            executable_path = _get_build_directory() / executable_name
+
+            if not sandbox:
+                lib.run(
+                    [executable_path, "-test.v"],
+                    timeout=timeout
+                ).check_returncode()
+            else:
+                lib.run([
+                    "bwrap",
+                    "--die-with-parent",
+                    "--unshare-pid",
+                    "--ro-bind",
+                    "/nix",
+                    "/nix",
+                    "--ro-bind",
+                    executable_path,
+                    executable_name,
+                    "--clearenv",
+                    f"./{executable_name}",
+                    "-test.v",
+                ], timeout=timeout).check_returncode()
+
+        except subprocess.CalledProcessError as error:
+            lib.print_inline_info(str(error))
+            lib.print_error(f"Test {check_name} failed")
+            return False
+        except subprocess.TimeoutExpired as error:
+            lib.print_inline_info(str(error))
+            lib.print_error(f"Test {check_name} timed out after {timeout:.0f} seconds")
+            return False
+        else:
+            lib.print_success(
+                f"Test {check_name} succeded in {time.perf_counter() - start:.1f} of "
+                f"{timeout:.0f} seconds")
+            return True
+
+
+def _run_format(check_name: str, source_files: list[Path], fix: bool) -> list[Path]:
+    """
+    Returns files with format errors. The cache keeps the hash of the last clean content of each
+    file, files with this content are not checked again.
+    """
+    with lib.span("format", check=check_name):
+        formatted_files = lib.load_cache("go-format").get("files", {})
+
+        file_hashes = {file: lib.get_file_hash(file) for file in source_files}
+        files_to_check = [
+            file for file in source_files if formatted_files.get(str(file)) != file_hashes[file]]
+
+        if not files_to_check:
+            return []
+
+        result = lib.run(
+            ["gofmt", "-l"] + (["-w"] if fix else []) + files_to_check,
+            capture_output=True,
+            text=True)
+        if result.stderr:
+            lib.error_console.print(result.stderr, end="")
+        result.check_returncode()
+
+        unformatted_files = [Path(line) for line in result.stdout.splitlines() if line]
+
+        checked_files = {}
+        for file in files_to_check:
+            if fix:
+                checked_files[str(file)] = lib.get_file_hash(file)
+            elif file not in unformatted_files:
+                checked_files[str(file)] = file_hashes[file]
+
+        # Tasks are checked concurrently, so the cache is reloaded before update.
+        with _format_cache_lock:
+            formatted_files = lib.load_cache("go-format").get("files", {}) | checked_files
+            lib.store_cache("go-format", {"files": {
+                path: file_hash
+                for path, file_hash in formatted_files.items() if os.path.exists(path)
+            }})
+
+        return [] if fix else unformatted_files
+
+
+def _get_go_sources_hash() -> str:
+    hashes = [
+        f"{file}:{lib.get_file_hash(file)}"
+        for file in sorted(lib.get_files(GO_EXT) + _get_go_module_files())
+    ]
+    return hashlib.sha256("\n".join(hashes).encode()).hexdigest()
+
+
+def _get_go_module_files() -> list[Path]:
+    return [
+        path for path in [
+            lib.get_course_directory() / "go.mod",
+            lib.get_course_directory() / "go.sum"
+        ] if path.is_file()
+    ]
+
+
+def _run_linter(check_name: str, packages: list[str]) -> list[str]:
+    """Returns packages with vet errors, packages are checked in a single go vet invocation."""
+    with lib.span("lint", check=check_name):
+        cache = lib.load_cache("go-vet")
+        sources_hash = _get_go_sources_hash()
+        passed_packages = set(cache.get(sources_hash, []))
+
+        packages_to_check = [package for package in packages if package not in passed_packages]
+
+        if not packages_to_check:
+            return []
+
+        result = lib.run(
+            ["go", "vet"] + packages_to_check,
+            cwd=lib.get_course_directory(),
+            env=_get_go_env(),
+            capture_output=True,
+            text=True)
+        lib.error_console.print(result.stdout + result.stderr, end="")
+
+        failed_packages = set()
+        if result.returncode != 0:
+            for line in result.stderr.splitlines():
+                if line.startswith("# "):
+                    failed_packages.add(line.removeprefix("# ").split()[0].strip("[]"))
+
+            if not failed_packages:
+                # Unable to attribute errors to packages, e.g. build failed before vet was run.
+                failed_packages = set(packages_to_check)
+
+        passed_packages.update(package for package in packages_to_check
+                               if package not in failed_packages)
+
+        # Results for other source trees are outdated, so only the current one is kept.
+        lib.store_cache("go-vet", {sources_hash: sorted(passed_packages)})
+
+        return sorted(failed_packages)
 
-    try:
-        _build_test(target)
 
-        lib.print_inline_info(f"Running test {check_name} with timeout {timeout} seconds")
+def _run_lint_check(check_name: str, packages: list[str]) -> bool:
+    lib.print_info(f"Running lint check {check_name} for {len(packages)} package(s)")
+
+    if _run_linter(check_name, packages):
+        lib.print_error("Lint check failed")
+        return False
 
-        executable_name = _get_executable_file_name(target)
-        executable_path = _get_build_directory() / executable_name
+    lib.print_success("Lint check succeded")
+    return True
 
-        if not sandbox:
-            subprocess.run(
-                [executable_path, "-test.v"],
-                timeout=timeout
-            ).check_returncode()
-        else:
-            subprocess.run([
-                "bwrap",
-                "--ro-bind",
-                "/nix",
-                "/nix",
-                "--ro-bind",
-                executable_path,
-                executable_name,
-                "--clearenv",
-                f"./{executable_name}",
-                "-test.v",
-            ], timeout=timeout).check_returncode()
-
-    except subprocess.CalledProcessError as error:
-        lib.print_inline_info(str(error))
-        lib.print_error(f"Test {check_name} failed")
-        return False
-    except subprocess.TimeoutExpired as error:
-        lib.print_inline_info(str(error))
-        lib.print_error(f"Test {check_name} timed out")
-        return False
-    else:
-        lib.print_success(f"Test {check_name} succeded")
+
+def _run_format_check(check_name: str, source_files: list[Path], fix: bool) -> bool:
+    if fix:
+        lib.print_inline_info(f"Fixing format for {len(source_files)} files")
+        _run_format(check_name, source_files, fix=True)
         return True
 
+    lib.print_info(f"Running format check {check_name} for {len(source_files)} file(s)")
+
+    unformatted_files = _run_format(check_name, source_files, fix=False)
+    if unformatted_files:
+        lib.print_error(
+            "Format check failed for the following files:\n" +
+            "\n".join(f" - {file}" for file in unformatted_files))
+        return False
+
+    lib.print_success("Format check succeded")
+    return True
+
+
+################################################################################
+
+
+def _get_test_cache_key(task: dict, target: str, timeout: float, sandbox: bool) -> str:
+    task_directory = lib.get_course_directory() / task["task_name"]
+    return lib.get_input_key(
+        [task_directory / file for file in task["submit_files"]] +
+        [_get_build_directory() / _get_executable_file_name(target)],
+        task=task,
+        timeout=timeout,
+        sandbox=sandbox,
+    )
+
 
-def run_tests(
+def test_steps(
         task: dict,
         profiles: list = [],
         filters: list = [],
-        sandbox: bool = False) -> Generator[str]:
+        sandbox: bool = False) -> list[lib.Step]:
     go_targets = task.get("go_targets") or []
 
     if not go_targets:
-        return
+        return []
 
     if profiles or filters:
         lib.print_error("Filters and profiles are not supported for go tasks.")
         sys.exit(1)
 
+    steps = []
     for target in go_targets:
         check_name = f"{task["task_name"]}#go.test#{target}"
-        timeout = parse(go_targets[target]["timeout"])
-        if not _run_single_test(check_name, target, timeout, sandbox):
-            yield check_name
+        timeout = parse(go_targets[target]["timeout"]) * lib.get_timeout_factor()
+        steps += [
+            lib.Step(
+                key=f"go.build.{target}",
+                function=functools.partial(_build_test, target),
+                cpus=os.cpu_count() or 1),
+            lib.Step(
+                key=check_name,
+                function=functools.partial(_run_single_test, check_name, target, timeout, sandbox),
+                dependencies=[f"go.build.{target}"],
+                check_name=check_name,
+                cache_key=functools.partial(_get_test_cache_key, task, target, timeout, sandbox),
+                memory=go_targets[target].get("memory", 0) * 2**20,
+                cores=go_targets[target].get("cores", 0),
+                timeout=timeout),
+        ]
+
+    return steps
+
+
+@cache
+def _get_package_directories(target: str) -> set[Path] | None:
+    """Returns directories of the packages the test of the target depends on."""
+    try:
+        output = lib.check_output(
+            ["go", "list", "-deps", "-test", "-f", "{{.Dir}}", target],
+            cwd=lib.get_course_directory(), env=_get_go_env())
+    except subprocess.CalledProcessError:
+        return None
+    return {Path(directory) for directory in output.decode().splitlines() if directory}
+
+
+def affected_test_checks(task: dict, changed_files: set[Path]) -> set[str]:
+    """Returns test checks of the task whose packages depend on the changed files."""
+    go_targets = task.get("go_targets") or []
+    module_changed = any(path.name in ["go.mod", "go.sum"] for path in changed_files)
+
+    affected = set()
+    for target in go_targets:
+        directories = None if module_changed else _get_package_directories(target)
+        if directories is None or any(path.parent in directories for path in changed_files):
+            affected.add(f"{task["task_name"]}#go.test#{target}")
+    return affected
+
+
+def lint_steps(task: dict) -> list[lib.Step]:
+    packages = list(task.get("go_targets") or [])
+
+    if not packages:
+        return []
+
+    check_name = f"{task["task_name"]}#go.lint"
+
+    return [
+        lib.Step(
+            key=check_name,
+            function=functools.partial(_run_lint_check, check_name, packages),
+            check_name=check_name),
+    ]
+
+
+def format_steps(task: dict, fix: bool = False) -> list[lib.Step]:
+    source_files = [
+        lib.get_course_directory() / task["task_name"] / file for file in task["submit_files"]
+        if Path(file).suffix in GO_EXT]
+
+    if not source_files:
+        return []
+
+    check_name = f"{task["task_name"]}#go.format"
+
+    return [
+        lib.Step(
+            key=check_name,
+            function=functools.partial(_run_format_check, check_name, source_files, fix),
+            check_name=check_name),
+    ]
 
 
 def check_config(task: dict):
@@ -127,9 +366,56 @@ def check_config(task: dict):
             sys.exit(1)
 
 
+def lint_all() -> Generator[str]:
+    packages = set()
+    for task in lib.load_all_tasks():
+        packages.update(task.get("go_targets") or [])
+
+    if not packages:
+        return
+
+    check_name = "private#go.lint"
+    if _run_linter(check_name, sorted(packages)):
+        yield check_name
+
+
+def format_all(fix: bool) -> Generator[str]:
+    source_files = lib.get_files(GO_EXT)
+
+    if not source_files:
+        return
+
+    check_name = "private#go.format"
+    unformatted_files = _run_format(check_name, source_files, fix)
+    if unformatted_files:
+        lib.print_error(
+            "Format check failed for the following files:\n" +
+            "\n".join(f" - {file}" for file in unformatted_files))
+        yield check_name
+
+
 ################################################################################
 
 
+def share_caches(directory: Path):
+    """Makes a copy of the course in the directory use the go cache of this course."""
+    cache_path = _get_go_cache_path()
+    shared_cache_path = directory / cache_path.relative_to(lib.get_course_directory())
+    if shared_cache_path.exists() or shared_cache_path.is_symlink():
+        return
+
+    cache_path.mkdir(parents=True, exist_ok=True)
+    shared_cache_path.parent.mkdir(parents=True, exist_ok=True)
+    shared_cache_path.symlink_to(cache_path)
+
+
+def cache_paths() -> list[Path]:
+    # Caches shared with grading worktrees are links to the cache of the course.
+    if not _get_go_cache_path().is_dir() or _get_go_cache_path().is_symlink():
+        return []
+    return [_get_go_cache_path()]
+
+
 def clean():
     shutil.rmtree(_get_build_directory(), ignore_errors=True)
     shutil.rmtree(_get_go_cache_path(), ignore_errors=True)
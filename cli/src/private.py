@@ -1,21 +1,30 @@
+import base64
+import dataclasses
+import functools
 import json
+import mmap
+import multiprocessing
 import os
+import queue
 import re
-import requests
+import rich.box
 import rich_click as click
+import rich_click.rich_click as rc
 import shutil
+import statistics
 import subprocess
 import sys
-import tempfile
-import tqdm
-import urllib3
+import threading
+import time
 
 import lib
 
-from collections import defaultdict
-from gitlab import Gitlab
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from functools import cache
 from pathlib import Path
 from rich.containers import Renderables
+from rich.rule import Rule
+from rich.table import Table
 
 
 ################################################################################
@@ -32,29 +41,53 @@ GITLAB_API_TOKEN = os.environ.get("GITLAB_API_TOKEN")
 CI_PROJECT_NAME = os.environ.get("CI_PROJECT_NAME")
 CI_PIPELINE_CREATED_AT = os.environ.get("CI_PIPELINE_CREATED_AT")
 
-# Split the string to disable substitution in private pattern itself.
-PRIVATE_REGEX = re.compile(r"\n[^\n]*PRIVATE" " BEGIN.*?PRIVATE" " END", re.DOTALL)
+# Split the string to disable substitution in private pattern itself. Files are transformed as
+# bytes, the line break before a block is removed whole in files with CRLF line endings.
+PRIVATE_REGEX = re.compile(r"\r?\n[^\n]*PRIVATE" " BEGIN.*?PRIVATE" " END", re.DOTALL)
 SOLUTION_REGEX = re.compile("SOLUTION " "BEGIN.*?SOLUTION " "END", re.DOTALL)
 SOLUTION_REPLACE = "TODO: Your solution"
+PRIVATE_MARKER = b"PRIVATE" b" BEGIN"
+SOLUTION_MARKER = b"SOLUTION " b"BEGIN"
+SOLUTION_BYTES_REGEX = re.compile(SOLUTION_REGEX.pattern.encode(), re.DOTALL)
+
+# Files with a NUL byte in the first bytes are considered binary and exported as is.
+BINARY_SNIFF_SIZE = 8192
+EXPORT_WORKERS = 8
+EXPORT_CHUNK_SIZE = 256
+EXPORT_CACHE_DIRECTORY = Path(".cache") / "export"
+
+# Top-level directories with these substrings in names are not checked by `check configs`.
+CONFIGS_EXCLUDED_DIRECTORIES = {".git", "build", ".cache"}
 
 COMMIT_MESSAGE = "Export public files"
 EXPORT_USER_NAME = "Marvin"
 EXPORT_USER_EMAIL = "no-reply@gitlab.manytask.org"
 
+# Batch grading admits a new worker only while the load average is below the number of CPUs and at
+# least this much memory is available (on Linux).
+GRADE_MIN_AVAILABLE_MEMORY = 2 * 1024 ** 3
+GRADE_ADMISSION_INTERVAL = 5
+
 os.environ['GIT_TERMINAL_PROMPT'] = '0'
 
+REPORT_WORKERS = 4
+REPORT_TIMEOUT = 60
+
+# Bulk updates of student projects retry throttled and failed requests with exponential backoff.
+GITLAB_UPDATE_ATTEMPTS = 5
+GITLAB_RETRY_DELAY = 2
+GITLAB_TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+_grade_slots_lock = threading.Lock()
+
 
 ################################################################################
 
 
-def _report_task(task_name: str):
-    data = {
-        "task": task_name,
-        "token": TESTER_TOKEN,
-        "username": CI_PROJECT_NAME,
-        "check_deadline": True,
-        "submit_time": CI_PIPELINE_CREATED_AT,
-    }
+@cache
+def _get_manytask_session():
+    import requests
+    import urllib3
 
     retry_strategy = urllib3.Retry(total=3, backoff_factor=1,
                                    status_forcelist=[408, 500, 502, 503, 504])
@@ -62,46 +95,166 @@ def _report_task(task_name: str):
     session = requests.Session()
     session.mount("https://", adapter)
     session.mount("http://", adapter)
-    response = session.post(url=f"{MANYTASK_URL}/report", data=data)
+    return session
 
-    if response.status_code >= 400:
-        lib.print_error(
-            f"{response.status_code}: {response.text}\n"
-            "Cannot report score to manytask. Please contact the course support team.")
-        sys.exit(1)
 
-    result = response.json()
-    lib.print_inline_success(
-        f"Report for task '{task_name}' for user '{CI_PROJECT_NAME}', "
-        f"result score: {result['score']}")
+@cache
+def _get_report_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=REPORT_WORKERS)
+
 
+def _get_report_queue_directory() -> Path:
+    return lib.get_course_directory() / ".cache" / "reports"
 
-def _grade_task(task_name: str, student_repo: str) -> list[str]:
-    task_dir = lib.get_course_directory() / task_name
-    task = lib.load_task_from_dir(task_dir)
 
-    submit_files = []
+def _enqueue_report(report: dict):
+    queue_directory = _get_report_queue_directory()
+    queue_directory.mkdir(parents=True, exist_ok=True)
 
-    for file in task["submit_files"]:
-        original_file = task_dir / file
-        student_file = Path(student_repo) / task_name / file
-        assert student_file.is_file(), str(student_file)
-        os.remove(original_file)
-        shutil.copy(student_file, original_file)
-        submit_files.append(str(original_file))
+    report_path = queue_directory / f"{time.time_ns()}-{threading.get_native_id()}.json"
+    temporary_path = report_path.with_suffix(".tmp")
+    temporary_path.write_text(json.dumps(report))
+    os.replace(temporary_path, report_path)
 
-    failed_tasks = []
 
-    failed_tasks += list(lib.execute_for_each_module_yielding("run_format", task))
-    failed_tasks += list(lib.execute_for_each_module_yielding("run_linter", task))
-    failed_tasks += list(lib.execute_for_each_module_yielding("run_tests", task, sandbox=True))
+def _send_report(report: dict, queue_on_failure: bool = True) -> str:
+    """
+    Sends the report to manytask. Reports which failed because of network errors or server errors
+    are queued on disk unless queue_on_failure is False. Returns "sent", "queued" or "failed".
+    """
+    import requests
 
-    return failed_tasks
+    with lib.span("report", task=report["task"]):
+        try:
+            response = _get_manytask_session().post(
+                url=f"{MANYTASK_URL}/report",
+                data=report | {"token": TESTER_TOKEN},
+                timeout=REPORT_TIMEOUT)
+        except requests.RequestException as error:
+            reason = str(error)
+        else:
+            if response.status_code < 400:
+                try:
+                    score = response.json()["score"]
+                except (ValueError, KeyError, TypeError):
+                    score = "unknown"
+                lib.print_inline_success(
+                    f"Report for task '{report['task']}' for user '{report['username']}', "
+                    f"result score: {score}")
+                return "sent"
+
+            if response.status_code < 500 and response.status_code not in [408, 429]:
+                lib.print_error(
+                    f"{response.status_code}: {response.text}\n"
+                    "Cannot report score to manytask. Please contact the course support team.")
+                return "failed"
+
+            reason = f"{response.status_code}: {response.text}"
+
+        if queue_on_failure:
+            _enqueue_report(report)
+        lib.print_warning(
+            f"Cannot report task '{report['task']}' for user '{report['username']}' now, "
+            f"the report is queued.\n{reason}\n"
+            "Run `cli report flush` to send queued reports.")
+        return "queued"
+
+
+class _Reports:
+    """Reports of one grading call, sent in the background from any thread."""
+
+    def __init__(self):
+        self._pending: list[Future] = []
+        self._lock = threading.Lock()
+
+    def send(self, task_name: str, username: str | None = CI_PROJECT_NAME):
+        report = {
+            "task": task_name,
+            "username": username,
+            "check_deadline": True,
+            "submit_time": CI_PIPELINE_CREATED_AT,
+        }
+        future = _get_report_executor().submit(_send_report, report)
+        with self._lock:
+            self._pending.append(future)
+
+    def send_passed(self, tasks: list[str], failed_checks: list[str],
+                    username: str | None = CI_PROJECT_NAME):
+        for task_name in tasks:
+            if not any(check.startswith(f"{task_name}#") for check in failed_checks):
+                self.send(task_name, username)
+
+    def wait(self) -> bool:
+        """Waits for the reports sent so far. Returns False if some of them failed."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return "failed" not in [future.result() for future in pending]
+
+
+def _order_by_cost(steps: list[lib.Step]) -> list[lib.Step]:
+    """
+    Orders checks by their expected duration together with their dependencies, each check is
+    preceded by its dependencies. Recorded durations are used where available, costs of the
+    other steps are scaled to seconds by the recorded ones.
+    """
+    steps_by_key = {step.key: step for step in steps}
+    durations = lib.load_step_durations()
+
+    recorded = [steps_by_key[key] for key in steps_by_key if key in durations]
+    recorded_cost = sum(step.cost for step in recorded)
+    scale = sum(durations[step.key] for step in recorded) / recorded_cost if recorded_cost else 1.0
+
+    def get_chain(key: str) -> list[str]:
+        chain = []
+        for dependency in steps_by_key[key].dependencies:
+            chain += get_chain(dependency)
+        return chain + [key]
+
+    chains = [get_chain(step.key) for step in steps_by_key.values() if step.check_name]
+    chains.sort(key=lambda chain: sum(
+        durations.get(key, steps_by_key[key].cost * scale) for key in set(chain)))
+
+    ordered_keys = dict.fromkeys(key for chain in chains for key in chain)
+    ordered_keys.update(dict.fromkeys(steps_by_key))
+    return [steps_by_key[key] for key in ordered_keys]
+
+
+def _grade_task(task_name: str, student_repo: str, full: bool = False) -> list[str]:
+    """
+    Grades the task in the course checkout, the original submit files are restored afterwards.
+    Format and lint checks run first, then tests from the cheapest one. Unless full is set,
+    grading stops at the first failed check, since the task is not scored anyway.
+    """
+    with lib.span("grade", task=task_name):
+        task_dir = lib.get_course_directory() / task_name
+        task = lib.load_task_from_dir(task_dir)
+
+        original_files = {}
+        try:
+            for file in task["submit_files"]:
+                original_file = task_dir / file
+                student_file = Path(student_repo) / task_name / file
+                assert student_file.is_file(), str(student_file)
+                original_files[original_file] = original_file.read_bytes()
+                os.remove(original_file)
+                shutil.copy(student_file, original_file)
+
+            steps = []
+            steps += lib.collect_steps_for_each_module("format_steps", task)
+            steps += lib.collect_steps_for_each_module("lint_steps", task)
+            steps += _order_by_cost(
+                lib.collect_steps_for_each_module("test_steps", task, sandbox=True))
+
+            # Grading never trusts results of previous runs.
+            return lib.execute_steps(steps, fail_fast=not full, use_cache=False)
+        finally:
+            for original_file, content in original_files.items():
+                original_file.write_bytes(content)
 
 
 def _try_get_tasks_from_notes(student_repo: Path) -> list[str]:
     try:
-        result = subprocess.run(
+        result = lib.run(
             ["git", "-C", str(student_repo), "notes", "show"],
             capture_output=True,
             text=True,
@@ -139,7 +292,7 @@ def _try_get_tasks_from_notes(student_repo: Path) -> list[str]:
 
 def _try_get_tasks_from_diff(student_repo: Path) -> list[str]:
     try:
-        result = subprocess.run(
+        result = lib.run(
             [
                 "git", "-C", str(student_repo),
                 "diff-tree", "-r", "--cc", "--no-commit-id", "--name-only", "HEAD"
@@ -164,13 +317,7 @@ def _try_get_tasks_from_diff(student_repo: Path) -> list[str]:
         lib.error_console.print(f"[cyan] - {file}")
     lib.error_console.print()
 
-    file_to_tasks: dict[str, list[str]] = defaultdict(list)
-
-    for task in lib.load_all_tasks():
-        for file in task["submit_files"]:
-            course_dir = lib.get_course_directory()
-            file_path = (Path(task["task_name"]) / file).resolve().relative_to(course_dir)
-            file_to_tasks[str(file_path)].append(task["task_name"])
+    file_to_tasks = lib.get_submit_file_tasks()
 
     tasks_to_run: set[str] = set()
 
@@ -189,6 +336,330 @@ def _try_get_tasks_from_diff(student_repo: Path) -> list[str]:
     return sorted(tasks_to_run)
 
 
+def _get_grade_slot(name: str) -> Path:
+    """
+    Returns a worktree of the course for grading, reset to the commit checked out in the course.
+    Build directories of the worktree are kept between jobs, caches of the modules are shared
+    with the course.
+    """
+    course_directory = lib.get_course_directory()
+    slot_directory = lib.get_build_directory() / "grade" / name
+    commit = lib.check_output(["git", "-C", course_directory, "rev-parse", "HEAD"]).decode().strip()
+
+    with _grade_slots_lock:
+        if not (slot_directory / ".git").exists():
+            lib.run(["git", "-C", course_directory, "worktree", "prune"]).check_returncode()
+            lib.run([
+                "git", "-C", course_directory, "worktree", "add", "--quiet", "--force", "--detach",
+                slot_directory, commit,
+            ]).check_returncode()
+
+    _reset_grade_slot(slot_directory, commit)
+    lib.execute_for_each_module("share_caches", slot_directory)
+    return slot_directory
+
+
+def _reset_grade_slot(slot_directory: Path, commit: str = "HEAD"):
+    lib.run(["git", "-C", slot_directory, "reset", "--quiet", "--hard", commit]).check_returncode()
+    lib.run([
+        "git", "-C", slot_directory, "clean", "--quiet", "-ffdx", "-e", "/build", "-e", "/.cache",
+    ]).check_returncode()
+
+
+def _grade_in_slot(slot_name: str, args: list, log_path: Path, env: dict | None = None) -> dict:
+    """
+    Runs `cli grade` with the arguments in the slot and returns its results. The slot is reset
+    afterwards, even if grading fails.
+    """
+    slot_directory = _get_grade_slot(slot_name)
+    result_path = slot_directory.with_suffix(".json")
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+
+    env = (env or os.environ).copy()
+    env["CLI_NO_DAEMON"] = "1"
+
+    start = time.perf_counter()
+    try:
+        with open(log_path, "w") as log:
+            process = lib.run(
+                [lib.get_cli_path(), "--output", "plain", "grade", "--in-place",
+                 "--json-output", result_path] + args,
+                cwd=slot_directory, env=env, stdout=log, stderr=subprocess.STDOUT)
+    finally:
+        _reset_grade_slot(slot_directory)
+
+    result = {
+        "exit_code": process.returncode,
+        "duration": time.perf_counter() - start,
+        "log": str(log_path),
+        "tasks": [],
+        "failed_checks": [],
+    }
+    try:
+        result |= json.loads(result_path.read_text())
+        result_path.unlink()
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return result
+
+
+def _has_free_resources() -> bool:
+    available_memory = lib.get_available_memory()
+    if available_memory is not None and available_memory < GRADE_MIN_AVAILABLE_MEMORY:
+        return False
+    return os.getloadavg()[0] < os.cpu_count()
+
+
+def _load_batch(batch_path: Path) -> list[tuple[Path, str]]:
+    repos = []
+    for line in batch_path.read_text().splitlines():
+        fields = line.split()
+        if not fields or fields[0].startswith("#"):
+            continue
+        repo = Path(fields[0]).absolute()
+        repos.append((repo, fields[1] if len(fields) > 1 else repo.name))
+    return repos
+
+
+def _grade_batch(repos: list[tuple[Path, str]], workers: int, reports: _Reports | None,
+                 full: bool) -> list[dict]:
+    """Grades repositories concurrently, each worker grades in its own worktree of the course."""
+    free_slots = queue.SimpleQueue()
+    for index in range(workers):
+        free_slots.put(index)
+
+    resources = threading.Condition()
+    running_jobs = 0
+
+    def grade_repo(student_repo: Path, username: str) -> dict:
+        nonlocal running_jobs
+
+        slot_index = free_slots.get()
+        try:
+            with resources:
+                while running_jobs and not _has_free_resources():
+                    resources.wait(GRADE_ADMISSION_INTERVAL)
+                running_jobs += 1
+
+            try:
+                result = {"repo": str(student_repo), "username": username} | _grade_in_slot(
+                    f"repo-{slot_index}",
+                    [student_repo] + (["--full"] if full else []),
+                    lib.get_build_directory() / "logs" / f"grade-{username}.log")
+            finally:
+                with resources:
+                    running_jobs -= 1
+                    resources.notify_all()
+        finally:
+            free_slots.put(slot_index)
+
+        if reports:
+            reports.send_passed(result["tasks"], result["failed_checks"], username)
+
+        if result["exit_code"] == 0:
+            lib.print_inline_success(f"{username}: passed ({result['duration']:.0f}s)")
+        else:
+            lib.print_inline_info(
+                f"{username}: failed with {len(result['failed_checks'])} failed checks "
+                f"({result['duration']:.0f}s), see {result['log']}")
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda repo: grade_repo(*repo), repos))
+
+
+def _grade_tasks_in_slots(tasks: list[str], student_repo: str, jobs: int,
+                          reports: _Reports | None, full: bool) -> list[str]:
+    """Grades the tasks concurrently, each one in its own worktree of the course."""
+    free_slots = queue.SimpleQueue()
+    for index in range(jobs):
+        free_slots.put(index)
+
+    def grade_task(task_name: str) -> dict:
+        slot_index = free_slots.get()
+        try:
+            log_name = task_name.replace("/", "_")
+            result = _grade_in_slot(
+                f"task-{slot_index}",
+                [Path(student_repo).absolute(), "--task", task_name] +
+                (["--full"] if full else []),
+                lib.get_build_directory() / "logs" / f"grade-{log_name}.log")
+        finally:
+            free_slots.put(slot_index)
+
+        if reports and result["exit_code"] == 0:
+            reports.send(task_name)
+        return result
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(grade_task, tasks))
+
+    failed_checks = []
+    for task_name, result in zip(tasks, results):
+        if result["exit_code"] == 0:
+            lib.print_inline_success(f"Task {task_name} passed ({result['duration']:.0f}s)")
+            continue
+
+        lib.error_console.print(
+            Rule(f"[bold red]Log of {task_name}", style="red"), width=lib.CONSOLE_WIDTH)
+        lib.error_console.out(Path(result["log"]).read_text(errors="replace"), highlight=False)
+        failed_checks += result["failed_checks"] or [f"{task_name}#grade"]
+
+    return failed_checks
+
+
+def _print_batch_results(results: list[dict]):
+    table = Table(title="Grading results", box=rich.box.SQUARE)
+    table.add_column("Username")
+    table.add_column("Tasks")
+    table.add_column("Failed checks")
+    table.add_column("Time", justify="right")
+
+    for result in results:
+        style = "green" if result["exit_code"] == 0 else "red"
+        table.add_row(
+            f"[{style}]{result['username']}",
+            ", ".join(result["tasks"]),
+            "\n".join(result["failed_checks"]) or ("-" if result["exit_code"] == 0 else "error"),
+            f"{result['duration']:.0f}s")
+
+    lib.error_console.print(table, width=lib.CONSOLE_WIDTH)
+
+
+def _write_json(path: Path | None, data: dict):
+    if path is not None:
+        with open(path, "w") as stream:
+            json.dump(data, stream, indent=2)
+
+
+def _run_timed(function, key: str, timings: dict[str, list[float]]) -> bool | None:
+    start = time.perf_counter()
+    try:
+        return function()
+    finally:
+        timings[key] = [start, time.perf_counter()]
+
+
+def _get_changed_files(revision: str) -> set[Path]:
+    """Returns files changed since the revision, including uncommitted and untracked ones."""
+    course_directory = lib.get_course_directory()
+    output = lib.check_output(["git", "diff", "--name-only", "--no-renames", revision, "--"],
+                              cwd=course_directory)
+    output += lib.check_output(["git", "ls-files", "--others", "--exclude-standard"],
+                               cwd=course_directory)
+    return {(course_directory / path).resolve() for path in output.decode().splitlines()}
+
+
+def _get_affected_test_checks(revision: str, smoke_tasks: set[str]) -> set[str]:
+    course_directory = lib.get_course_directory().resolve()
+    changed_files = _get_changed_files(revision)
+
+    affected = set()
+    for task in lib.load_all_tasks():
+        task_directory = course_directory / task["task_name"]
+        task_changed = any(task_directory in path.parents for path in changed_files)
+        if task_changed or task["task_name"] in smoke_tasks:
+            affected.update(
+                step.check_name for step in lib.collect_steps_for_each_module("test_steps", task)
+                if step.check_name)
+        else:
+            affected.update(lib.execute_for_each_module_yielding(
+                "affected_test_checks", task, changed_files))
+    return affected
+
+
+def _print_task_test_results(
+        steps: list[lib.Step],
+        failed_checks: list[str],
+        timings: dict[str, list[float]],
+        wall_time: float):
+    task_checks: dict[str, list[lib.Step]] = {}
+    for step in steps:
+        if step.check_name:
+            task_checks.setdefault(step.check_name.split("#")[0], []).append(step)
+
+    table = Table(box=rich.box.SQUARE, width=lib.CONSOLE_WIDTH)
+    table.add_column("Task")
+    table.add_column("Checks", justify="right")
+    table.add_column("Failed", justify="right")
+    table.add_column("Run", justify="right")
+    table.add_column("Time", justify="right")
+
+    for task_name, checks in sorted(task_checks.items()):
+        failed = sum(step.check_name in failed_checks for step in checks)
+        ran = [timings[step.key] for step in checks if step.key in timings]
+        elapsed = max(end for _, end in ran) - min(start for start, _ in ran) if ran else 0.0
+        table.add_row(
+            f"[{'red' if failed else 'green'}]{task_name}",
+            str(len(checks)),
+            str(failed) if failed else "",
+            str(len(ran)),
+            f"{elapsed:.1f}s")
+
+    table.caption = f"Wall time {wall_time:.1f}s"
+    lib.error_console.print(table, width=lib.CONSOLE_WIDTH)
+
+
+def _map_in_processes(function, paths: list[str]) -> list:
+    """
+    Applies the function to the files. Matching holds the GIL, so more than a chunk of files is
+    processed in separate processes. The cli may have threads running, so workers are started by
+    a fork server, not forked.
+    """
+    if len(paths) <= EXPORT_CHUNK_SIZE:
+        return [function(path) for path in paths]
+
+    with ProcessPoolExecutor(max_workers=min(EXPORT_WORKERS, os.cpu_count() or 1),
+                             mp_context=multiprocessing.get_context("forkserver")) as executor:
+        return list(executor.map(function, paths, chunksize=EXPORT_CHUNK_SIZE))
+
+
+def _has_solution(path: str) -> bool:
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return False
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            return content.find(SOLUTION_MARKER) != -1 and \
+                SOLUTION_BYTES_REGEX.search(content) is not None
+
+
+def _find_files_with_solution() -> set[Path]:
+    """
+    Returns files of the course with the solution pattern. Results are cached by modification
+    time and size of the files, so only changed files are read again.
+    """
+    course_directory = lib.get_course_directory()
+
+    files = {}
+    directories = [str(course_directory)]
+    while directories:
+        directory = directories.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    excluded = directory == str(course_directory) and any(
+                        exclude in entry.name for exclude in CONFIGS_EXCLUDED_DIRECTORIES)
+                    if not excluded:
+                        directories.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = [stat.st_mtime_ns, stat.st_size]
+
+    cached_results = lib.load_cache("configs")
+    results = {
+        path: cached_results[path]
+        for path, key in files.items()
+        if cached_results.get(path, [])[:2] == key
+    }
+
+    paths_to_scan = [path for path in files if path not in results]
+    for path, has_solution in zip(paths_to_scan, _map_in_processes(_has_solution, paths_to_scan)):
+        results[path] = files[path] + [has_solution]
+
+    lib.store_cache("configs", results)
+    return {Path(path) for path, result in results.items() if result[2]}
+
+
 ################################################################################
 
 
@@ -200,14 +671,55 @@ def check():
 @check.command()
 @click.option("--sandbox", is_flag=True,
               help="Run tests in an isolated environment (only for Linux).")
-def tests(sandbox: bool):
-    """Run tasks tests."""
-    tasks = lib.load_all_tasks()
-
-    failed_checks = []
-
-    for task in tasks:
-        failed_checks += list(lib.execute_for_each_module_yielding("run_tests", task))
+@click.option("-j", "--jobs", default=os.cpu_count() or 1, show_default="number of cpus",
+              help="Number of steps to run concurrently.")
+@click.option("--memory", "memory_limit", type=int,
+              help="Memory in MiB for concurrently running tests. Defaults to available memory.")
+@click.option("--no-cache", is_flag=True,
+              help="Run tests even if they passed before with the same inputs.")
+@click.option("--affected-since", metavar="REV",
+              help="Run only tests affected by changes since the revision.")
+@click.option("--smoke", "smoke_tasks", multiple=True, metavar="TASK",
+              help="Task to test even if it is not affected, in addition to 'smoke_tasks' "
+              "of the course config. This option can be used multiple times.")
+def tests(sandbox: bool, jobs: int, memory_limit: int | None, no_cache: bool,
+          affected_since: str | None, smoke_tasks: tuple[str, ...]):
+    """
+    Run tests of all tasks.
+
+    Tests of all tasks are scheduled together, so configure and build steps shared by tasks are
+    executed once. Tests run concurrently within the cpu and memory budget.
+
+    With --affected-since, tests are selected by the build dependency graph: the ninja graph of
+    each profile for C++ and `go list -deps` for Go. Changes of a task directory affect all its
+    tests, changes of CMake files or go.mod affect all tests of the language. The course config
+    and the cli are not files of the course, run all tests after updating them.
+    """
+    timings: dict[str, list[float]] = {}
+
+    steps = []
+    for task in lib.load_all_tasks():
+        for step in lib.collect_steps_for_each_module("test_steps", task, sandbox=sandbox):
+            if step.check_name:
+                step = dataclasses.replace(
+                    step, function=functools.partial(_run_timed, step.function, step.key, timings))
+            steps.append(step)
+
+    if affected_since is not None:
+        smoke_tasks = {*lib.load_config().get("smoke_tasks", []), *smoke_tasks}
+        affected_checks = _get_affected_test_checks(affected_since, smoke_tasks)
+        all_checks = [step.check_name for step in steps if step.check_name]
+        steps = lib.select_steps(steps, affected_checks)
+        lib.print_info(
+            f"{len(affected_checks.intersection(all_checks))} of {len(all_checks)} test checks are "
+            f"affected by changes since {affected_since}")
+
+    memory = memory_limit * 2**20 if memory_limit is not None else lib.get_available_memory()
+
+    start = time.perf_counter()
+    failed_checks = lib.execute_steps(
+        steps, jobs=jobs, use_cache=not no_cache, cpus=os.cpu_count() or 1, memory=memory)
+    _print_task_test_results(steps, failed_checks, timings, time.perf_counter() - start)
 
     lib.print_failed_checks_and_exit(failed_checks)
 
@@ -228,27 +740,7 @@ def format(fix: bool):
 @check.command()
 def configs():
     """Run config checks."""
-    files_with_solution = set()
-
-    exclude_top_directories = {".git", "build", ".cache"}
-
-    for path in lib.get_course_directory().rglob("*"):
-        if not path.is_file():
-            continue
-
-        base = path.relative_to(lib.get_course_directory()).parts[0]
-        if any(exclude in base for exclude in exclude_top_directories):
-            continue
-        try:
-            with open(path, "r") as file:
-                if SOLUTION_REGEX.search(file.read()):
-                    files_with_solution.add(path)
-        except UnicodeDecodeError:
-            lib.print_warning(f"Skipped binary file: {path}")
-
-        with open(path, "r") as file:
-            if SOLUTION_REGEX.search(file.read()):
-                files_with_solution.add(path)
+    files_with_solution = _find_files_with_solution()
 
     files_to_submit = set()
 
@@ -282,45 +774,121 @@ def configs():
     sys.exit(1)
 
 
+@check.command()
+@click.option("--budget", default=100, show_default=True,
+              help="Maximum allowed median startup time in milliseconds.")
+@click.option("--runs", default=10, show_default=True, help="Number of measured runs.")
+def startup(budget: int, runs: int):
+    """Check cli startup time."""
+    command = [lib.get_cli_path(), "--help"]
+
+    # The first run warms up the file system cache and is not measured.
+    lib.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).check_returncode()
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        lib.run(
+            command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).check_returncode()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    median = statistics.median(timings)
+    message = (
+        f"Startup time of `cli --help`: median {median:.0f} ms, "
+        f"min {min(timings):.0f} ms, max {max(timings):.0f} ms, budget {budget} ms")
+
+    if median > budget:
+        lib.print_error(message)
+        sys.exit(1)
+
+    lib.print_success(message)
+
+
+rc.COMMAND_GROUPS["cli check*"] = [
+    {
+        "name": "Staff Commands",
+        "commands": list(check.commands),
+    },
+]
+
+
 ################################################################################
 
 
-@click.command()
-@click.option("--push", is_flag=True, help="Push changes to the public repository.")
-@click.option("--directory", help="User-defined temporary directory.")
-def export(push: bool = False, directory: str | None = None):
-    """Export files to the public repository."""
+def _strip_private_patterns(path: str) -> bool:
+    """Removes private blocks and solutions from the file. Returns True if the file was changed."""
+    with open(path, "rb") as file:
+        content = file.read(BINARY_SNIFF_SIZE)
+        if b"\0" in content:
+            return False
+        content += file.read()
 
-    config = lib.load_config()
+    if PRIVATE_MARKER not in content and SOLUTION_MARKER not in content:
+        return False
 
-    if directory is None:
-        export_directory = tempfile.TemporaryDirectory(prefix="cli_", delete=False)
-        directory = export_directory.name
+    # Undecodable bytes are kept as they are.
+    text = content.decode(errors="surrogateescape")
+    text_new = PRIVATE_REGEX.sub("", text)
+    text_new = SOLUTION_REGEX.sub(SOLUTION_REPLACE, text_new)
+    if text == text_new:
+        return False
 
-    ########################################
-    # Checkout remote repo
-    ########################################
+    with open(path, "wb") as file:
+        file.write(text_new.encode(errors="surrogateescape"))
+    return True
+
+
+def _strip_private_patterns_from_files(paths: list[str]):
+    with lib.span("transform", files=len(paths)):
+        start = time.perf_counter()
+        changed = sum(_map_in_processes(_strip_private_patterns, paths))
+
+        lib.print_info(
+            f"Removed private patterns from {changed} of {len(paths)} files "
+            f"in {time.perf_counter() - start:.2f}s")
+
+
+def _update_public_clone(clone_directory: Path) -> str | None:
+    """Clones the public repository or resets the existing clone to it. Returns the commit."""
+    if (clone_directory / ".git").exists():
+        try:
+            lib.run(["git", "-C", clone_directory, "fetch", "--quiet", "--depth=1",
+                     COURSE_PUBLIC_REPO_URL, "HEAD"], capture_output=True, check=True)
+            lib.run(["git", "-C", clone_directory, "reset", "--quiet", "--hard", "FETCH_HEAD"],
+                    check=True)
+            lib.run(["git", "-C", clone_directory, "clean", "--quiet", "-ffdx"], check=True)
+        except subprocess.CalledProcessError:
+            # E.g. the repository is still empty, clone it again.
+            shutil.rmtree(clone_directory)
 
     try:
-        subprocess.run(
-            ["git", "clone", "--depth=1", COURSE_PUBLIC_REPO_URL, directory],
-            capture_output=True,
-            text=True,
-            check=True
-        )
+        if not clone_directory.exists():
+            lib.run(
+                ["git", "clone", "--depth=1", COURSE_PUBLIC_REPO_URL, clone_directory],
+                capture_output=True,
+                text=True,
+                check=True
+            )
     except subprocess.CalledProcessError as e:
         lib.print_error(
             "Failed to clone repository. Please verify the repository is public and accessible.")
         raise e
 
-    # This call may fail if the repo is empty.
-    subprocess.run(["git", "-C", directory, "rm", "-rq", "."])
+    # The repository may be empty.
+    head = lib.run(["git", "-C", clone_directory, "rev-parse", "--verify", "--quiet", "HEAD"],
+                   capture_output=True, text=True)
+    return head.stdout.strip() or None
 
-    ########################################
-    # Rsync files
-    ########################################
 
-    rsync_args = ["rsync", "-r"]
+def _sync_export_staging(staging_directory: Path) -> tuple[list[str], list[str]]:
+    """
+    Mirrors the exported files of the course into the staging directory without transforming
+    them. Returns relative paths of changed and of deleted files.
+    """
+    config = lib.load_config()
+
+    rsync_args = ["rsync", "-rt", "--delete", "--delete-excluded", "--out-format=%i %n",
+                  f"--exclude=/{EXPORT_CACHE_DIRECTORY.parts[0]}"]
 
     for pattern in config["include_patterns"]:
         rsync_args.append(f"--include={pattern}")
@@ -328,53 +896,134 @@ def export(push: bool = False, directory: str | None = None):
     for pattern in config["exclude_patterns"]:
         rsync_args.append(f"--exclude={pattern}")
 
-    rsync_args.append(".")
-    rsync_args.append(directory)
+    rsync_args.append(f"{lib.get_course_directory()}/")
+    rsync_args.append(staging_directory)
 
-    subprocess.run(rsync_args).check_returncode()
+    staging_directory.mkdir(parents=True, exist_ok=True)
+    output = lib.check_output(rsync_args).decode()
+
+    changed, deleted = [], []
+    for line in output.splitlines():
+        changes, _, path = line.partition(" ")
+        if changes == "*deleting":
+            deleted.append(path)
+        elif changes[:2] == ">f":
+            changed.append(path)
+    return changed, deleted
+
+
+def _load_export_state(export_directory: Path) -> dict:
+    try:
+        with open(export_directory / "state.json") as stream:
+            return json.load(stream)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _store_export_state(export_directory: Path, state: dict):
+    with open(export_directory / "state.json", "w") as stream:
+        json.dump(state, stream)
+
+
+@click.command()
+@click.option("--push", is_flag=True, help="Push changes to the public repository.")
+@click.option("--directory", help="Directory to keep the clone of the public repository in "
+              "between exports (.cache/export of the course by default).")
+@click.option("--diff", "show_diff", is_flag=True, help="Print a summary of exported changes.")
+def export(push: bool = False, directory: str | None = None, show_diff: bool = False):
+    """
+    Export files to the public repository.
+
+    The public repository is kept cloned between exports. When it is still at the commit of the
+    last pushed export, only files changed since then are copied and transformed.
+    """
+    if directory is None:
+        export_directory = lib.get_course_directory() / EXPORT_CACHE_DIRECTORY
+    else:
+        export_directory = Path(directory).absolute()
+    clone_directory = export_directory / "public"
+    staging_directory = export_directory / "staging"
+    export_directory.mkdir(parents=True, exist_ok=True)
 
     ########################################
-    # Remove private patterns
+    # Checkout remote repo
     ########################################
 
-    for root, dirs, files in os.walk(directory, topdown=True):
-        [dirs.remove(d) for d in list(dirs) if d == ".git"]
+    with lib.span("checkout"):
+        public_commit = _update_public_clone(clone_directory)
 
-        for filename in files:
-            filepath = os.path.join(root, filename)
+    # The state is valid only while the staging directory matches the public repository.
+    state = _load_export_state(export_directory)
+    incremental = public_commit is not None and state.get("commit") == public_commit
+    _store_export_state(export_directory, {})
 
-            with open(filepath, "r+") as file:
-                content = file.read()
-                content_new = PRIVATE_REGEX.sub("", content)
-                content_new = SOLUTION_REGEX.sub(SOLUTION_REPLACE, content_new)
-                if content == content_new:
-                    continue
+    ########################################
+    # Rsync files
+    ########################################
+
+    with lib.span("sync"):
+        changed, deleted = _sync_export_staging(staging_directory)
+
+        if incremental:
+            for path in deleted:
+                target = clone_directory / path
+                if target.is_dir() and not target.is_symlink():
+                    shutil.rmtree(target)
+                elif target.exists() or target.is_symlink():
+                    os.remove(target)
+            for path in changed:
+                (clone_directory / path).parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy(staging_directory / path, clone_directory / path)
+            paths = [str(clone_directory / path) for path in changed]
+        else:
+            # This call may fail if the repo is empty.
+            lib.run(["git", "-C", clone_directory, "rm", "-rq", "."])
+            lib.run(["rsync", "-r", f"{staging_directory}/", clone_directory]).check_returncode()
+            paths = [
+                os.path.join(root, filename)
+                for root, _, files in os.walk(staging_directory)
+                for filename in files
+            ]
+            paths = [
+                str(clone_directory / os.path.relpath(path, staging_directory)) for path in paths
+            ]
+
+    lib.print_info(
+        f"{'Incremental' if incremental else 'Full'} export: "
+        f"{len(changed)} changed and {len(deleted)} deleted files")
+
+    ########################################
+    # Remove private patterns
+    ########################################
 
-                file.seek(0)
-                file.truncate()
-                file.write(content_new)
+    _strip_private_patterns_from_files(paths)
 
     ########################################
     # Push to public repo
     ########################################
 
-    subprocess.run(["git", "-C", directory, "add", "."]).check_returncode()
+    lib.run(["git", "-C", clone_directory, "add", "-A", "."]).check_returncode()
 
-    status = subprocess.run(["git", "-C", directory, "status", "-s"], capture_output=True)
+    status = lib.run(["git", "-C", clone_directory, "status", "-s"], capture_output=True)
     if status.stderr:
         lib.error_console.print(status.stderr.decode())
 
     lib.error_console.print(status.stdout.decode())
 
     if len(status.stdout.strip()) == 0:
+        _store_export_state(export_directory, {"commit": public_commit})
         lib.print_warning("Nothing to export.")
         return
 
-    subprocess.run(["git", "-C", directory, "config", "user.name",
+    if show_diff:
+        diff = lib.check_output(["git", "-C", clone_directory, "diff", "--cached", "--stat"])
+        lib.error_console.out(diff.decode(), highlight=False)
+
+    lib.run(["git", "-C", clone_directory, "config", "user.name",
                    EXPORT_USER_NAME]).check_returncode()
-    subprocess.run(["git", "-C", directory, "config", "user.email",
+    lib.run(["git", "-C", clone_directory, "config", "user.email",
                    EXPORT_USER_EMAIL]).check_returncode()
-    subprocess.run(["git", "-C", directory, "commit", "-m", COMMIT_MESSAGE]).check_returncode()
+    lib.run(["git", "-C", clone_directory, "commit", "-m", COMMIT_MESSAGE]).check_returncode()
 
     if not push:
         return
@@ -383,16 +1032,24 @@ def export(push: bool = False, directory: str | None = None):
         lib.print_error("GITLAB_API_TOKEN is not set, cannot push to remote repository.")
         sys.exit(1)
 
-    subprocess.run(
-        ["git", "-C", directory, "push",
-         f'https://Bot:{GITLAB_API_TOKEN}@{COURSE_PUBLIC_REPO_URL.removeprefix("https://")}']
+    # The token is passed in the environment, so that it never appears in arguments or traces.
+    credentials = base64.b64encode(f"Bot:{GITLAB_API_TOKEN}".encode()).decode()
+    lib.run(
+        ["git", "-C", clone_directory, "push", COURSE_PUBLIC_REPO_URL, "HEAD"],
+        env=os.environ | {
+            "GIT_CONFIG_COUNT": "1",
+            "GIT_CONFIG_KEY_0": "http.extraHeader",
+            "GIT_CONFIG_VALUE_0": f"Authorization: Basic {credentials}",
+        }
     ).check_returncode()
 
+    exported_commit = lib.check_output(["git", "-C", clone_directory, "rev-parse", "HEAD"])
+    _store_export_state(export_directory, {"commit": exported_commit.decode().strip()})
+
 
 @click.command()
 def update_manytask():
     """Update manytask config."""
-
     with open(os.path.join(lib.get_course_directory(), ".manytask.yml")) as file:
         data = file.read()
 
@@ -405,20 +1062,92 @@ def update_manytask():
         "Authorization": f"Bearer {TESTER_TOKEN}",
     }
 
-    requests.post(url=f"{MANYTASK_URL}/update_config",
-                  data=data, headers=headers).raise_for_status()
+    _get_manytask_session().post(url=f"{MANYTASK_URL}/update_config",
+                                 data=data, headers=headers).raise_for_status()
+
+
+@click.group()
+def report():
+    """Manage reports to manytask."""
+
+
+@report.command()
+def flush():
+    """Send reports queued after transient failures."""
+    report_paths = sorted(_get_report_queue_directory().glob("*.json"))
+    if not report_paths:
+        lib.print_info("No queued reports")
+        return
+
+    results = []
+    for report_path in report_paths:
+        try:
+            result = _send_report(json.loads(report_path.read_text()), queue_on_failure=False)
+        except Exception as error:
+            lib.print_error(f"Cannot send the report {report_path.name}: {error!r}")
+            result = "failed"
+
+        # Reports stay queued until they are sent.
+        if result == "sent":
+            report_path.unlink()
+        results.append(result)
+
+    sent = results.count("sent")
+    if sent != len(results):
+        lib.print_error(
+            f"Sent {sent} of {len(results)} reports, the others stay queued in "
+            f"{_get_report_queue_directory()}")
+        sys.exit(1)
+    lib.print_success(f"Sent {sent} reports")
 
 
 @click.command()
-@click.argument("student-repo")
+@click.argument("student-repo", required=False, type=click.Path(exists=True, file_okay=False))
 @click.option("--report", is_flag=True, help="Report scores to manytask.")
-def grade(student_repo: Path, report: bool = False):
+@click.option("--batch", "batch_path", type=click.Path(exists=True, dir_okay=False),
+              help="Grade repositories listed in the file instead, one per line: the path and "
+              "optionally the username to report scores for (the directory name by default).")
+@click.option("--workers", default=1, show_default=True,
+              help="Number of repositories graded concurrently with --batch. Each worker uses "
+              "its own worktree of the course at the current commit.")
+@click.option("--json-output", type=click.Path(dir_okay=False),
+              help="Write grading results as JSON to the file.")
+@click.option("-t", "--task", "tasks", multiple=True,
+              help="Grade the task instead of the ones selected by the git note or the last "
+              "commit. This option can be used multiple times.")
+@click.option("-j", "--jobs", default=1, show_default=True,
+              help="Number of tasks graded concurrently, each in its own worktree of the course.")
+@click.option("--in-place", is_flag=True,
+              help="Grade tasks one by one in the course checkout instead of worktrees.")
+@click.option("--full", is_flag=True,
+              help="Run all checks of a task after a failed one to get the complete list of "
+              "failures. By default grading of the task stops at the first failure.")
+def grade(student_repo: str | None, report: bool = False, batch_path: str | None = None,
+          workers: int = 1, json_output: str | None = None, tasks: tuple[str, ...] = (),
+          jobs: int = 1, in_place: bool = False, full: bool = False):
     """Grade student's tasks."""
-    tasks_to_grade = _try_get_tasks_from_notes(student_repo)
+    json_path = Path(json_output) if json_output else None
+
+    if (student_repo is None) == (batch_path is None):
+        lib.print_error("Specify either a student repository or --batch")
+        sys.exit(1)
+
+    reports = _Reports() if report else None
+
+    if batch_path:
+        start = time.perf_counter()
+        results = _grade_batch(_load_batch(Path(batch_path)), workers, reports, full)
+        _write_json(json_path, {"wall_time": time.perf_counter() - start, "repos": results})
+        _print_batch_results(results)
+        reports_sent = not reports or reports.wait()
+        sys.exit(int(not reports_sent or any(result["exit_code"] != 0 for result in results)))
+
+    tasks_to_grade = list(tasks) or _try_get_tasks_from_notes(student_repo)
     if not tasks_to_grade:
         tasks_to_grade = _try_get_tasks_from_diff(student_repo)
 
     if not tasks_to_grade:
+        _write_json(json_path, {"tasks": [], "failed_checks": []})
         lib.print_info("Nothing to grade")
         return
 
@@ -430,46 +1159,142 @@ def grade(student_repo: Path, report: bool = False):
         info_text.append(f"[cyan] - {task}")
     lib.print_info(info_text)
 
-    failed_tasks = []
+    if in_place:
+        failed_tasks = []
+        for task_name in tasks_to_grade:
+            current_failed_tasks = _grade_task(task_name, student_repo, full)
+            if reports:
+                reports.send_passed([task_name], current_failed_tasks)
+            failed_tasks += current_failed_tasks
+    else:
+        failed_tasks = _grade_tasks_in_slots(tasks_to_grade, student_repo, jobs, reports, full)
+
+    _write_json(json_path, {"tasks": tasks_to_grade, "failed_checks": failed_tasks})
+    if reports and not reports.wait():
+        sys.exit(1)
+    lib.print_failed_checks_and_exit(failed_tasks)
 
-    for task_name in tasks_to_grade:
-        current_failed_tasks = _grade_task(task_name, student_repo)
-        if not current_failed_tasks and report:
-            _report_task(task_name)
 
-        failed_tasks += current_failed_tasks
+################################################################################
 
-    lib.print_failed_checks_and_exit(failed_tasks)
 
+class _RateLimiter:
+    """Spaces calls of wait() from all threads at least 1 / rate seconds apart."""
+
+    def __init__(self, rate: float):
+        self._interval = 1 / rate
+        self._next_call = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_call - now
+            self._next_call = max(now, self._next_call) + self._interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, delay: float):
+        """Delays calls of wait() from all threads for at least delay seconds from now."""
+        with self._lock:
+            self._next_call = max(self._next_call, time.monotonic() + delay)
+
+
+def _update_student_projects(attributes: dict, dry_run: bool, workers: int, rate: float):
+    """
+    Sets the attributes of all projects in the students group. Projects which already have these
+    values according to the group project list are skipped, the others are updated concurrently
+    without fetching them first. Updates failed with 429, 5xx or network errors are retried within
+    the rate limit, and each failure pauses all updates.
+    """
+    import requests
+    import tqdm
+    from gitlab import Gitlab
+    from gitlab.exceptions import GitlabError
+
+    gl = Gitlab(url=GITLAB_URL, oauth_token=GITLAB_API_TOKEN, retry_transient_errors=True)
+    gl.auth()
+    group = gl.groups.get(COURSE_STUDENTS_GROUP, lazy=True)
+    projects = group.projects.list(all=True)
 
-################################################################################
+    outdated_projects = [
+        project for project in projects
+        if any(getattr(project, name, None) != value for name, value in attributes.items())
+    ]
+
+    info_text = Renderables()
+    info_text.append(f"{len(outdated_projects)} of {len(projects)} projects need to be updated")
+    if dry_run:
+        for project in outdated_projects:
+            info_text.append(f" - {project.path_with_namespace}")
+    lib.print_info(info_text)
+
+    if dry_run or not outdated_projects:
+        return
+
+    rate_limiter = _RateLimiter(rate)
+
+    def update_project(project):
+        for attempt in range(1, GITLAB_UPDATE_ATTEMPTS + 1):
+            rate_limiter.wait()
+            try:
+                # The client would retry on its own, bypassing the rate limiter.
+                gl.projects.update(project.id, attributes,
+                                   obey_rate_limit=False, retry_transient_errors=False)
+                return
+            except GitlabError as error:
+                if (error.response_code not in GITLAB_TRANSIENT_STATUS_CODES or
+                        attempt == GITLAB_UPDATE_ATTEMPTS):
+                    raise
+            except requests.RequestException:
+                if attempt == GITLAB_UPDATE_ATTEMPTS:
+                    raise
+            rate_limiter.pause(GITLAB_RETRY_DELAY * 2 ** (attempt - 1))
+
+    failed_projects = []
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            tqdm.tqdm(total=len(outdated_projects)) as progress:
+        futures = {
+            executor.submit(update_project, project): project for project in outdated_projects
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (GitlabError, requests.RequestException) as error:
+                failed_projects.append(f"{futures[future].path_with_namespace}: {error}")
+            progress.update()
+
+    if failed_projects:
+        lib.print_error(
+            "Failed to update the following projects:\n" +
+            "\n".join(f" - {project}" for project in failed_projects))
+        sys.exit(1)
+
+
+def _bulk_update_options(function):
+    function = click.option("--dry-run", is_flag=True,
+                            help="Only print projects which need to be updated.")(function)
+    function = click.option("--workers", default=8, show_default=True,
+                            help="Number of concurrent updates.")(function)
+    function = click.option("--rate", default=10.0, show_default=True,
+                            help="Maximum number of updates per second.")(function)
+    return function
 
 
 @click.command()
-def fix_ci_config_path():
+@_bulk_update_options
+def fix_ci_config_path(dry_run: bool, workers: int, rate: float):
     """Fix CI config path in student's repositories."""
-    gl = Gitlab(url=GITLAB_URL, oauth_token=GITLAB_API_TOKEN)
-    gl.auth()
-    group = gl.groups.get(COURSE_STUDENTS_GROUP)
-    repositories = group.projects.list(all=True)
-    for repo in tqdm.tqdm(repositories):
-        project = gl.projects.get(repo.id)
-        project.ci_config_path = f".gitlab-ci.yml@{COURSE_PUBLIC_REPO}"
-        project.save()
+    _update_student_projects(
+        {"ci_config_path": f".gitlab-ci.yml@{COURSE_PUBLIC_REPO}"}, dry_run, workers, rate)
 
 
 @click.command()
 @click.argument("timeout", default=3600)
-def fix_ci_config_timeout(timeout: int):
+@_bulk_update_options
+def fix_ci_config_timeout(timeout: int, dry_run: bool, workers: int, rate: float):
     """Fix CI default timeout in student's repositories."""
-    gl = Gitlab(url=GITLAB_URL, oauth_token=GITLAB_API_TOKEN)
-    gl.auth()
-    group = gl.groups.get(COURSE_STUDENTS_GROUP)
-    repositories = group.projects.list(all=True)
-    for repo in tqdm.tqdm(repositories):
-        project = gl.projects.get(repo.id)
-        project.build_timeout = timeout
-        project.save()
+    _update_student_projects({"build_timeout": timeout}, dry_run, workers, rate)
 
 
 @click.command()
@@ -0,0 +1,95 @@
+import http.server
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import pytest
+
+from pathlib import Path
+
+
+# The cli reads its environment when it is imported, so the tests run in a temporary course
+# repository prepared before the test modules are collected.
+
+CONFIG = """cpp_default_profile: release
+
+gitlab_url: https://gitlab.example.com
+course_public_repo: public
+course_students_group: students
+manytask_url: https://manytask.example.com
+"""
+
+COURSE_DIRECTORY = Path(tempfile.mkdtemp(prefix="cli-tests-")).resolve()
+
+(COURSE_DIRECTORY / "config.yml").write_text(CONFIG)
+subprocess.run(["git", "init", "--quiet", COURSE_DIRECTORY], check=True)
+
+os.environ.update({
+    "SYSTEM": "x86_64-linux",
+    "CONFIG_PATH": str(COURSE_DIRECTORY / "config.yml"),
+    "VERSION_BUILD": "0.0.0",
+    "ASAN_SYMBOLIZER_PATH": "/bin/true",
+    "TSAN_SYMBOLIZER_PATH": "/bin/true",
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+
+@pytest.fixture(autouse=True)
+def course_directory(monkeypatch) -> Path:
+    """Commands of the cli find the course by the current directory."""
+    monkeypatch.chdir(COURSE_DIRECTORY)
+    return COURSE_DIRECTORY
+
+
+class Server:
+    """
+    Local HTTP server answering requests with the queued responses, the last one is repeated,
+    unless respond is replaced. Responses are (status, json body) pairs, received requests are
+    (method, path, body) tuples.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.responses = [(200, {})]
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def respond(self, method: str, path: str, body: bytes) -> tuple[int, object]:
+        with self._lock:
+            return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+
+@pytest.fixture
+def server():
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def _respond(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            state.requests.append((self.command, self.path, body))
+            status, content = state.respond(self.command, self.path, body)
+            content = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = do_POST = do_PUT = _respond
+
+        def log_message(self, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    state = Server(f"http://127.0.0.1:{httpd.server_address[1]}")
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def pytest_sessionfinish():
+    shutil.rmtree(COURSE_DIRECTORY, ignore_errors=True)
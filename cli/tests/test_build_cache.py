@@ -0,0 +1,51 @@
+import io
+import json
+import tarfile
+
+import build_cache
+import pytest
+
+from click.testing import CliRunner
+from pathlib import Path
+
+
+def _write_archive(archive: Path, paths: list[str], files: dict[str, bytes]):
+    manifest = json.dumps({
+        "version_build": build_cache.VERSION_BUILD,
+        "course_directory": "/nonexistent/course",
+        "paths": paths,
+        "files": {},
+    }).encode()
+    with tarfile.open(archive, "w:gz") as tar:
+        for name, content in {build_cache.MANIFEST_NAME: manifest, **files}.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+
+
+@pytest.mark.parametrize("path", ["..", "../outside", "/tmp", "build", "src", "build/../src"])
+def test_import_rejects_paths_outside_of_build_directories(course_directory, tmp_path, path):
+    kept = course_directory / "src" / "main.cpp"
+    kept.parent.mkdir(exist_ok=True)
+    kept.write_text("int main() {}\n")
+    archive = tmp_path / "snapshot.tar.gz"
+    _write_archive(archive, [path], {})
+
+    result = CliRunner().invoke(build_cache.import_cache, [str(archive)])
+
+    assert result.exit_code == 1
+    assert kept.read_text() == "int main() {}\n"
+
+
+def test_import_extracts_only_snapshot_paths(course_directory, tmp_path):
+    archive = tmp_path / "snapshot.tar.gz"
+    _write_archive(archive, [".cache/go"], {
+        ".cache/go/entry": b"cached",
+        "config.yml": b"overwritten",
+    })
+
+    result = CliRunner().invoke(build_cache.import_cache, [str(archive)])
+
+    assert result.exit_code == 0, result.output
+    assert (course_directory / ".cache" / "go" / "entry").read_bytes() == b"cached"
+    assert (course_directory / "config.yml").read_bytes() != b"overwritten"
@@ -0,0 +1,31 @@
+import lib
+
+
+def _passed() -> bool:
+    return True
+
+
+def _failed() -> bool:
+    return False
+
+
+def test_checks_depending_on_failed_step_fail():
+    steps = [
+        lib.Step(key="cpp.build.x.debug", function=_failed),
+        lib.Step(key="t#cpp.test.x.debug", function=_passed,
+                 dependencies=["cpp.build.x.debug"], check_name="t#cpp.test.x.debug"),
+    ]
+
+    for fail_fast in [False, True]:
+        assert lib.execute_steps(steps, fail_fast=fail_fast, use_cache=False) == \
+            ["t#cpp.test.x.debug"]
+
+
+def test_fail_fast_reports_checks_not_run_as_failed():
+    steps = [
+        lib.Step(key="t#first", function=_failed, check_name="t#first"),
+        lib.Step(key="t#second", function=_passed, check_name="t#second"),
+    ]
+
+    assert lib.execute_steps(steps, fail_fast=True, use_cache=False) == ["t#first", "t#second"]
+    assert lib.execute_steps(steps, fail_fast=False, use_cache=False) == ["t#first"]
@@ -0,0 +1,185 @@
+import json
+import shutil
+import time
+import urllib.parse
+
+import private
+import pytest
+import requests
+
+from click.testing import CliRunner
+
+
+REPORT = {"task": "hello", "username": "alice", "check_deadline": True, "submit_time": None}
+
+
+@pytest.fixture
+def manytask(monkeypatch, server):
+    # Retries of the session would only slow the tests down, the queue is tested instead.
+    monkeypatch.setattr(private, "MANYTASK_URL", server.url)
+    monkeypatch.setattr(private, "_get_manytask_session", requests.Session)
+    yield server
+    for report_path in private._get_report_queue_directory().glob("*.json"):
+        report_path.unlink()
+
+
+def _get_queued_reports() -> list[dict]:
+    return [json.loads(path.read_text())
+            for path in sorted(private._get_report_queue_directory().glob("*.json"))]
+
+
+def _get_sent_tasks(server) -> list[str]:
+    return [urllib.parse.parse_qs(body.decode())["task"][0]
+            for method, path, body in server.requests if path == "/report"]
+
+
+def test_report_failed_with_server_error_is_queued_and_flushed(manytask):
+    manytask.responses = [(503, {}), (200, {"score": 1})]
+
+    assert private._send_report(REPORT) == "queued"
+    assert _get_queued_reports() == [REPORT]
+
+    result = CliRunner().invoke(private.flush)
+
+    assert result.exit_code == 0, result.output
+    assert _get_sent_tasks(manytask) == ["hello", "hello"]
+    assert _get_queued_reports() == []
+
+
+def test_flush_keeps_reports_which_still_fail(manytask):
+    manytask.responses = [(502, {})]
+    assert private._send_report(REPORT) == "queued"
+    assert private._send_report(REPORT | {"task": "world"}) == "queued"
+
+    result = CliRunner().invoke(private.flush)
+
+    assert result.exit_code == 1
+    assert len(_get_queued_reports()) == 2
+
+    manytask.responses = [(200, {"score": 1})]
+    result = CliRunner().invoke(private.flush)
+
+    assert result.exit_code == 0, result.output
+    assert _get_sent_tasks(manytask)[-2:] == ["hello", "world"]
+    assert _get_queued_reports() == []
+
+
+def test_report_rejected_by_server_is_not_queued(manytask):
+    manytask.responses = [(403, {"error": "deadline"})]
+
+    assert private._send_report(REPORT) == "failed"
+    assert _get_queued_reports() == []
+
+
+CI_CONFIG_PATH = f".gitlab-ci.yml@{private.COURSE_PUBLIC_REPO}"
+
+
+@pytest.fixture
+def gitlab(monkeypatch, server):
+    """GitLab stand-in with the students group of three projects, one of them up to date."""
+    monkeypatch.setattr(private, "GITLAB_URL", server.url)
+    monkeypatch.setattr(private, "GITLAB_RETRY_DELAY", 0.05)
+    server.projects = [
+        {"id": 1, "path_with_namespace": "students/alice", "ci_config_path": ""},
+        {"id": 2, "path_with_namespace": "students/bob", "ci_config_path": CI_CONFIG_PATH},
+        {"id": 3, "path_with_namespace": "students/carol", "ci_config_path": ".gitlab-ci.yml"},
+    ]
+    # Responses to updates of the projects by their ids, the last one is repeated.
+    server.updates = {}
+    server.update_times = []
+
+    def respond(method: str, path: str, body: bytes):
+        if path.startswith("/api/v4/user"):
+            return 200, {"id": 1, "username": "tester"}
+        if path.startswith(f"/api/v4/groups/{private.COURSE_STUDENTS_GROUP}/projects"):
+            return 200, server.projects
+        if method == "PUT" and path.startswith("/api/v4/projects/"):
+            server.update_times.append(time.monotonic())
+            responses = server.updates.setdefault(int(path.rsplit("/", 1)[1]), [(200, {})])
+            status, content = responses.pop(0) if len(responses) > 1 else responses[0]
+            return status, content or {"id": int(path.rsplit("/", 1)[1])}
+        return 404, {"message": "404 Not Found"}
+
+    server.respond = respond
+    return server
+
+
+def _get_updated_projects(server) -> list[str]:
+    return sorted(path for method, path, body in server.requests if method == "PUT")
+
+
+def test_update_skips_projects_which_are_up_to_date(gitlab):
+    private._update_student_projects(
+        {"ci_config_path": CI_CONFIG_PATH}, dry_run=False, workers=4, rate=100)
+
+    assert _get_updated_projects(gitlab) == ["/api/v4/projects/1", "/api/v4/projects/3"]
+
+
+def test_update_dry_run_does_not_update_projects(gitlab):
+    private._update_student_projects(
+        {"ci_config_path": CI_CONFIG_PATH}, dry_run=True, workers=4, rate=100)
+
+    assert _get_updated_projects(gitlab) == []
+
+
+def test_update_is_rate_limited(gitlab):
+    gitlab.projects = [
+        {"id": index, "path_with_namespace": f"students/{index}", "ci_config_path": ""}
+        for index in range(1, 7)
+    ]
+
+    private._update_student_projects(
+        {"ci_config_path": CI_CONFIG_PATH}, dry_run=False, workers=6, rate=20)
+
+    assert len(gitlab.update_times) == 6
+    # Updates are spaced 50ms apart, the first one is not delayed.
+    assert gitlab.update_times[-1] - gitlab.update_times[0] >= 5 * 0.05 * 0.9
+
+
+def test_update_retries_transient_errors(gitlab):
+    gitlab.updates[1] = [(429, {"message": "Too Many Requests"}), (502, {}), (200, {})]
+
+    private._update_student_projects(
+        {"ci_config_path": CI_CONFIG_PATH}, dry_run=False, workers=4, rate=100)
+
+    assert _get_updated_projects(gitlab).count("/api/v4/projects/1") == 3
+    assert gitlab.updates[1] == [(200, {})]
+
+
+def test_update_reports_projects_which_failed(gitlab):
+    gitlab.updates[1] = [(403, {"message": "403 Forbidden"})]
+    gitlab.updates[3] = [(503, {})]
+
+    with pytest.raises(SystemExit) as exit_info:
+        private._update_student_projects(
+            {"ci_config_path": CI_CONFIG_PATH}, dry_run=False, workers=4, rate=100)
+
+    assert exit_info.value.code == 1
+    # Forbidden updates are not retried, server errors are retried until attempts run out.
+    updated_projects = _get_updated_projects(gitlab)
+    assert updated_projects.count("/api/v4/projects/1") == 1
+    assert updated_projects.count("/api/v4/projects/3") == private.GITLAB_UPDATE_ATTEMPTS
+
+
+@pytest.mark.parametrize("count", [3, private.EXPORT_CHUNK_SIZE * 2])
+def test_find_files_with_solution(course_directory, count):
+    directory = course_directory / "solutions"
+    directory.mkdir()
+    for index in range(count):
+        content = "int x;\n"
+        if index % 2:
+            content += "// SOLUTION " "BEGIN\nint y;\n// SOLUTION " "END\n"
+        (directory / f"{index}.cpp").write_text(content)
+    (directory / "marker_only.cpp").write_text("// SOLUTION " "BEGIN\n")
+    (course_directory / "build").mkdir(exist_ok=True)
+    (course_directory / "build" / "1.cpp").write_bytes((directory / "1.cpp").read_bytes())
+
+    try:
+        expected = {directory / f"{index}.cpp" for index in range(1, count, 2)}
+        assert private._find_files_with_solution() == expected
+
+        # Cached results are used for unchanged files, changed ones are scanned again.
+        (directory / "0.cpp").write_text("// SOLUTION " "BEGIN\n// SOLUTION " "END\n")
+        assert private._find_files_with_solution() == expected | {directory / "0.cpp"}
+    finally:
+        shutil.rmtree(directory)